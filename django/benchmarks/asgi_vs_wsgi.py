@@ -0,0 +1,145 @@
+"""
+Compares cache-miss throughput of the sync view under gunicorn (WSGI) with the async
+view under uvicorn (ASGI).
+
+Both servers run the benchmark settings against the fake upstream, with the same number
+of worker processes. Every request asks for a different book, so every request is a miss
+that waits on the upstream's latency.
+Run it from the django directory with:
+
+    python -m benchmarks.asgi_vs_wsgi --workers 2 --concurrency 500 --requests 5000 \\
+        --latency 0.1
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import time
+
+import aiohttp
+
+from benchmarks.fake_upstream import free_port, spawn, wait_for_port
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def run_load(base_url, concurrency, total, first_id):
+    """
+    Sends `total` GET requests for distinct books, `concurrency` at a time.
+
+    Returns:
+        dict: Throughput, latency percentiles (in milliseconds) and error count.
+    """
+    latencies = []
+    errors = 0
+    ids = iter(range(first_id, first_id + total))
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=60)
+
+    async with aiohttp.ClientSession(
+        base_url, connector=connector, timeout=timeout
+    ) as client:
+
+        async def worker():
+            nonlocal errors
+            for book_id in ids:
+                start = time.perf_counter()
+                try:
+                    async with client.get(f"/api/book/{book_id}") as response:
+                        await response.read()
+                        if response.status != 200:
+                            errors += 1
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "requests": total,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "rps": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+    }
+
+
+def start_server(mode, port, workers, env):
+    if mode == "wsgi":
+        command = [
+            "gunicorn",
+            "-c",
+            "config/gunicorn.py",
+            "config.wsgi:application",
+            "--bind",
+            f"127.0.0.1:{port}",
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+        ]
+    else:
+        command = [
+            "uvicorn",
+            "config.asgi:application",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+            "--no-access-log",
+        ]
+    return subprocess.Popen(command, env=env)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument(
+        "--latency", type=float, default=0.1, help="Fake upstream latency in seconds."
+    )
+    args = parser.parse_args()
+
+    results = {}
+    with spawn(latency=args.latency) as upstream_url:
+        for index, mode in enumerate(("wsgi", "asgi")):
+            port = free_port()
+            env = dict(
+                os.environ,
+                DJANGO_SETTINGS_MODULE="benchmarks.settings",
+                TAAGHCHE_API_URL=upstream_url,
+                BOOK_ASYNC_VIEW="1" if mode == "asgi" else "0",
+            )
+            server = start_server(mode, port, args.workers, env)
+            try:
+                wait_for_port(port)
+                results[mode] = asyncio.run(
+                    run_load(
+                        f"http://127.0.0.1:{port}",
+                        args.concurrency,
+                        args.requests,
+                        first_id=1 + index * args.requests,
+                    )
+                )
+            finally:
+                server.terminate()
+                server.wait()
+
+    print(json.dumps({"settings": vars(args), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
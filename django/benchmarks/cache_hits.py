@@ -0,0 +1,91 @@
+"""
+Measures the throughput of cache hits on the book endpoint, tier by tier.
+
+Each tier is benchmarked alone, with book data stored as Python objects and then as
+pre-rendered JSON (BOOK_RENDERED_ENTRIES), by calling the view in-process, so that only
+the cache and rendering work is timed. Set BENCH_REDIS_URL to measure a real Redis tier.
+Run it from the django directory with:
+
+    BENCH_REDIS_URL=redis://localhost:6379/1 python -m benchmarks.cache_hits \\
+        --requests 20000 --size 8192
+"""
+
+import argparse
+import json
+import os
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.cache import caches  # noqa: E402
+from django.test import RequestFactory  # noqa: E402
+
+from benchmarks.fake_upstream import make_book  # noqa: E402
+from books import entries  # noqa: E402
+from books.views import GetBookData  # noqa: E402
+
+
+def measure(view, requests, books):
+    """
+    Sends `requests` GET requests to the view, cycling over `books` book IDs.
+
+    Returns:
+        dict: Throughput and mean latency (in microseconds).
+    """
+    factory = RequestFactory()
+    paths = [
+        (book_id, factory.get(f"/api/book/{book_id}"))
+        for book_id in range(1, books + 1)
+    ]
+    start = time.perf_counter()
+    for index in range(requests):
+        book_id, request = paths[index % books]
+        response = view(request, book_id=book_id)
+        assert response.status_code == 200 and response["data-origin"] != "upstream"
+    elapsed = time.perf_counter() - start
+    return {
+        "rps": round(requests / elapsed),
+        "mean_us": round(elapsed / requests * 1e6, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--books", type=int, default=100)
+    parser.add_argument(
+        "--size", type=int, default=8192, help="Book payload size in bytes."
+    )
+    args = parser.parse_args()
+
+    view = GetBookData.as_view()
+    all_caches = settings.CACHES
+    for cache_name in all_caches:
+        caches[cache_name]  # Opens every tier before settings.CACHES is narrowed down.
+    results = {}
+    for cache_name in all_caches:
+        # Only this tier is looked up, so every request is a hit from it.
+        settings.CACHES = {cache_name: all_caches[cache_name]}
+        results[cache_name] = {}
+        for mode, rendered in (("objects", False), ("rendered", True)):
+            settings.BOOK_RENDERED_ENTRIES = rendered
+            caches[cache_name].set_many(
+                {
+                    book_id: entries.wrap(make_book(book_id, args.size))
+                    for book_id in range(1, args.books + 1)
+                }
+            )
+            measure(view, min(1000, args.requests), args.books)  # Warm-up
+            results[cache_name][mode] = measure(view, args.requests, args.books)
+        caches[cache_name].clear()
+    settings.CACHES = all_caches
+
+    print(json.dumps({"settings": vars(args), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Reports the memory saved and the CPU spent by each compressor codec of the Redis tier.
+
+Book entries are generated like the fake upstream's, with descriptions made of random
+words so that they do not compress unrealistically well, and serialized like
+django-redis does. For each codec, the report gives the stored size (and its
+extrapolation to a million books), and the time to compress a value on a fill and to
+decompress and unpickle it on a hit. With --redis, the values are also written to Redis
+and its memory usage is measured. Run it from the django directory with:
+
+    python -m benchmarks.compression --books 5000 --redis redis://localhost:6379/15 \\
+        --save-dictionary books.dict
+"""
+
+import argparse
+import json
+import os
+import pickle
+import random
+import tempfile
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+django.setup()
+
+import redis  # noqa: E402
+
+from benchmarks.fake_upstream import make_book  # noqa: E402
+from books import entries  # noqa: E402
+from books.compressors import BookCompressor, train_dictionary  # noqa: E402
+
+WORDS = (
+    "کتاب داستان رمان نویسنده زندگی ایران تاریخ شعر عشق جهان "
+    "انسان جنگ سفر خانواده کودک "
+    "the of and story novel life world history love war family "
+    "child journey author book"
+).split()
+
+
+def sample_entries(count, first_id, rng):
+    values = []
+    for book_id in range(first_id, first_id + count):
+        data = make_book(book_id, size=0)
+        data["book"]["description"] = " ".join(
+            rng.choices(WORDS, k=rng.randint(100, 1500))
+        )
+        values.append(pickle.dumps(entries.wrap(data), pickle.HIGHEST_PROTOCOL))
+    return values
+
+
+def redis_memory(url, values):
+    """
+    Writes the values to an empty Redis database and returns the memory they use, in
+    bytes.
+    """
+    client = redis.Redis.from_url(url)
+    client.flushdb()
+    before = client.info("memory")["used_memory"]
+    pipeline = client.pipeline(transaction=False)
+    for index, value in enumerate(values):
+        pipeline.set(f"bench:{index}", value)
+    pipeline.execute()
+    used = client.info("memory")["used_memory"] - before
+    client.flushdb()
+    return used
+
+
+def measure(compressor, values, redis_url):
+    start = time.perf_counter()
+    stored = [compressor.compress(value) for value in values]
+    compress_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for value in stored:
+        try:
+            value = compressor.decompress(value)
+        except Exception:
+            pass
+        pickle.loads(value)
+    hit_time = time.perf_counter() - start
+
+    size = sum(len(value) for value in stored)
+    result = {
+        "mean_bytes": round(size / len(values)),
+        "mb_per_million_books": round(size / len(values) * 1e6 / 2**20),
+        "fill_us": round(compress_time / len(values) * 1e6, 1),
+        "hit_us": round(hit_time / len(values) * 1e6, 1),
+    }
+    if redis_url:
+        used = redis_memory(redis_url, stored)
+        result["redis_mb_per_million_books"] = round(used / len(values) * 1e6 / 2**20)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--books", type=int, default=5000)
+    parser.add_argument("--min-size", type=int, default=1024)
+    parser.add_argument(
+        "--redis", help="URL of a scratch Redis database; it is flushed."
+    )
+    parser.add_argument(
+        "--save-dictionary", help="Where to save the trained zstd dictionary."
+    )
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    training = sample_entries(2000, first_id=10**6, rng=rng)
+    values = sample_entries(args.books, first_id=1, rng=rng)
+
+    dictionary_path = args.save_dictionary or tempfile.mkstemp(suffix=".dict")[1]
+    with open(dictionary_path, "wb") as dictionary_file:
+        dictionary_file.write(train_dictionary(training))
+
+    codecs = {
+        "none": {"COMPRESSOR_CODEC": "none"},
+        "zlib": {"COMPRESSOR_CODEC": "zlib"},
+        "zstd": {"COMPRESSOR_CODEC": "zstd"},
+        "zstd+dictionary": {
+            "COMPRESSOR_CODEC": "zstd",
+            "ZSTD_DICTIONARY": dictionary_path,
+        },
+    }
+    results = {}
+    for name, options in codecs.items():
+        compressor = BookCompressor(dict(options, COMPRESS_MIN_SIZE=args.min_size))
+        results[name] = measure(compressor, values, args.redis)
+
+    if not args.save_dictionary:
+        os.remove(dictionary_path)
+    print(json.dumps({"settings": vars(args), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
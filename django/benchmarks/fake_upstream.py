@@ -0,0 +1,243 @@
+"""
+A local stand-in for the Taaghche API, for benchmarks.
+
+It answers `GET /v2/book/<id>/` with a generated payload after a configurable delay
+(longer for a configurable share of requests, to produce a latency tail), or with a 500
+error for a configurable share of requests, and `GET /__stats` with the number of book
+requests it has served and how many of them failed. Run it with:
+
+    python -m benchmarks.fake_upstream --port 8100 --latency 0.1 --error-rate 0.01 \\
+        --slow-rate 0.05 --slow-latency 1
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import random
+import socket
+import subprocess
+import sys
+import time
+
+
+def make_book(book_id, size):
+    """
+    Builds a book payload shaped like the Taaghche API's.
+
+    Args:
+        book_id (int): The book ID.
+        size (int): The approximate size of the encoded payload, in bytes.
+
+    Returns:
+        dict: The payload.
+    """
+    book = {
+        "id": book_id,
+        "title": f"کتاب شماره {book_id}",
+        "authors": [
+            {"id": book_id % 97, "firstName": "نویسنده", "lastName": str(book_id)}
+        ],
+        "publisher": "نشر نمونه",
+        "coverUri": f"https://images.taaghche.com/frontCover/{book_id}.jpg",
+        "price": (book_id % 50) * 10000,
+        "rating": 4.2,
+        "categories": [{"id": 1, "title": "رمان"}],
+        "description": "",
+    }
+    padding = max(
+        0, size - len(json.dumps({"book": book}, ensure_ascii=False).encode())
+    )
+    # Persian text takes two bytes per character in UTF-8.
+    book["description"] = ("این یک متن نمونه است. " * (padding // 38 + 1))[
+        : padding // 2
+    ]
+    return {"book": book, "bookFiles": [], "comments": []}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing is listening on port {port} after {timeout}s")
+
+
+@contextlib.contextmanager
+def spawn(
+    latency=0.0, size=8192, error_rate=0.0, seed=None, slow_rate=0.0, slow_latency=0.0
+):
+    """
+    Runs the fake upstream in a child process, so that it does not compete with the
+    measured code for the GIL.
+
+    Args:
+        latency (float, optional): Seconds to wait before answering. Defaults to 0.
+        size (int, optional): Approximate payload size in bytes. Defaults to 8192.
+        error_rate (float, optional): The share of book requests answered with a 500
+            error. Defaults to 0.
+        seed (int, optional): Seed of the random errors, to repeat a run exactly.
+            Defaults to None.
+        slow_rate (float, optional): The share of book requests answered after
+            `slow_latency`. Defaults to 0.
+        slow_latency (float, optional): Seconds to wait before answering the slow
+            requests. Defaults to 0.
+
+    Yields:
+        str: The base URL of the server.
+    """
+    port = free_port()
+    command = [
+        sys.executable,
+        "-m",
+        "benchmarks.fake_upstream",
+        "--port",
+        str(port),
+        "--latency",
+        str(latency),
+        "--size",
+        str(size),
+        "--error-rate",
+        str(error_rate),
+        "--slow-rate",
+        str(slow_rate),
+        "--slow-latency",
+        str(slow_latency),
+    ]
+    if seed is not None:
+        command += ["--seed", str(seed)]
+    process = subprocess.Popen(command)
+    try:
+        wait_for_port(port)
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        process.terminate()
+        process.wait()
+
+
+class FakeUpstream:
+    """
+    A minimal asyncio HTTP/1.1 server with keep-alive, serving generated book payloads.
+    """
+
+    def __init__(
+        self,
+        latency=0.0,
+        size=8192,
+        error_rate=0.0,
+        seed=None,
+        slow_rate=0.0,
+        slow_latency=0.0,
+    ):
+        self.latency = latency
+        self.size = size
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.random = random.Random(seed)
+        self.book_requests = 0
+        self.failed_requests = 0
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                while (await reader.readline()) not in (b"\r\n", b""):
+                    pass
+                path = request_line.split()[1].decode()
+                status, body = await self.respond(path)
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+                )
+                await writer.drain()
+        except (ConnectionError, IndexError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, path):
+        if path == "/__stats":
+            stats = {
+                "book_requests": self.book_requests,
+                "failed_requests": self.failed_requests,
+            }
+            return "200 OK", json.dumps(stats).encode()
+
+        parts = path.strip("/").split("/")
+        if len(parts) != 3 or parts[:2] != ["v2", "book"] or not parts[2].isdigit():
+            return "404 Not Found", b'{"error": "not found"}'
+
+        self.book_requests += 1
+        if self.slow_rate and self.random.random() < self.slow_rate:
+            await asyncio.sleep(self.slow_latency)
+        elif self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.failed_requests += 1
+            return "500 Internal Server Error", b'{"error": "internal error"}'
+        payload = make_book(int(parts[2]), self.size)
+        return "200 OK", json.dumps(payload, ensure_ascii=False).encode()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port, backlog=4096)
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds to wait before answering."
+    )
+    parser.add_argument(
+        "--size", type=int, default=8192, help="Approximate payload size in bytes."
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Share of requests answered with a 500.",
+    )
+    parser.add_argument(
+        "--seed", type=int, help="Seed of the random errors and slow requests."
+    )
+    parser.add_argument(
+        "--slow-rate",
+        type=float,
+        default=0.0,
+        help="Share of requests answered after --slow-latency.",
+    )
+    parser.add_argument(
+        "--slow-latency",
+        type=float,
+        default=0.0,
+        help="Seconds to answer the slow requests in.",
+    )
+    args = parser.parse_args()
+    upstream = FakeUpstream(
+        args.latency,
+        args.size,
+        args.error_rate,
+        args.seed,
+        args.slow_rate,
+        args.slow_latency,
+    )
+    asyncio.run(upstream.serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
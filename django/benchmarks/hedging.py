@@ -0,0 +1,131 @@
+"""
+Measures the latency of book requests to a Taaghche API with a latency tail, plain,
+hedged, and hedged with a deadline.
+
+A fake upstream answers most requests after `--latency` seconds and a share
+`--slow-rate` of them after `--slow-latency` seconds. `--concurrency` threads send
+`--requests` book requests through the shared UpstreamClient, for each mode: `plain`
+(UpstreamClient.get, as before hedging), `hedged` (get_within with a generous deadline)
+and `deadline` (get_within with `--deadline`). The report gives the latency percentiles
+of the answers, the requests that timed out, and how many requests reached the API per
+book request: the cost of hedging. The hedge delay starts at UPSTREAM_HEDGE_DELAY and
+adapts to the latencies seen. Run it from the django
+directory with:
+
+    python -m benchmarks.hedging --requests 2000 --concurrency 8 --latency 0.02 \\
+        --slow-rate 0.03 --slow-latency 0.5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+import requests
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+django.setup()
+
+from django.test import override_settings  # noqa: E402
+
+from benchmarks import fake_upstream  # noqa: E402
+from books import upstream  # noqa: E402
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run(mode, args, base_url):
+    """
+    Sends the book requests of one mode.
+
+    Returns:
+        dict: Latency percentiles in milliseconds, timeouts, and upstream requests per
+        book request.
+    """
+    upstream._clients.clear()
+    upstream._latencies.clear()
+    client = upstream.get_client()
+    before = requests.get(f"{base_url}/__stats").json()["book_requests"]
+
+    def fetch(book_id):
+        start = time.monotonic()
+        try:
+            if mode == "plain":
+                client.get(f"/v2/book/{book_id}/")
+            else:
+                deadline = args.deadline if mode == "deadline" else 60
+                client.get_within(f"/v2/book/{book_id}/", start + deadline)
+        except upstream.UpstreamTimeout:
+            return None
+        return time.monotonic() - start
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        latencies = list(executor.map(fetch, range(1, args.requests + 1)))
+    # Lets the abandoned attempts finish, so that they are counted.
+    time.sleep(args.slow_latency)
+    sent = requests.get(f"{base_url}/__stats").json()["book_requests"] - before
+    answered = sorted(latency for latency in latencies if latency is not None)
+    return {
+        "p50_ms": round(percentile(answered, 0.5) * 1000, 1),
+        "p95_ms": round(percentile(answered, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(answered, 0.99) * 1000, 1),
+        "max_ms": round(answered[-1] * 1000, 1),
+        "mean_ms": round(statistics.mean(answered) * 1000, 1),
+        "timeouts": len(latencies) - len(answered),
+        "upstream_requests_per_request": round(sent / args.requests, 3),
+        "hedging": client.latency.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="Seconds the API takes to answer."
+    )
+    parser.add_argument(
+        "--slow-rate",
+        type=float,
+        default=0.03,
+        help="Share of requests answered slowly.",
+    )
+    parser.add_argument(
+        "--slow-latency",
+        type=float,
+        default=0.5,
+        help="Seconds the slow requests take.",
+    )
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        default=0.2,
+        help="Latency budget of the deadline mode.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = {}
+    with fake_upstream.spawn(
+        args.latency,
+        seed=args.seed,
+        slow_rate=args.slow_rate,
+        slow_latency=args.slow_latency,
+    ) as base_url:
+        with override_settings(
+            TAAGHCHE_API_URL=base_url,
+            UPSTREAM_GUARD_CACHE="",
+            UPSTREAM_POOL_SIZE=2 * args.concurrency,
+        ):
+            for mode in ("plain", "hedged", "deadline"):
+                results[mode] = run(mode, args, base_url)
+    print(json.dumps({"settings": vars(args), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,415 @@
+"""
+Generates load against the book service and reports its capacity: throughput, latency
+percentiles, the share of requests served by each cache tier, the hit ratio of each tier
+and the number of calls to the Taaghche API.
+
+Unless --url is given, a server (gunicorn by default) is started with the benchmark
+settings against the fake upstream, with PROMETHEUS_MULTIPROC_DIR set so that tier
+lookups are counted across its workers. Without BENCH_REDIS_URL each worker has its own
+redis_cache tier, so point it at a Redis server to measure the shared tier. Book IDs
+follow a Zipfian, uniform or scan (sequential) distribution over --keys IDs, and
+requests mix GETs with PUTs and DELETEs (sent like the Celery tasks do). With --rate,
+requests are sent on a fixed schedule (open loop) and latency is measured from the time
+each one was due, so that a slow server cannot hide its queueing delay.
+Run it from the django directory with:
+
+    BENCH_REDIS_URL=redis://localhost:6379/1 python -m benchmarks.load \\
+        --workers 4 --concurrency 64 --duration 30 --keys 100000 \\
+        --distribution zipf --zipf-exponent 1.1 --mix get=98,put=1,delete=1
+
+The client is a single asyncio process: check that it is not the bottleneck (its CPU)
+before trusting high rates.
+"""
+
+import argparse
+import asyncio
+import bisect
+import itertools
+import json
+import os
+import random
+import secrets
+import tempfile
+import time
+import urllib.request
+
+import aiohttp
+from prometheus_client.parser import text_string_to_metric_families
+
+from benchmarks.asgi_vs_wsgi import start_server
+from benchmarks.fake_upstream import free_port, make_book, spawn, wait_for_port
+
+PERCENTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+class Keys:
+    """
+    Draws book IDs from 1 to `count` following a distribution.
+
+    - zipf: ID `k` is drawn with a probability proportional to 1 / k ** exponent, so low
+      IDs are the hot ones.
+    - uniform: every ID is equally likely.
+    - scan: IDs are drawn in order, wrapping around, so that nothing is requested twice
+      within `count` requests.
+    """
+
+    def __init__(self, distribution, count, exponent=1.0, seed=None):
+        self.distribution = distribution
+        self.count = count
+        self.random = random.Random(seed)
+        self.scan = itertools.cycle(range(1, count + 1))
+        if distribution == "zipf":
+            total = 0.0
+            self.cumulative = []
+            for rank in range(1, count + 1):
+                total += 1 / rank**exponent
+                self.cumulative.append(total)
+
+    def __next__(self):
+        if self.distribution == "zipf":
+            return (
+                bisect.bisect_left(
+                    self.cumulative, self.random.random() * self.cumulative[-1]
+                )
+                + 1
+            )
+        if self.distribution == "uniform":
+            return self.random.randint(1, self.count)
+        return next(self.scan)
+
+
+def parse_mix(value):
+    """
+    Parses a request mix such as "get=90,put=5,delete=5" into cumulative weights.
+
+    Returns:
+        tuple: The methods and their cumulative weights.
+
+    Raises:
+        ValueError: If a method or a weight is invalid.
+    """
+    methods, weights = [], []
+    for part in value.split(","):
+        method, _, weight = part.partition("=")
+        method = method.strip().upper()
+        if method not in ("GET", "PUT", "DELETE"):
+            raise ValueError(f"Unknown method {method!r} in --mix")
+        methods.append(method)
+        weights.append(float(weight or 1))
+    return methods, list(itertools.accumulate(weights))
+
+
+def percentiles(latencies):
+    ordered = sorted(latencies)
+    if not ordered:
+        return {}
+    result = {
+        f"p{fraction * 100:g}_ms": round(
+            ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] * 1000, 2
+        )
+        for fraction in PERCENTILES
+    }
+    result["max_ms"] = round(ordered[-1] * 1000, 2)
+    return result
+
+
+def scrape_lookups(base_url, token):
+    """
+    Reads the lookups of each cache tier, summed over the server's workers, from
+    /metrics.
+
+    Returns:
+        dict: Each cache name mapped to its hit and miss counts, or an empty dict if
+        metrics are unavailable.
+    """
+    request = urllib.request.Request(
+        f"{base_url}/metrics", headers={"Authorization": f"Bearer {token}"}
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            text = response.read().decode()
+    except OSError:
+        return {}
+    lookups = {}
+    for family in text_string_to_metric_families(text):
+        if family.name != "books_cache_lookups":
+            continue
+        for sample in family.samples:
+            if sample.name.endswith("_total"):
+                counts = lookups.setdefault(sample.labels["cache"], {})
+                counts[sample.labels["result"]] = (
+                    counts.get(sample.labels["result"], 0) + sample.value
+                )
+    return lookups
+
+
+def upstream_stats(upstream_url):
+    if upstream_url is None:
+        return None
+    with urllib.request.urlopen(f"{upstream_url}/__stats", timeout=10) as response:
+        return json.load(response)
+
+
+async def run_load(args, mix, base_url, token, duration):
+    """
+    Sends requests for `duration` seconds, from `args.concurrency` concurrent clients,
+    with the `mix` of methods (see `parse_mix`).
+
+    Returns:
+        dict: The requests sent, their latencies by method, their statuses and the
+        origin of the GETs.
+    """
+    keys = Keys(args.distribution, args.keys, args.zipf_exponent, args.seed)
+    methods, weights = mix
+    picker = random.Random(args.seed)
+    headers = {"Authorization": f"Bearer {token}"}
+    latencies = {method: [] for method in methods}
+    statuses = {}
+    origins = {}
+    errors = 0
+    sent = 0
+
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    start = time.perf_counter()
+    deadline = start + duration
+
+    async with aiohttp.ClientSession(
+        base_url, connector=connector, timeout=timeout
+    ) as client:
+
+        async def request(method, book_id):
+            path = f"/api/book/{book_id}"
+            if method == "GET":
+                return await client.get(path)
+            if method == "PUT":
+                data = json.dumps(make_book(book_id, args.size), ensure_ascii=False)
+                return await client.put(
+                    path,
+                    json={"cache": args.write_cache, "data": data},
+                    headers=headers,
+                )
+            return await client.delete(
+                path, json={"cache": args.write_cache}, headers=headers
+            )
+
+        async def worker():
+            nonlocal errors, sent
+            while True:
+                if args.rate:
+                    # Open loop: each request has its slot on a fixed schedule, and its
+                    # latency counts from it.
+                    due = start + sent / args.rate
+                    sent += 1
+                    if due >= deadline:
+                        return
+                    await asyncio.sleep(max(0.0, due - time.perf_counter()))
+                else:
+                    due = time.perf_counter()
+                    if due >= deadline:
+                        return
+                    sent += 1
+                method = methods[
+                    bisect.bisect_right(weights, picker.random() * weights[-1])
+                ]
+                try:
+                    async with await request(method, next(keys)) as response:
+                        await response.read()
+                        statuses[response.status] = statuses.get(response.status, 0) + 1
+                        if method == "GET":
+                            origin = response.headers.get("data-origin") or "none"
+                            origins[origin] = origins.get(origin, 0) + 1
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    errors += 1
+                latencies[method].append(time.perf_counter() - due)
+
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "elapsed": elapsed,
+        "latencies": latencies,
+        "statuses": statuses,
+        "origins": origins,
+        "errors": errors,
+    }
+
+
+def report(load, lookups_before, lookups_after, upstream_before, upstream_after):
+    """
+    Builds the capacity report of a run.
+
+    Returns:
+        dict: Throughput, latency percentiles overall and by method, statuses, the share
+        of GETs served by each origin, the hit ratio of each tier and the calls to the
+        upstream.
+    """
+    all_latencies = [
+        latency for latencies in load["latencies"].values() for latency in latencies
+    ]
+    total = len(all_latencies)
+    gets = sum(load["origins"].values())
+    result = {
+        "requests": total,
+        "errors": load["errors"],
+        "seconds": round(load["elapsed"], 2),
+        "rps": round(total / load["elapsed"], 1),
+        "latency": percentiles(all_latencies),
+        "by_method": {
+            method: {"requests": len(latencies), **percentiles(latencies)}
+            for method, latencies in load["latencies"].items()
+        },
+        "statuses": {
+            str(code): count for code, count in sorted(load["statuses"].items())
+        },
+        "origins": {
+            origin: round(count / gets, 4)
+            for origin, count in sorted(load["origins"].items())
+        },
+    }
+
+    tiers = {}
+    for cache_name, after in lookups_after.items():
+        before = lookups_before.get(cache_name, {})
+        hits = after.get("hit", 0) - before.get("hit", 0)
+        # Only book data counts as a hit: expired and negative entries count as misses.
+        misses = sum(after.values()) - sum(before.values()) - hits
+        if hits + misses:
+            tiers[cache_name] = {
+                "hits": int(hits),
+                "misses": int(misses),
+                "hit_ratio": round(hits / (hits + misses), 4),
+            }
+    result["tiers"] = tiers
+
+    if upstream_after is not None:
+        calls = upstream_after["book_requests"] - upstream_before["book_requests"]
+        result["upstream"] = {
+            "calls": calls,
+            "failures": upstream_after["failed_requests"]
+            - upstream_before["failed_requests"],
+            "calls_per_get": round(calls / gets, 4) if gets else None,
+        }
+    return result
+
+
+def measure(args, mix, base_url, token, upstream_url):
+    if args.warmup:
+        asyncio.run(run_load(args, mix, base_url, token, args.warmup))
+    lookups_before = scrape_lookups(base_url, token)
+    upstream_before = upstream_stats(upstream_url)
+    load = asyncio.run(run_load(args, mix, base_url, token, args.duration))
+    return report(
+        load,
+        lookups_before,
+        scrape_lookups(base_url, token),
+        upstream_before,
+        upstream_stats(upstream_url),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--url", help="Load an already running server instead of starting one."
+    )
+    parser.add_argument(
+        "--token",
+        default=os.getenv("CELERY_SECRET_KEY"),
+        help="Bearer key of a running server.",
+    )
+    parser.add_argument("--server", choices=("wsgi", "asgi"), default="wsgi")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0,
+        help="Requests per second, on a fixed schedule (0 - as fast as possible).",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=30, help="Seconds of measured load."
+    )
+    parser.add_argument(
+        "--warmup", type=float, default=5, help="Seconds of unmeasured load sent first."
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=30,
+        help="Seconds before a request counts as an error.",
+    )
+    parser.add_argument(
+        "--keys",
+        type=int,
+        default=10000,
+        help="How many distinct book IDs are requested.",
+    )
+    parser.add_argument(
+        "--distribution", choices=("zipf", "uniform", "scan"), default="zipf"
+    )
+    parser.add_argument("--zipf-exponent", type=float, default=1.0)
+    parser.add_argument(
+        "--mix",
+        default="get=100",
+        help='The share of each method, e.g. "get=90,put=5,delete=5".',
+    )
+    parser.add_argument(
+        "--write-cache",
+        default="redis_cache",
+        help="The cache PUTs and DELETEs are sent for.",
+    )
+    parser.add_argument(
+        "--size", type=int, default=8192, help="Book payload size in bytes."
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="Fake upstream latency in seconds."
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Share of upstream requests failing with a 500.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the report to this file too.")
+    args = parser.parse_args()
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as error:
+        parser.error(str(error))
+
+    if args.url:
+        results = measure(args, mix, args.url, args.token, None)
+    else:
+        token = secrets.token_hex(16)
+        with spawn(args.latency, args.size, args.error_rate, args.seed) as upstream_url:
+            with tempfile.TemporaryDirectory() as metrics_dir:
+                port = free_port()
+                env = dict(
+                    os.environ,
+                    DJANGO_SETTINGS_MODULE="benchmarks.settings",
+                    TAAGHCHE_API_URL=upstream_url,
+                    CELERY_SECRET_KEY=token,
+                    PROMETHEUS_MULTIPROC_DIR=metrics_dir,
+                    BOOK_ASYNC_VIEW="1" if args.server == "asgi" else "0",
+                )
+                server = start_server(args.server, port, args.workers, env)
+                try:
+                    wait_for_port(port)
+                    results = measure(
+                        args, mix, f"http://127.0.0.1:{port}", token, upstream_url
+                    )
+                finally:
+                    server.terminate()
+                    server.wait()
+
+    output = json.dumps({"settings": vars(args), "results": results}, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Compares the project settings with the lean ones (config.settings_lean): request
+overhead and startup time.
+
+Requests go through the whole WSGI handler (middleware included), in-process, with the
+book held in the in-process tier, so that only the framework's work differs between
+profiles. PUT and DELETE are sent too, authenticated like the Celery tasks do, to check
+that they still work. Startup is the time a fresh interpreter takes to import the WSGI
+application, as a gunicorn worker does. Run it from the django directory with:
+
+    python -m benchmarks.profiles --requests 20000
+"""
+
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROFILES = ("default", "lean")
+
+STARTUP = """
+import os, sys, time
+start = time.perf_counter()
+from config.wsgi import application
+print(time.perf_counter() - start, len(sys.modules))
+"""
+
+
+def measure_requests(args):
+    """
+    Times GET, PUT and DELETE requests through the WSGI handler of this process's
+    settings.
+
+    Returns:
+        dict: The mean time of each kind of request (in microseconds), and the
+        middleware in use.
+    """
+    import django
+
+    django.setup()
+    from django.conf import settings
+    from django.core.cache import caches
+    from django.core.handlers.wsgi import WSGIHandler
+    from django.test import RequestFactory
+
+    from benchmarks.fake_upstream import make_book
+    from books import entries
+
+    for cache_name in settings.CACHES:
+        caches[cache_name]  # Opens every tier before settings.CACHES is narrowed down.
+    settings.CACHES = {"default": settings.CACHES["default"]}
+    settings.BOOK_INVALIDATION_CACHE = ""
+    caches["default"].set(1, entries.wrap(make_book(1, args.size)))
+
+    handler = WSGIHandler()
+    factory = RequestFactory()
+    authorization = f"Bearer {settings.CELERY_SECRET_KEY}"
+    body = json.dumps(
+        {"cache": "default", "data": json.dumps(make_book(2, args.size))}
+    ).encode()
+
+    def environ(method, path, data=b""):
+        request = factory.generic(
+            method,
+            path,
+            data,
+            content_type="application/json",
+            HTTP_AUTHORIZATION=authorization,
+        )
+        return request.environ, data
+
+    def call(prepared):
+        env, data = prepared
+        env = dict(env, **{"wsgi.input": io.BytesIO(data)})
+        status = []
+        for _ in handler(env, lambda code, headers, exc_info=None: status.append(code)):
+            pass
+        return status[0]
+
+    requests = {
+        "get": (environ("GET", "/api/book/1"), args.requests),
+        "put": (environ("PUT", "/api/book/2", body), max(1, args.requests // 10)),
+        "delete": (
+            environ("DELETE", "/api/book/2", json.dumps({"cache": "default"}).encode()),
+            max(1, args.requests // 10),
+        ),
+    }
+    results = {
+        "middleware": list(settings.MIDDLEWARE),
+        "installed_apps": list(settings.INSTALLED_APPS),
+    }
+    for name, (prepared, count) in requests.items():
+        assert call(prepared).startswith("200"), f"{name} failed"
+        best = None
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            for _ in range(count):
+                call(prepared)
+            mean = (time.perf_counter() - start) / count * 1e6
+            best = mean if best is None else min(best, mean)
+        results[f"{name}_us"] = round(best, 1)
+    return results
+
+
+def measure_startup(profile, runs):
+    """
+    Imports the WSGI application in `runs` fresh interpreters.
+
+    Returns:
+        dict: The median import time (in milliseconds) and the number of modules loaded.
+    """
+    env = dict(
+        os.environ, DJANGO_SETTINGS_MODULE="benchmarks.settings", BENCH_PROFILE=profile
+    )
+    times, modules = [], 0
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", STARTUP],
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.split()
+        times.append(float(output[0]))
+        modules = int(output[1])
+    return {"startup_ms": round(statistics.median(times) * 1000, 1), "modules": modules}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--requests",
+        type=int,
+        default=20000,
+        help="GETs per round (a tenth for PUT and DELETE).",
+    )
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument(
+        "--size", type=int, default=8192, help="Book payload size in bytes."
+    )
+    parser.add_argument("--startup-runs", type=int, default=10)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure_requests(args)))
+        return
+
+    results = {}
+    for profile in PROFILES:
+        # The settings are read once per process, so each profile is measured in its
+        # own.
+        env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE="benchmarks.settings",
+            BENCH_PROFILE=profile,
+        )
+        child = subprocess.run(
+            [sys.executable, "-m", "benchmarks.profiles", "--child", *sys.argv[1:]],
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        results[profile] = {
+            **json.loads(child.stdout),
+            **measure_startup(profile, args.startup_runs),
+        }
+
+    default, lean = results["default"], results["lean"]
+    results["saved"] = {
+        key: round(default[key] - lean[key], 1)
+        for key in ("get_us", "put_us", "delete_us", "startup_ms")
+    }
+    print(json.dumps({"settings": vars(args), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Measures field projection (`?fields=`) on the book endpoints, against serving the full
+book data.
+
+Cache hits on the in-process tier are timed for the full data, for a projection built on
+every request (BOOK_PROJECTION_CACHE empty) and for a cached projection, on the single
+and batch endpoints. Response sizes are reported too. Run it from the django directory
+with:
+
+    python -m benchmarks.projections --requests 20000 --size 8192
+"""
+
+import argparse
+import json
+import os
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.cache import caches  # noqa: E402
+from django.test import RequestFactory, override_settings  # noqa: E402
+
+from benchmarks.fake_upstream import make_book  # noqa: E402
+from books import entries  # noqa: E402
+from books.views import GetBookData, GetBooksData  # noqa: E402
+
+LISTING_FIELDS = "book.id,book.title,book.authors,book.coverUri,book.price"
+
+
+def measure(view, requests, paths):
+    """
+    Sends `requests` GET requests to the view, cycling over `paths` (tuples of a request
+    and view kwargs).
+
+    Returns:
+        dict: Mean latency (in microseconds) and response size (in bytes).
+    """
+    start = time.perf_counter()
+    for index in range(requests):
+        request, kwargs = paths[index % len(paths)]
+        response = view(request, **kwargs)
+        assert response.status_code == 200
+    elapsed = time.perf_counter() - start
+    return {
+        "mean_us": round(elapsed / requests * 1e6, 1),
+        "bytes": len(response.content),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--books", type=int, default=100)
+    parser.add_argument(
+        "--size", type=int, default=8192, help="Book payload size in bytes."
+    )
+    parser.add_argument(
+        "--batch", type=int, default=20, help="Books per batch request."
+    )
+    parser.add_argument("--fields", default=LISTING_FIELDS)
+    args = parser.parse_args()
+
+    for cache_name in settings.CACHES:
+        caches[cache_name]  # Opens every tier before settings.CACHES is narrowed down.
+    settings.CACHES = {"default": settings.CACHES["default"]}
+    caches["default"].set_many(
+        {
+            book_id: entries.wrap(make_book(book_id, args.size))
+            for book_id in range(1, args.books + 1)
+        }
+    )
+
+    factory = RequestFactory()
+    book_ids = range(1, args.books + 1)
+    single = GetBookData.as_view()
+    batch = GetBooksData.as_view()
+    batches = [
+        ",".join(
+            str(book_ids[(start + offset) % args.books]) for offset in range(args.batch)
+        )
+        for start in range(0, args.books, args.batch)
+    ]
+
+    results = {}
+    for mode, query, cache in (
+        ("full", {}, "default"),
+        ("projected", {"fields": args.fields}, ""),
+        ("projected_cached", {"fields": args.fields}, "default"),
+    ):
+        with override_settings(BOOK_PROJECTION_CACHE=cache):
+            single_paths = [
+                (factory.get(f"/api/book/{book_id}", query), {"book_id": book_id})
+                for book_id in book_ids
+            ]
+            batch_paths = [
+                (factory.get("/api/books", {"ids": ids, **query}), {})
+                for ids in batches
+            ]
+            measure(single, min(1000, args.requests), single_paths)  # Warm-up
+            measure(batch, min(100, args.requests), batch_paths)
+            results[mode] = {
+                "single": measure(single, args.requests, single_paths),
+                "batch": measure(
+                    batch, max(1, args.requests // args.batch), batch_paths
+                ),
+            }
+
+    print(json.dumps({"settings": vars(args), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
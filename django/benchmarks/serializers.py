@@ -0,0 +1,186 @@
+"""
+Compares the serializer codecs of the Redis tier, and the JSON renderers, on book-sized
+payloads.
+
+Payloads are shaped like the Taaghche API's book responses: the book with its authors,
+categories and files, and a page of comments, with descriptions and comments of random
+words. Cache entries are serialized as stored in the Redis tier, both rendered
+(BOOK_RENDERED_ENTRIES: the response bytes) and as data, with pickle, orjson, msgpack
+and the standard library's json (data only: it cannot hold bytes). For each, the report
+gives the time to serialize a value on a write and to deserialize it on a hit, and its
+size before and after compression. The payloads are also rendered with DRF's
+JSONRenderer and FastJSONRenderer, and decoded with json and orjson.
+Run it from the django directory with:
+
+    python -m benchmarks.serializers --books 200 --comments 20
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+django.setup()
+
+from django.test import override_settings  # noqa: E402
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+
+from benchmarks.compression import WORDS  # noqa: E402
+from benchmarks.fake_upstream import make_book  # noqa: E402
+from books import entries  # noqa: E402
+from books.compressors import BookCompressor  # noqa: E402
+from books.renderers import FastJSONRenderer, orjson  # noqa: E402
+from books.serializers import BookSerializer, msgpack  # noqa: E402
+
+
+def sample_book(book_id, comments, rng):
+    """
+    Builds a book response with the structure and size of the Taaghche API's.
+
+    Returns:
+        dict: The payload.
+    """
+    data = make_book(book_id, size=0)
+    book = data["book"]
+    book["description"] = " ".join(rng.choices(WORDS, k=rng.randint(100, 800)))
+    book.update(
+        {
+            "subtitle": " ".join(rng.choices(WORDS, k=4)),
+            "isbn": f"978-600-{book_id:06d}",
+            "publishDate": "2021-06-01T00:00:00",
+            "pageCount": rng.randint(80, 900),
+            "beforeOffPrice": book["price"] + 5000,
+            "rates": [
+                {"value": value, "count": rng.randint(0, 500)} for value in range(1, 6)
+            ],
+            "categories": [
+                {"id": rng.randint(1, 300), "title": rng.choice(WORDS)}
+                for _ in range(3)
+            ],
+            "tags": [rng.choice(WORDS) for _ in range(8)],
+        }
+    )
+    data["bookFiles"] = [
+        {
+            "id": book_id * 10 + index,
+            "type": kind,
+            "size": rng.randint(10**5, 10**8),
+            "encrypted": True,
+        }
+        for index, kind in enumerate(("epub", "pdf", "audio"))
+    ]
+    data["comments"] = [
+        {
+            "id": book_id * 100 + index,
+            "nickname": rng.choice(WORDS),
+            "rate": rng.randint(1, 5),
+            "text": " ".join(rng.choices(WORDS, k=rng.randint(5, 60))),
+            "creationDate": "2023-01-15T10:20:30",
+            "likes": rng.randint(0, 100),
+            "replies": [],
+        }
+        for index in range(comments)
+    ]
+    return data
+
+
+def best_mean(function, values, rounds):
+    """
+    Calls `function` on every value, `rounds` times.
+
+    Returns:
+        float: The lowest mean time of a call, in microseconds.
+    """
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for value in values:
+            function(value)
+        mean = (time.perf_counter() - start) / len(values) * 1e6
+        best = mean if best is None else min(best, mean)
+    return round(best, 2)
+
+
+def measure_codec(dumps, loads, values, rounds, compressor):
+    stored = [dumps(value) for value in values]
+    assert all(
+        loads(item) == value for item, value in zip(stored, values)
+    ), "Lossy round trip"
+    return {
+        "dumps_us": best_mean(dumps, values, rounds),
+        "loads_us": best_mean(loads, stored, rounds),
+        "bytes": round(statistics.mean(len(item) for item in stored)),
+        "compressed_bytes": round(
+            statistics.mean(len(compressor.compress(item)) for item in stored)
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--books", type=int, default=200)
+    parser.add_argument("--comments", type=int, default=20, help="Comments per book.")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    payloads = [
+        sample_book(book_id, args.comments, rng) for book_id in range(1, args.books + 1)
+    ]
+    compressor = BookCompressor({"COMPRESSOR_CODEC": "zlib", "COMPRESS_MIN_SIZE": 1024})
+    codecs = [
+        codec
+        for codec, module in (
+            ("pickle", True),
+            ("orjson", orjson),
+            ("msgpack", msgpack),
+        )
+        if module
+    ]
+
+    results = {
+        "payload_bytes": round(
+            statistics.mean(len(JSONRenderer().render(data)) for data in payloads)
+        )
+    }
+    for mode, rendered in (("rendered_entries", True), ("data_entries", False)):
+        with override_settings(BOOK_RENDERED_ENTRIES=rendered):
+            values = [entries.wrap(data) for data in payloads]
+        results[mode] = {}
+        for codec in codecs:
+            serializer = BookSerializer({"SERIALIZER_CODEC": codec})
+            results[mode][codec] = measure_codec(
+                serializer.dumps, serializer.loads, values, args.rounds, compressor
+            )
+        if not rendered:
+            results[mode]["json"] = measure_codec(
+                lambda value: json.dumps(value, ensure_ascii=False).encode(),
+                json.loads,
+                values,
+                args.rounds,
+                compressor,
+            )
+
+    slow, fast = JSONRenderer(), FastJSONRenderer()
+    results["renderers"] = {
+        "identical_output": all(
+            slow.render(data) == fast.render(data) for data in payloads
+        ),
+        "JSONRenderer_us": best_mean(slow.render, payloads, args.rounds),
+        "FastJSONRenderer_us": best_mean(fast.render, payloads, args.rounds),
+    }
+    bodies = [slow.render(data) for data in payloads]
+    results["decoders"] = {"json_us": best_mean(json.loads, bodies, args.rounds)}
+    if orjson is not None:
+        results["decoders"]["orjson_us"] = best_mean(orjson.loads, bodies, args.rounds)
+    print(json.dumps({"settings": vars(args), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
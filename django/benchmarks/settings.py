@@ -0,0 +1,31 @@
+"""
+Django settings for benchmarks.
+
+They extend the project settings, or the lean ones (config.settings_lean) with
+BENCH_PROFILE=lean. Unless BENCH_REDIS_URL points at a Redis server, the redis_cache
+tier is replaced by an in-memory cache, so benchmarks can run without the docker-compose
+stack.
+"""
+
+import os
+
+if os.getenv("BENCH_PROFILE") == "lean":
+    from config.settings_lean import *  # noqa: F401,F403
+else:
+    from config.settings import *  # noqa: F401,F403
+from config.settings import CACHES
+
+SECRET_KEY = os.getenv("SECRET_KEY") or "benchmark-secret-key"
+ALLOWED_HOSTS = ["*"]
+
+if os.getenv("BENCH_REDIS_URL"):
+    CACHES["redis_cache"]["LOCATION"] = os.getenv("BENCH_REDIS_URL")
+else:
+    CACHES["redis_cache"] = {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "benchmark-redis-cache",
+    }
+
+# Benchmarks measure the service itself: the fake upstream is not rate limited unless
+# asked to.
+UPSTREAM_RATE_LIMIT = float(os.getenv("UPSTREAM_RATE_LIMIT", 0))
@@ -0,0 +1,171 @@
+"""
+Compares the per-process L1 tier (L1Cache) with the one shared by the processes of a
+host (SharedMemoryCache).
+
+`--workers` processes look books up concurrently, with Zipfian IDs, and store the ones
+they miss (as the Book tier chain does after reading the next tier). L1Cache gets
+`--max-bytes` in each process; SharedMemoryCache gets as much for the whole host, then
+as much as all the L1Caches together. The report gives the hit ratio over every worker
+and the memory held by the tier on the host. The latency of a hit is measured apart, in
+this process, as concurrent workers on few CPUs mostly time each other. Run it from the
+django directory with:
+
+    python -m benchmarks.shared_l1 --workers 4 --requests 20000 --keys 10000 \\
+        --max-bytes 16777216
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+django.setup()
+
+from benchmarks.fake_upstream import make_book  # noqa: E402
+from benchmarks.load import Keys  # noqa: E402
+from books import backends, entries  # noqa: E402
+
+
+def make_cache(backend, max_bytes, args):
+    if backend == "shared":
+        backends._tables.pop(
+            args.path, None
+        )  # Maps the file again, like a new worker process does.
+        options = {"MAX_BYTES": max_bytes, "SLOT_BYTES": args.slot_bytes}
+        return backends.SharedMemoryCache(args.path, {"OPTIONS": options})
+    backends._stores.pop("benchmark-l1", None)
+    return backends.L1Cache("benchmark-l1", {"OPTIONS": {"MAX_BYTES": max_bytes}})
+
+
+def run_worker(backend, max_bytes, args, seed, start):
+    """
+    Looks books up in one worker process, storing the missed ones.
+
+    Returns:
+        dict: The hits and misses, and the tier's stats.
+    """
+    cache = make_cache(backend, max_bytes, args)
+    keys = Keys("zipf", args.keys, args.zipf_exponent, seed)
+    entry = entries.wrap(make_book(1, args.size))
+    hits = misses = 0
+    start.wait()
+    for _ in range(args.requests):
+        book_id = next(keys)
+        if cache.get(book_id) is None:
+            misses += 1
+            cache.set(book_id, entry)
+        else:
+            hits += 1
+    return {"hits": hits, "misses": misses, "stats": cache.stats()}
+
+
+def measure(backend, max_bytes, args):
+    """
+    Runs `args.workers` worker processes against a new, empty tier.
+
+    Returns:
+        dict: The hit ratio over every worker, and the memory held and allowed by the
+        tier on the host.
+    """
+    if os.path.exists(args.path):
+        os.unlink(args.path)
+    context = multiprocessing.get_context("fork")
+    with context.Manager() as manager:
+        start = manager.Barrier(args.workers)
+        with context.Pool(args.workers) as pool:
+            workers = pool.starmap(
+                run_worker,
+                [
+                    (backend, max_bytes, args, seed, start)
+                    for seed in range(args.workers)
+                ],
+            )
+    hits = sum(worker["hits"] for worker in workers)
+    lookups = hits + sum(worker["misses"] for worker in workers)
+    if backend == "shared":
+        # One table for the host, every worker reports it. Whole slots are used,
+        # whatever the size of the values.
+        memory = workers[0]["stats"]["entries"] * args.slot_bytes
+        budget = max_bytes
+    else:
+        memory = sum(worker["stats"]["bytes"] for worker in workers)
+        budget = max_bytes * args.workers
+    return {
+        "hit_ratio": round(hits / lookups, 4),
+        "misses": lookups - hits,
+        "host_bytes": memory,
+        "host_budget_bytes": budget,
+    }
+
+
+def hit_latency(backend, args):
+    """
+    Times hits on one book in this process.
+
+    Returns:
+        float: The mean latency of a hit, in microseconds.
+    """
+    cache = make_cache(backend, args.max_bytes, args)
+    cache.set(1, entries.wrap(make_book(1, args.size)))
+    best = None
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            cache.get(1)
+        mean = (time.perf_counter() - start) / args.requests * 1e6
+        best = mean if best is None else min(best, mean)
+    cache.clear()
+    return round(best, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--requests", type=int, default=20000, help="Lookups per worker."
+    )
+    parser.add_argument(
+        "--keys",
+        type=int,
+        default=10000,
+        help="How many distinct book IDs are looked up.",
+    )
+    parser.add_argument("--zipf-exponent", type=float, default=1.0)
+    parser.add_argument(
+        "--size", type=int, default=8192, help="Book payload size in bytes."
+    )
+    parser.add_argument(
+        "--max-bytes",
+        type=int,
+        default=16 * 2**20,
+        help="Memory budget of each backend.",
+    )
+    parser.add_argument("--slot-bytes", type=int, default=16 * 2**10)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory(
+        dir="/dev/shm" if os.path.isdir("/dev/shm") else None
+    ) as directory:
+        args.path = os.path.join(directory, "l1")
+        results["per_process"] = measure("per_process", args.max_bytes, args)
+        results["shared"] = measure("shared", args.max_bytes, args)
+        results["shared_same_host_budget"] = measure(
+            "shared", args.max_bytes * args.workers, args
+        )
+        for backend in ("per_process", "shared"):
+            results[backend]["hit_us"] = hit_latency(backend, args)
+    results["memory_ratio"] = round(
+        results["per_process"]["host_bytes"] / max(1, results["shared"]["host_bytes"]),
+        2,
+    )
+    print(json.dumps({"settings": vars(args), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+"""
+Runs the microbenchmarks of the Book cache paths, offline, and compares them with a
+saved baseline.
+
+Every case is timed call by call, in-process, against the fake upstream (run in a child
+process) and the benchmark settings' cache tiers: in-memory ones unless BENCH_REDIS_URL
+points at a Redis server. Per-call setup (e.g. evicting the book so that the next call
+misses) is not timed. Each case runs `--rounds` times and the round with the lowest
+median is kept, which makes runs comparable on a noisy machine. Run it from the django
+directory with:
+
+    python -m benchmarks.suite --output results.json --save-baseline baseline.json
+    python -m benchmarks.suite --baseline baseline.json --tolerance 0.2
+
+With --baseline, the exit status is 1 if the median of any case regressed by more than
+the tolerance.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import urllib.request
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.cache import caches  # noqa: E402
+from django.test import RequestFactory  # noqa: E402
+
+from benchmarks.fake_upstream import make_book, spawn  # noqa: E402
+from books.classes import Book  # noqa: E402
+from books.views import GetBookData  # noqa: E402
+
+
+def summarize(samples):
+    """
+    Summarizes the durations of the calls of a round.
+
+    Args:
+        samples (list): The duration of each call, in nanoseconds.
+
+    Returns:
+        dict: The number of calls, their mean, p50 and p99 (in microseconds), and the
+        calls per second.
+    """
+    ordered = sorted(samples)
+    mean = sum(ordered) / len(ordered)
+    return {
+        "calls": len(ordered),
+        "mean_us": round(mean / 1000, 2),
+        "p50_us": round(ordered[len(ordered) // 2] / 1000, 2),
+        "p99_us": round(
+            ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] / 1000, 2
+        ),
+        "ops": round(1e9 / mean),
+    }
+
+
+def run_round(call, setup, iterations, book_ids):
+    """
+    Times `call(book_id)` for `iterations` calls, cycling over `book_ids`.
+
+    Args:
+        call (callable): The measured operation.
+        setup (callable): Called, untimed, before each call with the same book ID; may
+            be None.
+        iterations (int): The number of calls.
+        book_ids (list): The book IDs.
+
+    Returns:
+        dict: The summary of the calls (see `summarize`).
+    """
+    clock = time.perf_counter_ns
+    samples = []
+    for index in range(iterations):
+        book_id = book_ids[index % len(book_ids)]
+        if setup is not None:
+            setup(book_id)
+        start = clock()
+        call(book_id)
+        samples.append(clock() - start)
+    return summarize(samples)
+
+
+def evict(cache_names):
+    def setup(book_id):
+        for cache_name in cache_names:
+            caches[cache_name].delete(book_id)
+
+    return setup
+
+
+def run(args):
+    """
+    Runs every case, `args.rounds` times, keeping the round with the lowest median of
+    each.
+
+    Rounds of the cases are interleaved, so that a slow spell of the machine affects all
+    of them alike. The `calibration` case only encodes and decodes a payload with the
+    standard library: it does not depend on the service's code, and tells how fast the
+    machine was during the run (see `compare`).
+
+    Returns:
+        tuple: Each case name mapped to its summary, and the costs derived from them:
+        the view overhead on top of `get_entry`, and the cost of decoding the stored
+        body in `get_data`.
+    """
+    cache_names = list(settings.CACHES)
+    book_ids = list(range(1, args.books + 1))
+    payloads = {book_id: make_book(book_id, args.size) for book_id in book_ids}
+
+    def fill():
+        for book_id in book_ids:
+            Book(book_id=book_id).set_cached_data(payloads[book_id])
+
+    factory = RequestFactory()
+    view = GetBookData.as_view()
+    requests = {book_id: factory.get(f"/api/book/{book_id}") for book_id in book_ids}
+
+    def get_view(book_id):
+        response = view(requests[book_id], book_id=book_id)
+        assert response.status_code == 200
+
+    misses = max(1, args.iterations // 10)
+    cases = {
+        "calibration": (
+            lambda book_id: json.loads(json.dumps(payloads[book_id])),
+            None,
+            args.iterations,
+        ),
+        # A hit in the in-process tier, with and without decoding the stored body.
+        "get_data_l1_hit": (
+            lambda book_id: Book(book_id=book_id).get_data(),
+            None,
+            args.iterations,
+        ),
+        "get_entry_l1_hit": (
+            lambda book_id: Book(book_id=book_id).get_entry(),
+            None,
+            args.iterations,
+        ),
+        # A miss in the in-process tier and a hit in the shared one, which is copied to
+        # the in-process tier.
+        "get_data_l2_hit": (
+            lambda book_id: Book(book_id=book_id).get_data(),
+            evict(cache_names[:1]),
+            args.iterations,
+        ),
+        # A miss in every tier: the book is fetched from the fake upstream (over HTTP),
+        # and stored in every tier.
+        "get_data_miss": (
+            lambda book_id: Book(book_id=book_id).get_data(),
+            evict(cache_names),
+            misses,
+        ),
+        # Wrapping and rendering the book data, and writing it to every tier.
+        "set_cached_data": (
+            lambda book_id: Book(book_id=book_id).set_cached_data(payloads[book_id]),
+            None,
+            args.iterations,
+        ),
+        # The whole sync view on an in-process hit.
+        "view_l1_hit": (get_view, None, args.iterations),
+    }
+
+    results = {}
+    for round_index in range(args.rounds + 1):
+        for name, (call, setup, iterations) in cases.items():
+            fill()
+            if round_index == 0:
+                run_round(call, setup, min(iterations, 200), book_ids)  # Warm-up
+                continue
+            result = run_round(call, setup, iterations, book_ids)
+            if name not in results or result["p50_us"] < results[name]["p50_us"]:
+                results[name] = result
+
+    derived = {
+        "view_overhead_us": round(
+            results["view_l1_hit"]["p50_us"] - results["get_entry_l1_hit"]["p50_us"], 2
+        ),
+        "decode_us": round(
+            results["get_data_l1_hit"]["p50_us"]
+            - results["get_entry_l1_hit"]["p50_us"],
+            2,
+        ),
+    }
+    for cache_name in cache_names:
+        caches[cache_name].clear()
+    return results, derived
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares the median of every case with a baseline.
+
+    Medians are compared rather than means, as they are barely moved by the pauses of a
+    busy machine. Both are first divided by the median of their run's `calibration`
+    case, so that a machine running slower or faster than when the baseline was saved
+    (another CPU, frequency scaling, noisy neighbours) is not taken for a change of the
+    service's code.
+
+    Args:
+        results (dict): Each case name mapped to its summary.
+        baseline (dict): The output of a previous run.
+        tolerance (float): The relative slowdown allowed, e.g. 0.1 for 10%.
+
+    Returns:
+        dict: Each case found in both mapped to its baseline and current medians, the
+        ratio of their calibrated values, and whether it regressed.
+    """
+    speed = (
+        results["calibration"]["p50_us"] / baseline["results"]["calibration"]["p50_us"]
+    )
+    comparison = {}
+    for name, result in results.items():
+        before = baseline["results"].get(name)
+        if before is None or name == "calibration":
+            continue
+        ratio = result["p50_us"] / before["p50_us"] / speed
+        comparison[name] = {
+            "baseline_us": before["p50_us"],
+            "current_us": result["p50_us"],
+            "ratio": round(ratio, 3),
+            "regressed": ratio > 1 + tolerance,
+        }
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--iterations",
+        type=int,
+        default=5000,
+        help="Calls per round (a tenth of them for misses).",
+    )
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--books", type=int, default=100)
+    parser.add_argument(
+        "--size", type=int, default=8192, help="Book payload size in bytes."
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Fake upstream latency in seconds."
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Share of upstream requests failing with a 500.",
+    )
+    parser.add_argument("--output", help="Write the results to this file too.")
+    parser.add_argument(
+        "--save-baseline",
+        help="Save the results as the baseline to compare later runs with.",
+    )
+    parser.add_argument("--baseline", help="A baseline to compare the results with.")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Relative slowdown allowed by --baseline.",
+    )
+    args = parser.parse_args()
+
+    with spawn(
+        latency=args.latency, size=args.size, error_rate=args.error_rate, seed=0
+    ) as upstream_url:
+        settings.TAAGHCHE_API_URL = upstream_url
+        results, derived = run(args)
+        with urllib.request.urlopen(f"{upstream_url}/__stats") as response:
+            upstream_stats = json.load(response)
+
+    report = {
+        "settings": vars(args),
+        "environment": {
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "machine": platform.machine(),
+            "redis": os.getenv("BENCH_REDIS_URL") or "in-memory",
+        },
+        "results": results,
+        "derived": derived,
+        "upstream": upstream_stats,
+    }
+    regressed = []
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            report["comparison"] = compare(
+                results, json.load(baseline_file), args.tolerance
+            )
+        regressed = [
+            name for name, result in report["comparison"].items() if result["regressed"]
+        ]
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as output_file:
+                output_file.write(output + "\n")
+    if regressed:
+        print(f"Regressed: {', '.join(regressed)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
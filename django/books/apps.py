@@ -1,6 +1,15 @@
+import os
+
 from django.apps import AppConfig
 
 
 class BooksConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "books"
+
+    def ready(self):
+        from . import invalidation
+
+        # Serving processes start listening to the invalidation bus themselves (see
+        # `invalidation.start_listener`); the processes they fork listen too.
+        os.register_at_fork(after_in_child=invalidation._after_fork)
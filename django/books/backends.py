@@ -0,0 +1,701 @@
+import fcntl
+import mmap
+import os
+import pickle
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+# Global in-process stores, keyed by cache name: Django creates a backend instance per
+# thread.
+_stores = {}
+_stores_lock = threading.Lock()
+
+_MISSING = object()
+
+
+def sizeof(value):
+    """
+    Estimates the memory used by a cached value, in bytes.
+
+    Args:
+        value: The value, usually a cache entry holding bytes or plain JSON-like data.
+
+    Returns:
+        int: The estimated size.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sizeof(key) + sizeof(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(sizeof(item) for item in value)
+    return size
+
+
+class _Shard:
+    """
+    One shard of an L1Cache: a segmented LRU with its own lock.
+
+    New keys enter the probation segment; a key read again while in probation is
+    promoted to the protected segment, which holds at most `protected_ratio` of the
+    shard's bytes and demotes its least recently used keys back to probation. Evictions
+    are taken from probation first, so a scan of keys read only once cannot push the
+    frequently read ones out.
+    """
+
+    def __init__(self, max_bytes, protected_ratio):
+        self.lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.max_protected_bytes = int(max_bytes * protected_ratio)
+        self.probation = (
+            OrderedDict()
+        )  # Key -> (value, expiry, size), least recently used first.
+        self.protected = OrderedDict()
+        self.bytes = 0
+        self.protected_bytes = 0
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def get(self, key, now):
+        item = self.protected.get(key)
+        if item is not None:
+            if item[1] is not None and item[1] <= now:
+                self.remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return _MISSING
+            self.protected.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+        item = self.probation.get(key)
+        if item is None:
+            self.misses += 1
+            return _MISSING
+        if item[1] is not None and item[1] <= now:
+            self.remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return _MISSING
+        del self.probation[key]
+        self.protected[key] = item
+        self.protected_bytes += item[2]
+        self._demote()
+        self.hits += 1
+        return item[0]
+
+    def contains(self, key, now):
+        item = self.protected.get(key) or self.probation.get(key)
+        return item is not None and (item[1] is None or item[1] > now)
+
+    def set(self, key, value, expiry, size):
+        self.remove(key)
+        if size > self.max_bytes:
+            return False
+        self.probation[key] = (value, expiry, size)
+        self.bytes += size
+        self._evict()
+        return True
+
+    def touch(self, key, expiry, now):
+        for segment in (self.protected, self.probation):
+            item = segment.get(key)
+            if item is not None:
+                if item[1] is not None and item[1] <= now:
+                    return False
+                segment[key] = (item[0], expiry, item[2])
+                return True
+        return False
+
+    def remove(self, key):
+        item = self.protected.pop(key, None)
+        if item is not None:
+            self.protected_bytes -= item[2]
+        else:
+            item = self.probation.pop(key, None)
+        if item is None:
+            return False
+        self.bytes -= item[2]
+        return True
+
+    def clear(self):
+        self.probation.clear()
+        self.protected.clear()
+        self.bytes = self.protected_bytes = 0
+
+    def _demote(self):
+        while (
+            self.protected_bytes > self.max_protected_bytes and len(self.protected) > 1
+        ):
+            key, item = self.protected.popitem(last=False)
+            self.protected_bytes -= item[2]
+            self.probation[key] = item
+
+    def _evict(self):
+        while self.bytes > self.max_bytes:
+            segment = self.probation or self.protected
+            key, item = segment.popitem(last=False)
+            if segment is self.protected:
+                self.protected_bytes -= item[2]
+            self.bytes -= item[2]
+            self.evictions += 1
+
+
+class L1Cache(BaseCache):
+    """
+    An in-process cache backend for the first cache tier, bounded by memory rather than
+    entry count.
+
+    Keys are spread over shards, each with its own lock and segmented LRU eviction (see
+    `_Shard`). Values are stored and returned as is, without pickling or copying: they
+    are shared by every caller and must never be mutated, which holds for cache entries.
+    It is configured through OPTIONS:
+
+    - MAX_BYTES: the memory budget, in bytes, split evenly between the shards. Defaults
+      to 64 MiB.
+    - SHARDS: the number of shards. Defaults to 16.
+    - PROTECTED_RATIO: the share of each shard kept for keys read more than once.
+      Defaults to 0.8.
+    """
+
+    def __init__(self, name, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        with _stores_lock:
+            if name not in _stores:
+                shards = int(options.get("SHARDS", 16))
+                max_bytes = int(options.get("MAX_BYTES", 64 * 2**20))
+                protected_ratio = float(options.get("PROTECTED_RATIO", 0.8))
+                _stores[name] = [
+                    _Shard(max_bytes // shards, protected_ratio) for _ in range(shards)
+                ]
+            self._shards = _stores[name]
+
+    def _shard(self, key):
+        return self._shards[hash(key) % len(self._shards)]
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        size = sizeof(key) + sizeof(value)
+        shard = self._shard(key)
+        with shard.lock:
+            if shard.contains(key, time.time()):
+                return False
+            return shard.set(key, value, self.get_backend_timeout(timeout), size)
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        shard = self._shard(key)
+        with shard.lock:
+            value = shard.get(key, time.time())
+        return default if value is _MISSING else value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        size = sizeof(key) + sizeof(value)
+        shard = self._shard(key)
+        with shard.lock:
+            if timeout == 0:
+                shard.remove(key)
+            else:
+                shard.set(key, value, self.get_backend_timeout(timeout), size)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        shard = self._shard(key)
+        with shard.lock:
+            return shard.touch(key, self.get_backend_timeout(timeout), time.time())
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        shard = self._shard(key)
+        with shard.lock:
+            return shard.contains(key, time.time())
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        shard = self._shard(key)
+        with shard.lock:
+            return shard.remove(key)
+
+    def clear(self):
+        for shard in self._shards:
+            with shard.lock:
+                shard.clear()
+
+    def stats(self):
+        """
+        Reports the usage of the cache in this process, summed over its shards.
+
+        Returns:
+            dict: Entry and byte counts, the memory budget, and hit, miss, eviction and
+            expiration counters.
+        """
+        result = dict.fromkeys(
+            (
+                "entries",
+                "bytes",
+                "max_bytes",
+                "hits",
+                "misses",
+                "evictions",
+                "expirations",
+            ),
+            0,
+        )
+        for shard in self._shards:
+            with shard.lock:
+                result["entries"] += len(shard.probation) + len(shard.protected)
+                result["bytes"] += shard.bytes
+                result["max_bytes"] += shard.max_bytes
+                result["hits"] += shard.hits
+                result["misses"] += shard.misses
+                result["evictions"] += shard.evictions
+                result["expirations"] += shard.expirations
+        lookups = result["hits"] + result["misses"]
+        result["hit_ratio"] = round(result["hits"] / lookups, 4) if lookups else None
+        return result
+
+
+# Layout of a SharedMemoryCache file: a header, the state saved by the leading process
+# (see `SharedMemoryCache.leads`) with its CRC32, then fixed-size slots grouped in
+# buckets of `ways` slots. Each slot starts with its own header: a sequence number (odd
+# while the slot is being written), the hash of its key, the expiry and write timestamps
+# (0 for none), the CRC32 of the value, the value and key lengths, and whether the key
+# was read since the slot was written (second chance on eviction). The key and pickled
+# value follow it.
+_FILE_HEADER = struct.Struct("<8sQQQ")
+_FILE_MAGIC = b"BOOKSL1\x01"
+_LEADER_STATE = struct.Struct("<qqq")
+_LEADER_STATE_CRC = struct.Struct("<I")
+_LEADER_STATE_OFFSET = _FILE_HEADER.size
+_LEADER_STATE_END = _LEADER_STATE_OFFSET + _LEADER_STATE.size
+_SLOTS_OFFSET = 64
+_SLOT_HEADER = struct.Struct("<QQddIIHB")
+_SEQUENCE = struct.Struct("<Q")
+_REFERENCED_OFFSET = _SLOT_HEADER.size - 1
+_DATA_OFFSET = 48
+# The byte locked while a process creates or checks the file; bucket N is locked at byte
+# N.
+_INIT_LOCK_OFFSET = 2**62
+# The byte locked by the process applying the host-wide changes to the file (see
+# `SharedMemoryCache.leads`).
+_LEADER_LOCK_OFFSET = _INIT_LOCK_OFFSET + 1
+# How many times a read is retried while the slot is being written, before counting as a
+# miss.
+_READ_RETRIES = 8
+
+# Shared tables, keyed by file path: one mapping per process, whatever the number of
+# threads and backend instances.
+_tables = {}
+
+
+class _SharedTable:
+    """
+    A hash table in a memory-mapped file, shared by every process that maps it.
+
+    Keys are hashed to a bucket of `ways` slots and may only live there
+    (set-associative). Writers lock their bucket, with an fcntl lock on one byte of the
+    file (between processes) and a thread lock (within this process), and bump the
+    slot's sequence number before and after writing it. Readers take no lock: they copy
+    the slot, then check that the sequence number is even and unchanged and that the
+    value matches its CRC32, retrying otherwise (a seqlock). A process killed while
+    writing leaves an odd sequence number behind; its fcntl lock is released by the
+    kernel and the next writer of the slot makes it even again.
+    """
+
+    def __init__(self, path, slots, slot_bytes, ways):
+        self.path = path
+        self.ways = ways
+        self.buckets = max(1, slots // ways)
+        self.slot_bytes = slot_bytes
+        self.size = _SLOTS_OFFSET + self.buckets * ways * slot_bytes
+        self.fd = self._open()
+        self.map = mmap.mmap(
+            self.fd, self.size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE
+        )
+        self.locks = [threading.Lock() for _ in range(64)]
+        self.leader_pid = None
+        self.hits = self.misses = self.evictions = self.expirations = self.rejected = 0
+
+    def _open(self):
+        header = _FILE_HEADER.pack(
+            _FILE_MAGIC, self.buckets, self.ways, self.slot_bytes
+        )
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.lockf(fd, fcntl.LOCK_EX, 1, _INIT_LOCK_OFFSET)
+            try:
+                current = os.stat(self.path)
+            except FileNotFoundError:
+                current = None
+            if current is not None and current.st_ino == os.fstat(fd).st_ino:
+                if (
+                    current.st_size == self.size
+                    and os.pread(fd, _FILE_HEADER.size, 0) == header
+                ):
+                    # Left by processes that ran before: its entries are reused.
+                    fcntl.lockf(fd, fcntl.LOCK_UN, 1, _INIT_LOCK_OFFSET)
+                    return fd
+                if not current.st_size:
+                    os.ftruncate(fd, self.size)
+                    os.pwrite(fd, header, 0)
+                    fcntl.lockf(fd, fcntl.LOCK_UN, 1, _INIT_LOCK_OFFSET)
+                    return fd
+                # Another layout (e.g. the budget was changed): processes still mapping
+                # the old file keep it until they exit, and this one starts a new, empty
+                # file.
+                os.unlink(self.path)
+            # Otherwise the file was replaced by another process meanwhile: open the new
+            # one.
+            os.close(fd)
+
+    def lead(self):
+        """
+        Tries to take the leader lock of the file, held until this process exits. fcntl
+        locks belong to a process and are not inherited by forked children.
+
+        Returns:
+            bool: Whether this process holds it.
+        """
+        if self.leader_pid != os.getpid():
+            try:
+                fcntl.lockf(
+                    self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, _LEADER_LOCK_OFFSET
+                )
+            except OSError:
+                return False
+            self.leader_pid = os.getpid()
+        return True
+
+    def lock(self, bucket):
+        lock = self.locks[bucket % len(self.locks)]
+        lock.acquire()
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, bucket)
+        return lock
+
+    def unlock(self, bucket, lock):
+        fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, bucket)
+        lock.release()
+
+    def offsets(self, bucket):
+        first = _SLOTS_OFFSET + bucket * self.ways * self.slot_bytes
+        return range(first, first + self.ways * self.slot_bytes, self.slot_bytes)
+
+    def read(self, key, key_hash, now, load=True):
+        """
+        Reads a key without locking.
+
+        Returns:
+            The unpickled value (or True if not `load`), or _MISSING.
+        """
+        for offset in self.offsets(key_hash % self.buckets):
+            for _ in range(_READ_RETRIES):
+                (
+                    sequence,
+                    slot_hash,
+                    expiry,
+                    _,
+                    checksum,
+                    value_length,
+                    key_length,
+                    referenced,
+                ) = _SLOT_HEADER.unpack_from(self.map, offset)
+                if slot_hash != key_hash or not key_length:
+                    break
+                start = offset + _DATA_OFFSET
+                key_end = start + key_length
+                value_end = key_end + value_length
+                slot_key = self.map[start:key_end]
+                data = self.map[key_end:value_end] if load else b""
+                if (
+                    sequence & 1
+                    or _SEQUENCE.unpack_from(self.map, offset)[0] != sequence
+                ):
+                    continue  # Being written: try again.
+                if slot_key != key or (load and zlib.crc32(data) != checksum):
+                    break
+                if expiry and expiry <= now:
+                    self.expirations += 1
+                    self.misses += 1
+                    return _MISSING
+                if not referenced:
+                    self.map[offset + _REFERENCED_OFFSET] = 1
+                self.hits += 1
+                return pickle.loads(data) if load else True
+        self.misses += 1
+        return _MISSING
+
+    def find(self, bucket, key, key_hash):
+        """
+        Finds the slot holding a key, with its bucket locked.
+
+        Returns:
+            int: The offset of the slot, or None.
+        """
+        for offset in self.offsets(bucket):
+            _, slot_hash, _, _, _, _, key_length, _ = _SLOT_HEADER.unpack_from(
+                self.map, offset
+            )
+            if slot_hash == key_hash and key_length:
+                start = offset + _DATA_OFFSET
+                end = start + key_length
+                if self.map[start:end] == key:
+                    return offset
+        return None
+
+    def is_live(self, offset, now):
+        expiry = _SLOT_HEADER.unpack_from(self.map, offset)[2]
+        return not expiry or expiry > now
+
+    def victim(self, bucket, now):
+        """
+        Chooses the slot of a bucket to write a new key to, with the bucket locked: an
+        empty or expired slot if there is one, else the oldest slot not read since it
+        was written. If every slot was read, the oldest one is taken and the others lose
+        their second chance.
+        """
+        candidates = []
+        for offset in self.offsets(bucket):
+            _, _, expiry, stored, _, _, key_length, referenced = (
+                _SLOT_HEADER.unpack_from(self.map, offset)
+            )
+            if not key_length or (expiry and expiry <= now):
+                return offset
+            candidates.append((referenced, stored, offset))
+        referenced, _, offset = min(candidates)
+        if referenced:
+            for _, _, other in candidates:
+                self.map[other + _REFERENCED_OFFSET] = 0
+        self.evictions += 1
+        return offset
+
+    def write(self, offset, key, key_hash, data, expiry, now):
+        sequence = _SEQUENCE.unpack_from(self.map, offset)[0]
+        sequence |= 1  # Odd while writing (it already is if a writer died halfway).
+        _SEQUENCE.pack_into(self.map, offset, sequence)
+        start = offset + _DATA_OFFSET
+        if key:
+            end = start + len(key) + len(data)
+            self.map[start:end] = key + data
+        _SLOT_HEADER.pack_into(
+            self.map,
+            offset,
+            sequence,
+            key_hash,
+            expiry or 0.0,
+            now,
+            zlib.crc32(data),
+            len(data),
+            len(key),
+            0,
+        )
+        _SEQUENCE.pack_into(self.map, offset, sequence + 1)
+
+    def set_expiry(self, offset, expiry):
+        header = list(_SLOT_HEADER.unpack_from(self.map, offset))
+        sequence = header[0] | 1
+        _SEQUENCE.pack_into(self.map, offset, sequence)
+        header[0], header[2] = sequence, expiry or 0.0
+        _SLOT_HEADER.pack_into(self.map, offset, *header)
+        _SEQUENCE.pack_into(self.map, offset, sequence + 1)
+
+
+class SharedMemoryCache(BaseCache):
+    """
+    A cache backend shared by every process of a host, for the first cache tier: a hash
+    table in a memory-mapped file, with fixed-size slots (see `_SharedTable`).
+
+    Every gunicorn worker maps the same file, so a book cached by one of them is a hit
+    for all the others, and the host holds one copy of the hot books instead of one per
+    worker. The file outlives the processes (put it on a tmpfs such as /dev/shm), so
+    restarted workers find the books cached before. Values are pickled into their slot
+    and unpickled on every read; values larger than a slot are not stored. Reads take no
+    lock; writes lock the key's bucket. LOCATION is the path of the file. It is
+    configured through OPTIONS:
+
+    - MAX_BYTES: the size of the table, in bytes, for the whole host. Defaults to 256
+      MiB.
+    - SLOT_BYTES: the size of a slot, which bounds the size of a key and its pickled
+      value. Defaults to 16 KiB.
+    - WAYS: the number of slots a key may be stored in. Defaults to 8.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        with _stores_lock:
+            if location not in _tables:
+                slot_bytes = int(options.get("SLOT_BYTES", 16 * 2**10))
+                slots = int(options.get("MAX_BYTES", 256 * 2**20)) // slot_bytes
+                _tables[location] = _SharedTable(
+                    location, slots, slot_bytes, int(options.get("WAYS", 8))
+                )
+            self._table = _tables[location]
+
+    def _key(self, key, version):
+        key = self.make_and_validate_key(key, version=version).encode()
+        return key, zlib.crc32(key)
+
+    def _store(self, key, key_hash, value, timeout, only_new):
+        table = self._table
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if _DATA_OFFSET + len(key) + len(data) > table.slot_bytes:
+            table.rejected += 1
+            data = None
+        bucket = key_hash % table.buckets
+        now = time.time()
+        lock = table.lock(bucket)
+        try:
+            offset = table.find(bucket, key, key_hash)
+            if offset is not None and only_new and table.is_live(offset, now):
+                return False
+            if data is None or timeout == 0:
+                if offset is not None:
+                    table.write(offset, b"", 0, b"", None, now)
+                return False
+            if offset is None:
+                offset = table.victim(bucket, now)
+            table.write(
+                offset, key, key_hash, data, self.get_backend_timeout(timeout), now
+            )
+            return True
+        finally:
+            table.unlock(bucket, lock)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._store(*self._key(key, version), value, timeout, only_new=True)
+
+    def get(self, key, default=None, version=None):
+        key, key_hash = self._key(key, version)
+        value = self._table.read(key, key_hash, time.time())
+        return default if value is _MISSING else value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._store(*self._key(key, version), value, timeout, only_new=False)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key, key_hash = self._key(key, version)
+        table = self._table
+        bucket = key_hash % table.buckets
+        lock = table.lock(bucket)
+        try:
+            offset = table.find(bucket, key, key_hash)
+            if offset is None or not table.is_live(offset, time.time()):
+                return False
+            table.set_expiry(offset, self.get_backend_timeout(timeout))
+            return True
+        finally:
+            table.unlock(bucket, lock)
+
+    def has_key(self, key, version=None):
+        key, key_hash = self._key(key, version)
+        return self._table.read(key, key_hash, time.time(), load=False) is not _MISSING
+
+    def delete(self, key, version=None):
+        key, key_hash = self._key(key, version)
+        table = self._table
+        bucket = key_hash % table.buckets
+        lock = table.lock(bucket)
+        try:
+            offset = table.find(bucket, key, key_hash)
+            if offset is None:
+                return False
+            table.write(offset, b"", 0, b"", None, time.time())
+            return True
+        finally:
+            table.unlock(bucket, lock)
+
+    def leads(self):
+        """
+        Tells whether this process applies the changes broadcast to every process, e.g.
+        the invalidation messages, to the table: every process of the host shares it, so
+        a single one of them must. The first process to ask leads until it exits, then
+        the next one to ask takes over.
+
+        Returns:
+            bool: True for the leading process of the host.
+        """
+        return self._table.lead()
+
+    def leader_state(self):
+        """
+        Returns the state saved by the leading process with `save_leader_state`, e.g.
+        how far it applied the broadcast changes, so that the next one resumes from
+        there when it exits.
+
+        Returns:
+            tuple: The three integers saved, or None if none were (or the leader exited
+            while saving them).
+        """
+        table = self._table
+        state = table.map[_LEADER_STATE_OFFSET:_LEADER_STATE_END]
+        (crc,) = _LEADER_STATE_CRC.unpack_from(table.map, _LEADER_STATE_END)
+        return _LEADER_STATE.unpack(state) if zlib.crc32(state) == crc else None
+
+    def save_leader_state(self, *state):
+        """
+        Saves the state of the leading process for the next one (see `leader_state`).
+        Only the leader may call it.
+
+        Args:
+            *state (int): Three integers.
+        """
+        table = self._table
+        data = _LEADER_STATE.pack(*state)
+        table.map[_LEADER_STATE_OFFSET:_LEADER_STATE_END] = data
+        _LEADER_STATE_CRC.pack_into(table.map, _LEADER_STATE_END, zlib.crc32(data))
+
+    def clear(self):
+        table = self._table
+        now = time.time()
+        for bucket in range(table.buckets):
+            lock = table.lock(bucket)
+            try:
+                for offset in table.offsets(bucket):
+                    if _SLOT_HEADER.unpack_from(table.map, offset)[6]:
+                        table.write(offset, b"", 0, b"", None, now)
+            finally:
+                table.unlock(bucket, lock)
+
+    def stats(self):
+        """
+        Reports the usage of the table, shared by the host, and the lookups of this
+        process.
+
+        Entries are counted without locking, so they may be off by the writes in
+        progress.
+
+        Returns:
+            dict: Entry and byte counts, the table size, its slots, and this process'
+            hit, miss, eviction, expiration and rejection (values larger than a slot)
+            counters.
+        """
+        table = self._table
+        now = time.time()
+        entries = used = 0
+        for offset in range(_SLOTS_OFFSET, table.size, table.slot_bytes):
+            _, _, expiry, _, _, value_length, key_length, _ = _SLOT_HEADER.unpack_from(
+                table.map, offset
+            )
+            if key_length and (not expiry or expiry > now):
+                entries += 1
+                used += _DATA_OFFSET + key_length + value_length
+        lookups = table.hits + table.misses
+        return {
+            "entries": entries,
+            "bytes": used,
+            "max_bytes": table.size - _SLOTS_OFFSET,
+            "slots": table.buckets * table.ways,
+            "slot_bytes": table.slot_bytes,
+            "hits": table.hits,
+            "misses": table.misses,
+            "evictions": table.evictions,
+            "expirations": table.expirations,
+            "rejected": table.rejected,
+            "hit_ratio": round(table.hits / lookups, 4) if lookups else None,
+        }
@@ -1,7 +1,15 @@
-import requests
+import asyncio
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
 from django.conf import settings
 from django.core.cache import caches
 
+from . import entries, hotness, invalidation, metrics, tiers, upstream
+from .coalescing import async_book_fills, book_fills
+
 
 class Book:
     """
@@ -20,27 +28,355 @@ class Book:
         """
         self.book_id = book_id
         self.caches = cache_names if cache_names is not None else settings.CACHES
+        self.entry = None  # The cache entry last read or written by get_data.
+        self.upstream_error = None  # Why the last fetch got no answer from the API.
+        self.deadline = (
+            None  # The time.monotonic() time by which the API must answer, if any.
+        )
+
+    @property
+    def stale(self):
+        """
+        bool: Whether the data returned by the last call to get_data was stale.
+        """
+        return entries.state(self.entry) == entries.STALE
+
+    @property
+    def negative(self):
+        """
+        bool: Whether the last call to get_data found that the API has no data for the
+        book.
+        """
+        return entries.is_negative(self.entry)
+
+    @property
+    def upstream_failed(self):
+        """
+        bool: Whether the API could not answer the last fetch: it failed, or its guard
+        did not let it through.
+        """
+        return entries.is_failure(self.entry)
+
+    @property
+    def upstream_timed_out(self):
+        """
+        bool: Whether the API did not answer the last fetch within the latency budget of
+        the request.
+        """
+        return entries.is_negative(self.entry) and self.entry["status"] == 504
 
-    def fetch_book_data(self):
+    def start_deadline(self):
+        """
+        Starts the latency budget of a book request: from now on, the API has
+        UPSTREAM_DEADLINE seconds to answer the fetches of this book (see
+        `upstream.UpstreamClient.get_within`).
+        """
+        if settings.UPSTREAM_DEADLINE > 0:
+            self.deadline = time.monotonic() + settings.UPSTREAM_DEADLINE
+
+    def fetch_book_data(self, store=True):
         """
         Fetches book data from the Taaghche API.
 
-        This method sends a GET request to the Taaghche API to retrieve book data and caches it.
+        This method sends a GET request to the Taaghche API, through the shared pooled
+        client, to retrieve book data and caches it. If the API has no data for the
+        book, a short-lived negative entry is cached instead, so that repeated requests
+        for it do not reach the API. The cache entry is kept in `entry`. While the API's
+        circuit breaker is open, or its rate limit is reached, the request is not sent
+        and a 503 entry is kept instead (see `upstream_failed` and `upstream_error`).
+        Once a deadline is started (see `start_deadline`), the request is hedged when
+        late, and a 504 entry is kept if the API has not answered by the deadline; its
+        answer is still cached when it arrives.
+
+        Args:
+            store (bool, optional): Whether to set the fetched data in the caches.
+                Defaults to True.
 
         Returns:
             dict: The book data if successfully fetched, None otherwise.
         """
-        url = f"https://get.taaghche.com/v2/book/{self.book_id}/"
-        response = requests.get(
-            url, headers={"User-Agent": "TaaghcheApplication/1.0", "accepts": "*/*"}
-        )
+        self.upstream_error = None
+        start = time.perf_counter()
+        path = f"/v2/book/{self.book_id}/"
+        try:
+            if self.deadline is None:
+                response = upstream.get_client().get(path)
+            else:
+                response = upstream.get_client().get_within(path, self.deadline)
+            status_code = outcome = response.status_code
+        except upstream.UpstreamTimeout as error:
+            status_code, outcome = 504, "timeout"
+            self.upstream_error = str(error)
+            self._store_late_answer(error.pending)
+        except upstream.UpstreamUnavailable as error:
+            status_code, outcome = 503, "rejected"
+            self.upstream_error = str(error)
+        except upstream.UpstreamError as error:
+            status_code, outcome = 502, "error"
+            self.upstream_error = str(error)
+        metrics.upstream_request(outcome, time.perf_counter() - start)
 
-        if response.status_code == 200:
+        if status_code == 200:
             data = response.json()
-            self.set_cached_data(data)
-            return data
+            entry = entries.wrap(data)
+        else:
+            data = None
+            entry = entries.wrap_negative(status_code)
 
-        return None
+        if store:
+            self.set_cached_data(entry)
+        self.entry = entry
+        return data
+
+    def _store_late_answer(self, attempts):
+        """
+        Caches the first successful answer of the API requests still running after the
+        deadline, so that the next requests for the book find it.
+
+        Args:
+            attempts (list): The futures of the requests.
+        """
+        once = (
+            threading.Lock()
+        )  # Acquired by the first answer stored, and never released.
+
+        def store(attempt):
+            try:
+                response = attempt.result()
+            except upstream.UpstreamError:
+                return
+            if response.status_code == 200 and once.acquire(blocking=False):
+                Book(self.book_id, self.caches).set_cached_data(response.json())
+
+        for attempt in attempts:
+            attempt.add_done_callback(store)
+
+    @classmethod
+    def get_many_entries(cls, book_ids, cache_names=None):
+        """
+        Retrieves the cache entries of several books at once.
+
+        Each cache is queried once for all the books it may hold (a single MGET on
+        Redis), and only the books missing from every cache are fetched from the API,
+        concurrently. Every cache is then backfilled with a single pipelined write, and
+        a background refresh is scheduled for each stale entry.
+
+        Args:
+            book_ids (list): The unique identifiers of the books.
+            cache_names (list, optional): A list of cache names. Defaults to None, which
+                uses the settings-defined caches.
+
+        Returns:
+            dict: Each book ID mapped to a tuple of its cache entry and the source of
+            the entry, or (None, None) if not found.
+        """
+        cache_names = list(cache_names if cache_names is not None else settings.CACHES)
+        remaining = list(dict.fromkeys(book_ids))
+        for book_id in remaining:
+            hotness.record(book_id)
+        results = {}
+        missed_in = {}
+
+        for cache_name in cache_names:
+            if not remaining:
+                break
+            missed_in[cache_name] = set(remaining)
+            found = caches[cache_name].get_many(remaining)
+            lookups = Counter()
+            for book_id, entry in found.items():
+                if entries.state(entry) in entries.FOUND:
+                    results[book_id] = (entry, cache_name)
+                lookups[metrics.lookup_result(entry)] += 1
+            lookups["miss"] += len(remaining) - len(found)
+            for result, count in lookups.items():
+                metrics.lookup(cache_name, result, count)
+            remaining = [book_id for book_id in remaining if book_id not in results]
+
+        if remaining:
+            results.update(cls._fetch_many(remaining, cache_names))
+
+        for cache_name, missed in missed_in.items():
+            backfill = {}
+            for book_id, (entry, place) in results.items():
+                if entry and book_id in missed and place != cache_name:
+                    backfill.setdefault(entries.timeout(entry), {})[book_id] = entry
+            for timeout, values in backfill.items():
+                tiers.write_many([cache_name], values, timeout)
+
+        for book_id, (entry, place) in results.items():
+            if entries.state(entry) == entries.STALE:
+                cls(book_id=book_id, cache_names=cache_names).schedule_refresh()
+
+        return {book_id: results.get(book_id, (None, None)) for book_id in book_ids}
+
+    @classmethod
+    def _fetch_many(cls, book_ids, cache_names):
+        """
+        Fetches several books from the API concurrently, without setting them in the
+        caches.
+
+        Each fetch is coalesced with concurrent misses for the same book, like in
+        `get_data`.
+
+        Returns:
+            dict: Each book ID mapped to a tuple of its new cache entry and the source
+            of the entry.
+        """
+
+        def fetch(book_id):
+            book = cls(book_id=book_id, cache_names=cache_names)
+            book.start_deadline()
+
+            def fill():
+                book.fetch_book_data(store=False)
+                if book.upstream_failed:
+                    expired = book._find_expired()
+                    if expired is not None:
+                        return expired
+                return (book.entry, "upstream") if book.entry else (None, None)
+
+            result = book_fills.do(str(book_id), fill, book._find_in_caches)
+            return book_id, result if result is not None else (None, None)
+
+        workers = min(settings.BOOK_BATCH_UPSTREAM_CONCURRENCY, len(book_ids))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(executor.map(fetch, book_ids))
+
+    @classmethod
+    def fetch_many(cls, book_ids, concurrency=None, throttle=None):
+        """
+        Fetches several books from the API concurrently, without reading nor setting
+        them in the caches.
+
+        Args:
+            book_ids (list): The unique identifiers of the books.
+            concurrency (int, optional): How many books to fetch at the same time.
+                Defaults to BOOK_BULK_UPSTREAM_CONCURRENCY.
+            throttle (callable, optional): Called before each request, e.g. to enforce a
+                rate limit.
+
+        Returns:
+            dict: Each book ID mapped to its new cache entry (possibly negative).
+        """
+
+        def fetch(book_id):
+            if throttle is not None:
+                throttle()
+            book = cls(book_id=book_id)
+            book.fetch_book_data(store=False)
+            return book_id, book.entry
+
+        concurrency = concurrency or settings.BOOK_BULK_UPSTREAM_CONCURRENCY
+        workers = max(1, min(concurrency, len(book_ids)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(executor.map(fetch, book_ids))
+
+    @classmethod
+    def store_many(cls, values, cache_names=None):
+        """
+        Writes the cache entries of several books to the caches, in bulk.
+
+        Shared caches (Redis) get one pipelined write per kind of entry; caches held in
+        the memory of each process get the new entries through the invalidation bus, in
+        a single round-trip. Negative entries for API errors never replace existing
+        data, like in `set_in_cache`.
+
+        Args:
+            values (dict): Each book ID mapped to its cache entry.
+            cache_names (list, optional): A list of cache names. Defaults to None, which
+                uses the settings-defined caches.
+
+        Returns:
+            dict: The write result of each cache (see `write_to_caches`), summed over
+            the books.
+        """
+        cache_names = list(cache_names if cache_names is not None else settings.CACHES)
+        groups = {}
+        for book_id, entry in values.items():
+            nx = entries.is_negative(entry) and entry["status"] >= 500
+            groups.setdefault((entries.timeout(entry), nx), {})[book_id] = entry
+
+        results = {}
+        for cache_name in cache_names:
+            result = {"cache": cache_name, "success": True, "written": 0, "error": None}
+            for (timeout, nx), group in groups.items():
+                group_result = tiers.write_many([cache_name], group, timeout, nx=nx)[
+                    cache_name
+                ]
+                metrics.writes({cache_name: group_result}, len(group))
+                result["written"] += group_result["written"]
+                if not group_result["success"]:
+                    result.update(success=False, error=group_result["error"])
+            results[cache_name] = result
+
+        if set(cache_names) & set(invalidation.local_tiers()):
+            invalidation.publish_many(
+                [
+                    (book_id, invalidation.SET, entry, False)
+                    for book_id, entry in values.items()
+                ]
+            )
+        return results
+
+    @classmethod
+    def refresh_many(cls, book_ids, cache_names=None):
+        """
+        Fetches several books from the API concurrently and writes them to the caches,
+        in bulk.
+
+        See `fetch_many` and `store_many`.
+
+        Args:
+            book_ids (list): The unique identifiers of the books.
+            cache_names (list, optional): A list of cache names. Defaults to None, which
+                uses the settings-defined caches.
+
+        Returns:
+            tuple: Each book ID mapped to its new cache entry, and the write result of
+            each cache.
+        """
+        fetched = cls.fetch_many(book_ids)
+        return fetched, cls.store_many(fetched, cache_names)
+
+    @classmethod
+    def delete_many(cls, book_ids, cache_names=None, negative_only=False):
+        """
+        Deletes several books from the caches, in bulk.
+
+        Shared caches (Redis) get one pipelined delete; caches held in the memory of
+        each process are cleared in every process through the invalidation bus, in a
+        single round-trip.
+
+        Args:
+            book_ids (list): The unique identifiers of the books.
+            cache_names (list, optional): A list of cache names. Defaults to None, which
+                uses the settings-defined caches.
+            negative_only (bool, optional): Only delete negative entries, keeping actual
+                book data. Defaults to False.
+
+        Returns:
+            dict: Each cache name mapped to its result (see `tiers.delete_many`).
+        """
+        cache_names = list(cache_names if cache_names is not None else settings.CACHES)
+        results = {}
+        for cache_name in cache_names:
+            keys = book_ids
+            if negative_only:
+                keys = [
+                    book_id
+                    for book_id, entry in caches[cache_name].get_many(book_ids).items()
+                    if entries.is_negative(entry)
+                ]
+            results.update(tiers.delete_many([cache_name], keys))
+
+        if set(cache_names) & set(invalidation.local_tiers()):
+            invalidation.publish_many(
+                [
+                    (book_id, invalidation.DELETE, None, negative_only)
+                    for book_id in book_ids
+                ]
+            )
+        return results
 
     def get_cached_data(self):
         """
@@ -48,17 +384,30 @@ class Book:
 
         It checks each cache for the book data and if found, it returns the data and the cache name.
         If the data is missing in a cache, it ensures that the data is set in all previously missed caches.
+        Stale data is returned too; expired data is treated as missing. A negative entry
+        returns None with the cache name.
 
         Returns:
             tuple: A tuple containing the book data and the cache name it was found in, or (None, None) if not found.
         """
+        entry, place = self.get_cached_entry()
+        return entries.unwrap(entry), place
+
+    def get_cached_entry(self):
+        """
+        Retrieves the cache entry of the book from the caches. See `get_cached_data`.
+
+        Returns:
+            tuple: A tuple containing the cache entry and the cache name it was found
+            in, or (None, None) if not found.
+        """
         missing_cache = []
         for cache_name in self.caches:
-            data = self.get_from_cache(cache_name)
-            if data:
-                for cache in missing_cache:
-                    self.set_in_cache(cache, data)
-                return data, cache_name
+            entry = self.get_from_cache(cache_name)
+            if entries.state(entry) in entries.FOUND:
+                if missing_cache:
+                    self.write_to_caches(missing_cache, entry)
+                return entry, cache_name
             missing_cache.append(cache_name)
 
         return None, None
@@ -67,60 +416,103 @@ class Book:
         """
         Sets the book data in all specified caches.
 
+        The data is wrapped in a single fresh cache entry shared by every cache.
+
         Args:
-            value (dict): The book data to be cached.
+            value (dict): The book data to be cached, or a cache entry.
 
         Returns:
-            dict: A dictionary indicating success for each cache.
+            dict: The write result of each cache (see `write_to_caches`).
         """
-        result = {}
-        for cache_name in self.caches:
-            result[cache_name] = self.set_in_cache(cache_name, value)
-        return result
+        self.entry = value if entries.is_entry(value) else entries.wrap(value)
+        return self.write_to_caches(self.caches, self.entry)
 
     def get_from_cache(self, cache_name):
         """
-        Retrieves the book data from a specific cache.
+        Retrieves the cache entry of the book from a specific cache.
 
         Args:
             cache_name (str): The name of the cache to retrieve data from.
 
         Returns:
-            dict: The book data if found, None otherwise.
+            dict: The cache entry (see `entries`) if found, None otherwise.
         """
-        cache = caches[cache_name]
-        data = cache.get(self.book_id)
-        return data if data is not None else None
+        entry = caches[cache_name].get(self.book_id)
+        metrics.lookup(cache_name, metrics.lookup_result(entry))
+        return entry
 
     def set_in_cache(self, cache_name, value):
         """
         Sets the book data in a specific cache.
 
+        Negative entries for API errors never replace existing data, so that a failed
+        refresh does not hide data that can still be served. If the cache is held in the
+        memory of each process, every other process gets the new entry too, through the
+        invalidation bus.
+
         Args:
             cache_name (str): The name of the cache to set data in.
-            value (dict): The book data to be cached.
+            value (dict): The book data to be cached, or a cache entry to copy as is.
 
         Returns:
-            str: A message indicating whether the data was successfully set or not.
+            dict: The write result of the cache (see `write_to_caches`).
         """
-        cache = caches[cache_name]
-        cache.set(self.book_id, value)
-        if cache.get(self.book_id):
-            return f"Data for {self.book_id} set in {cache_name} cache"
-        return f"Data for {self.book_id} not set in {cache_name} cache"
+        if not entries.is_entry(value):
+            value = entries.wrap(value)
+        result = self.write_to_caches([cache_name], value)[cache_name]
+        if cache_name in invalidation.local_tiers():
+            invalidation.publish(self.book_id, invalidation.SET, entry=value)
+        return result
+
+    def write_to_caches(self, cache_names, entry):
+        """
+        Writes a cache entry of the book to several caches.
+
+        Every cache gets a single write (one pipelined round-trip on Redis), and the
+        result is taken from the write acknowledgements rather than read back. Negative
+        entries for API errors are only written where the book is missing, so that a
+        failed refresh does not hide data that can still be served.
 
-    def delete_in_cache(self, cache_name):
+        Args:
+            cache_names (list): The names of the caches to write to.
+            entry (dict): The cache entry.
+
+        Returns:
+            dict: Each cache name mapped to its result: `success`, `written` (0 if the
+            cache kept the data it had) and `error` (see `tiers.write_many`).
+        """
+        results = tiers.write_many(
+            cache_names,
+            {self.book_id: entry},
+            entries.timeout(entry),
+            nx=entries.is_negative(entry) and entry["status"] >= 500,
+        )
+        metrics.writes(results)
+        return results
+
+    def delete_in_cache(self, cache_name, negative_only=False):
         """
         Deletes the book data from a specific cache.
 
+        If the cache is held in the memory of each process, the book is evicted from
+        every other process too, through the invalidation bus.
+
         Args:
             cache_name (str): The name of the cache to delete data from.
+            negative_only (bool, optional): Only delete a negative entry, keeping actual
+                book data. Defaults to False.
 
         Returns:
             str: A message indicating whether the data was successfully deleted or not.
         """
+        if cache_name in invalidation.local_tiers():
+            invalidation.publish(
+                self.book_id, invalidation.DELETE, negative_only=negative_only
+            )
+
         cache = caches[cache_name]
-        if cache.get(self.book_id) is not None:
+        entry = cache.get(self.book_id)
+        if entry is not None and (entries.is_negative(entry) or not negative_only):
             cache.delete(self.book_id)
             return f"Deleted data in {cache_name} cache"
         else:
@@ -130,12 +522,338 @@ class Book:
         """
         Retrieves the book data, first attempting to get it from the cache, and if not found, fetching it from the API.
 
+        Concurrent misses for the same book are coalesced, so only one caller in the
+        cluster goes upstream while the others wait for its result. Stale data is
+        returned at once, and a single background refresh is scheduled for it (see
+        `stale`).
+
         Returns:
             tuple: A tuple containing the book data and the source of the data ("upstream" or cache name).
+                   The data is None if the book was not found; the source is then None
+                   too, unless a negative entry was found (see `negative`).
+        """
+        entry, place = self.get_entry()
+        return entries.unwrap(entry), place
+
+    def get_entry(self):
+        """
+        Retrieves the cache entry of the book, like `get_data`, without decoding the
+        book data.
+
+        Views serve the entry as is with `entries.render`, so cache hits never decode
+        the payload. The lookup is counted towards the hot books (see `hotness`).
+
+        Returns:
+            tuple: A tuple containing the cache entry and the source of the entry, or
+            (None, None) if not found.
+        """
+        start = time.perf_counter()
+        self.start_deadline()
+        hotness.record(self.book_id)
+        entry, place = self.get_cached_entry()
+        if not entry:
+            result = book_fills.do(
+                str(self.book_id), self._fill_from_upstream, self._find_in_caches
+            )
+            entry, place = result if result is not None else (None, None)
+
+        self.entry = entry
+        state = entries.state(entry)
+        if state == entries.STALE:
+            self.schedule_refresh()
+        metrics.request(place, state, time.perf_counter() - start)
+        return entry, place
+
+    def schedule_refresh(self):
+        """
+        Schedules a background refresh of the book through the `refresh_book_cache`
+        Celery task.
+
+        At most one refresh per book is scheduled across the cluster within
+        BOOK_REFRESH_LOCK_TIMEOUT. Failures are ignored: the stale data keeps being
+        served until a refresh gets through.
+
+        Returns:
+            bool: True if a refresh was scheduled.
+        """
+        from .tasks import refresh_book_cache
+
+        try:
+            cache = caches[settings.BOOK_FILL_LOCK_CACHE]
+            if not cache.add(
+                f"book-refresh:{self.book_id}", 1, settings.BOOK_REFRESH_LOCK_TIMEOUT
+            ):
+                return False
+            refresh_book_cache.delay(self.book_id)
+        except Exception:
+            return False
+        return True
+
+    def _fill_from_upstream(self):
+        """
+        Fetches the book data from the API on behalf of every caller waiting on this
+        miss.
+
+        If the API cannot answer and a cache still holds expired data for the book, that
+        data is served (and cached) as stale instead, for BOOK_ERROR_TTL seconds (see
+        `entries.revive`).
+
+        Returns:
+            tuple: The new cache entry (possibly negative) and "upstream", or the
+            revived entry and the cache it was found in, or (None, None) if there is
+            none.
+        """
+        start = time.perf_counter()
+        try:
+            self.fetch_book_data()
+            if self.upstream_failed:
+                expired = self._find_expired()
+                if expired is not None:
+                    self.set_cached_data(expired[0])
+                    return expired
+            if self.entry:
+                return self.entry, "upstream"
+            return None, None
+        finally:
+            metrics.fill(time.perf_counter() - start)
+
+    def _find_in_caches(self):
+        """
+        Looks for data stored by a fill running in another process.
+
+        Returns:
+            tuple: The cache entry and the cache name, or None if no cache has it yet.
+        """
+        entry, place = self.get_cached_entry()
+        return (entry, place) if entry else None
+
+    def _find_expired(self):
+        """
+        Looks for expired book data to serve while the API cannot answer.
+
+        Returns:
+            tuple: The revived cache entry and the cache name it was found in, or None
+            if no cache has any.
+        """
+        for cache_name in self.caches:
+            entry = self.get_from_cache(cache_name)
+            if entries.state(entry) == entries.EXPIRED and not entries.is_negative(
+                entry
+            ):
+                return entries.revive(entry), cache_name
+        return None
+
+
+# The tasks caching late answers of the API: the event loop only keeps weak references
+# to its tasks.
+_late_answers = set()
+
+
+class AsyncBook(Book):
+    """
+    A Book whose data access runs on the event loop, for the async view.
+
+    Each synchronous method of Book has an awaitable counterpart prefixed with "a".
+    Cache tiers and the Taaghche API are reached through asyncio clients, so a request
+    waiting on I/O does not hold a thread.
+    """
+
+    async def afetch_book_data(self):
+        """
+        Fetches book data from the Taaghche API without blocking the event loop. See
+        `Book.fetch_book_data`.
+        """
+        self.upstream_error = None
+        start = time.perf_counter()
+        path = f"/v2/book/{self.book_id}/"
+        try:
+            if self.deadline is None:
+                response = await upstream.get_async_client().get(path)
+            else:
+                response = await upstream.get_async_client().get_within(
+                    path, self.deadline
+                )
+            status_code = outcome = response.status_code
+        except upstream.UpstreamTimeout as error:
+            status_code, outcome = 504, "timeout"
+            self.upstream_error = str(error)
+            _late_answers.add(
+                asyncio.ensure_future(self._astore_late_answer(error.pending))
+            )
+        except upstream.UpstreamUnavailable as error:
+            status_code, outcome = 503, "rejected"
+            self.upstream_error = str(error)
+        except upstream.UpstreamError as error:
+            status_code, outcome = 502, "error"
+            self.upstream_error = str(error)
+        metrics.upstream_request(outcome, time.perf_counter() - start)
+
+        if status_code == 200:
+            data = response.json()
+            entry = entries.wrap(data)
+        else:
+            data = None
+            entry = entries.wrap_negative(status_code)
+
+        await self.aset_cached_data(entry)
+        return data
+
+    async def _astore_late_answer(self, attempts):
+        """
+        Caches the first successful answer of the API requests still running after the
+        deadline. See `Book._store_late_answer`.
+        """
+        try:
+            for attempt in asyncio.as_completed(attempts):
+                try:
+                    response = await attempt
+                except upstream.UpstreamError:
+                    continue
+                if response.status_code == 200:
+                    await AsyncBook(self.book_id, self.caches).aset_cached_data(
+                        response.json()
+                    )
+                    return
+        finally:
+            _late_answers.discard(asyncio.current_task())
+
+    async def aget_cached_entry(self):
+        """
+        Retrieves the cache entry of the book from the caches. See
+        `Book.get_cached_entry`.
+        """
+        missing_cache = []
+        for cache_name in self.caches:
+            entry = await self.aget_from_cache(cache_name)
+            if entries.state(entry) in entries.FOUND:
+                if missing_cache:
+                    await self.awrite_to_caches(missing_cache, entry)
+                return entry, cache_name
+            missing_cache.append(cache_name)
+
+        return None, None
+
+    async def aset_cached_data(self, value):
+        """
+        Sets the book data in all specified caches. See `Book.set_cached_data`.
+        """
+        self.entry = value if entries.is_entry(value) else entries.wrap(value)
+        return await self.awrite_to_caches(self.caches, self.entry)
+
+    async def aget_from_cache(self, cache_name):
+        """
+        Retrieves the cache entry of the book from a specific cache. See
+        `Book.get_from_cache`.
+        """
+        entry = await tiers.aget(cache_name, self.book_id)
+        metrics.lookup(cache_name, metrics.lookup_result(entry))
+        return entry
+
+    async def aset_in_cache(self, cache_name, value):
+        """
+        Sets the book data in a specific cache, and publishes it to the other processes.
+        See `Book.set_in_cache`.
+        """
+        if not entries.is_entry(value):
+            value = entries.wrap(value)
+        result = (await self.awrite_to_caches([cache_name], value))[cache_name]
+        if cache_name in invalidation.local_tiers():
+            await invalidation.apublish(self.book_id, invalidation.SET, entry=value)
+        return result
+
+    async def awrite_to_caches(self, cache_names, entry):
         """
-        data, place = self.get_cached_data()
-        if not data:
-            data = self.fetch_book_data()
-            if data:
-                place = "upstream"
-        return data, place
+        Writes a cache entry of the book to several caches. See `Book.write_to_caches`.
+        """
+        results = await tiers.awrite_many(
+            cache_names,
+            {self.book_id: entry},
+            entries.timeout(entry),
+            nx=entries.is_negative(entry) and entry["status"] >= 500,
+        )
+        metrics.writes(results)
+        return results
+
+    async def aget_data(self):
+        """
+        Retrieves the book data from the caches, or from the API on a miss. See
+        `Book.get_data`.
+        """
+        entry, place = await self.aget_entry()
+        return entries.unwrap(entry), place
+
+    async def aget_entry(self):
+        """
+        Retrieves the cache entry of the book without decoding the book data. See
+        `Book.get_entry`.
+        """
+        start = time.perf_counter()
+        self.start_deadline()
+        hotness.record(self.book_id)
+        entry, place = await self.aget_cached_entry()
+        if not entry:
+            result = await async_book_fills.do(
+                str(self.book_id), self._afill_from_upstream, self._afind_in_caches
+            )
+            entry, place = result if result is not None else (None, None)
+
+        self.entry = entry
+        state = entries.state(entry)
+        if state == entries.STALE:
+            # Publishing the Celery task may block on the broker, so it must not hold up
+            # the response.
+            asyncio.get_running_loop().run_in_executor(None, self.schedule_refresh)
+        metrics.request(place, state, time.perf_counter() - start)
+        return entry, place
+
+    async def _afill_from_upstream(self):
+        """
+        Fetches the book data from the API on behalf of every caller waiting on this
+        miss, without blocking the event loop. See `Book._fill_from_upstream`.
+
+        Returns:
+            tuple: The new cache entry (possibly negative) and "upstream", or the
+            revived entry and the cache it was found in, or (None, None) if there is
+            none.
+        """
+        start = time.perf_counter()
+        try:
+            await self.afetch_book_data()
+            if self.upstream_failed:
+                expired = await self._afind_expired()
+                if expired is not None:
+                    await self.aset_cached_data(expired[0])
+                    return expired
+            if self.entry:
+                return self.entry, "upstream"
+            return None, None
+        finally:
+            metrics.fill(time.perf_counter() - start)
+
+    async def _afind_in_caches(self):
+        """
+        Looks for data stored by a fill running in another process. See
+        `Book._find_in_caches`.
+
+        Returns:
+            tuple: The cache entry and the cache name, or None if no cache has it yet.
+        """
+        entry, place = await self.aget_cached_entry()
+        return (entry, place) if entry else None
+
+    async def _afind_expired(self):
+        """
+        Looks for expired book data to serve while the API cannot answer. See
+        `Book._find_expired`.
+
+        Returns:
+            tuple: The revived cache entry and the cache name it was found in, or None
+            if no cache has any.
+        """
+        for cache_name in self.caches:
+            entry = await self.aget_from_cache(cache_name)
+            if entries.state(entry) == entries.EXPIRED and not entries.is_negative(
+                entry
+            ):
+                return entries.revive(entry), cache_name
+        return None
@@ -0,0 +1,450 @@
+import bisect
+import hashlib
+import logging
+import random
+import socket
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.exceptions import ImproperlyConfigured
+from django_redis.client import DefaultClient
+from django_redis.exceptions import ConnectionInterrupted
+from redis.exceptions import ConnectionError, TimeoutError
+
+logger = logging.getLogger(__name__)
+
+# The errors telling that a server cannot be reached, as opposed to errors in the
+# command itself.
+UNAVAILABLE = (ConnectionError, TimeoutError, socket.timeout)
+
+# The servers found unreachable, mapped to the time until which they are skipped. Shared
+# by the clients of every thread, as Django creates a cache backend per thread.
+_down = {}
+_down_lock = threading.Lock()
+
+_RAISE = object()
+
+
+class ShardUnavailable(ConnectionError):
+    """
+    Raised when no server of the shard holding a key can be reached.
+    """
+
+
+class HashRing:
+    """
+    A consistent hash ring with virtual nodes.
+
+    Each node is placed on the ring at `vnodes` points, and a key belongs to the node of
+    the first point after its hash. Adding a node only moves the keys falling just
+    before its points, about 1/N of them, from every other node evenly; removing a node
+    only moves its own keys. The points of a node only depend on its name, so the nodes
+    can be listed in any order.
+    """
+
+    def __init__(self, nodes, vnodes=160):
+        points = sorted(
+            (_hash(f"{node}#{index}"), node)
+            for node in nodes
+            for index in range(vnodes)
+        )
+        if not points:
+            raise ValueError("A hash ring needs at least one node")
+        self.hashes = [point for point, _ in points]
+        self.nodes = [node for _, node in points]
+
+    def node(self, key):
+        """
+        Returns the node a key belongs to.
+
+        Args:
+            key (str): The key.
+
+        Returns:
+            The node.
+        """
+        index = bisect.bisect(self.hashes, _hash(key))
+        return self.nodes[index % len(self.nodes)]
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+def parse_location(location):
+    """
+    Parses the LOCATION of a sharded cache into its shards.
+
+    Args:
+        location (str or list): Shards separated by semicolons, or a list of shards.
+            Each shard is a comma separated list of Redis URLs: its primary, then its
+            replicas.
+
+    Returns:
+        list: The Redis URLs of each shard, primary first.
+    """
+    if isinstance(location, str):
+        location = location.split(";")
+    shards = [
+        [url.strip() for url in shard.split(",") if url.strip()] for shard in location
+    ]
+    return [shard for shard in shards if shard]
+
+
+class ShardedClient(DefaultClient):
+    """
+    A django-redis client spreading the keys of a cache over several Redis shards, with
+    consistent hashing.
+
+    A shard is a primary server, where its keys are written, and optional replicas,
+    which serve its reads. Keys are placed on the shards with a `HashRing`, named after
+    their primaries, so that adding a shard only moves about 1/N of the keys. A server
+    that cannot be reached is skipped for SHARD_RETRY_INTERVAL seconds by every client
+    of the process: reads go to another server of its shard if there is one, and
+    otherwise find nothing, and writes are dropped, so the caller falls through to the
+    next tier or the upstream API instead of failing. Commands that cannot be dropped
+    (incr, locks...) still raise. The LOCATION is parsed by `parse_location`; a single
+    URL is a single shard, which behaves like django-redis's DefaultClient. Keys not
+    tied to a book, such as the invalidation stream, go to the first shard through
+    `get_client`. It is configured through the
+    cache OPTIONS:
+
+    - VIRTUAL_NODES: the points of each shard on the ring. Defaults to 160.
+    - SHARD_RETRY_INTERVAL: seconds an unreachable server is skipped for. Defaults to 5.
+    """
+
+    def __init__(self, server, params, backend):
+        shards = parse_location(server)
+        if not shards:
+            raise ImproperlyConfigured("Missing connections string")
+        super().__init__([url for shard in shards for url in shard], params, backend)
+        self.shards = []
+        for shard in shards:
+            start = sum(len(urls) for urls in self.shards)
+            self.shards.append(list(range(start, start + len(shard))))
+        self.retry_interval = self._options.get("SHARD_RETRY_INTERVAL", 5)
+        by_primary = {self._server[shard[0]]: shard for shard in self.shards}
+        if len(by_primary) != len(self.shards):
+            raise ImproperlyConfigured("Each shard needs its own primary")
+        self.ring = HashRing(by_primary, self._options.get("VIRTUAL_NODES", 160))
+        self._shard_of = by_primary
+
+    def shard(self, key=None):
+        """
+        Returns the shard holding a key: the first one without a key.
+
+        Args:
+            key (optional): The cache key, made with `make_key`.
+
+        Returns:
+            list: The indexes of the servers of the shard, primary first.
+        """
+        if key is None or len(self.shards) == 1:
+            return self.shards[0]
+        return self._shard_of[self.ring.node(str(key))]
+
+    def candidates(self, key=None, write=True):
+        """
+        Returns the reachable servers that may serve a command on a key, in the order to
+        try them.
+
+        Args:
+            key (optional): The cache key, made with `make_key`.
+            write (bool, optional): Whether the command writes. Writes only go to the
+                primary of the shard, reads go to a random replica first. Defaults to
+                True.
+
+        Returns:
+            list: Server indexes, empty if the shard cannot be reached.
+        """
+        shard = self.shard(key)
+        if write or len(shard) == 1:
+            servers = shard[:1]
+        else:
+            servers = random.sample(shard[1:], len(shard) - 1) + shard[:1]
+        return [index for index in servers if self.available(index)]
+
+    def available(self, index):
+        """
+        Tells whether a server may be tried, i.e. it was not found unreachable in the
+        last SHARD_RETRY_INTERVAL.
+        """
+        until = _down.get(self._server[index])
+        return until is None or until <= time.monotonic()
+
+    def mark_down(self, index, error):
+        """
+        Skips an unreachable server for SHARD_RETRY_INTERVAL seconds.
+
+        Args:
+            index (int): The index of the server.
+            error (Exception): Why it is unreachable.
+        """
+        url = self._server[index]
+        with _down_lock:
+            if self.available(index):
+                logger.warning(
+                    "Redis server %s is unreachable, skipping it: %r",
+                    _safe_url(url),
+                    error,
+                )
+            _down[url] = time.monotonic() + self.retry_interval
+
+    def connection(self, index):
+        """
+        Returns the Redis client of a server.
+        """
+        if self._clients[index] is None:
+            self._clients[index] = self.connect(index)
+        return self._clients[index]
+
+    def get_client(self, write=True, tried=None, show_index=False, key=None):
+        """
+        Returns the Redis client of the server serving a key, reachable or not: the
+        first shard without a key.
+        """
+        index = (self.candidates(key, write) or self.shard(key))[0]
+        client = self.connection(index)
+        return (client, index) if show_index else client
+
+    def group(self, keys, write, version=None):
+        """
+        Groups keys by the server to send them to.
+
+        Args:
+            keys (list): The cache keys, as given to the cache.
+            write (bool): Whether the keys are written.
+            version (int, optional): The version of the keys.
+
+        Returns:
+            list: (server index, Redis client, keys) tuples. The keys of unreachable
+            shards are returned with None for the index and client.
+        """
+        groups, servers = {}, {}
+        for key in keys:
+            cache_key = self.make_key(key, version=version)
+            primary = self.shard(cache_key)[0]
+            if primary not in servers:
+                candidates = self.candidates(cache_key, write)
+                servers[primary] = candidates[0] if candidates else None
+            groups.setdefault(servers[primary], []).append(key)
+        return [
+            (index, None if index is None else self.connection(index), group)
+            for index, group in groups.items()
+        ]
+
+    def _on_shard(self, key, write, fallback, method, *args, **kwargs):
+        # Runs `method` on the shard of `key`, trying each reachable server of the shard
+        # in turn.
+        error = None
+        for index in self.candidates(key, write):
+            try:
+                return method(*args, client=self.connection(index), **kwargs)
+            except ConnectionInterrupted as interrupted:
+                if not isinstance(interrupted.__cause__, UNAVAILABLE):
+                    raise
+                error = interrupted.__cause__
+            except UNAVAILABLE as unavailable:
+                error = unavailable
+            self.mark_down(index, error)
+        if fallback is _RAISE:
+            raise ShardUnavailable(
+                f"No server of the shard of {key} is reachable"
+            ) from error
+        return fallback
+
+    def _on_every_shard(self, method, *args, **kwargs):
+        # Runs `method` on the primary of every shard, skipping the unreachable ones.
+        results = []
+        for shard in self.shards:
+            try:
+                results.append(
+                    method(*args, client=self.connection(shard[0]), **kwargs)
+                )
+            except ConnectionInterrupted as interrupted:
+                if not isinstance(interrupted.__cause__, UNAVAILABLE):
+                    raise
+                self.mark_down(shard[0], interrupted.__cause__)
+            except UNAVAILABLE as error:
+                self.mark_down(shard[0], error)
+        return results
+
+    def get(self, key, default=None, version=None, client=None):
+        if client is not None:
+            return super().get(key, default, version, client)
+        key = self.make_key(key, version=version)
+        return self._on_shard(key, False, default, super().get, key, default, version)
+
+    def set(
+        self,
+        key,
+        value,
+        timeout=DEFAULT_TIMEOUT,
+        version=None,
+        client=None,
+        nx=False,
+        xx=False,
+    ):
+        if client is not None:
+            return super().set(key, value, timeout, version, client, nx, xx)
+        key = self.make_key(key, version=version)
+        return self._on_shard(
+            key, True, False, super().set, key, value, timeout, version, nx=nx, xx=xx
+        )
+
+    def delete(self, key, version=None, prefix=None, client=None):
+        if client is not None:
+            return super().delete(key, version, prefix, client)
+        key = self.make_key(key, version=version, prefix=prefix)
+        return self._on_shard(key, True, 0, super().delete, key, version, prefix)
+
+    def has_key(self, key, version=None, client=None):
+        if client is not None:
+            return super().has_key(key, version, client)
+        key = self.make_key(key, version=version)
+        return self._on_shard(key, False, False, super().has_key, key, version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None, client=None):
+        if client is not None:
+            return super().touch(key, timeout, version, client)
+        key = self.make_key(key, version=version)
+        return self._on_shard(key, True, False, super().touch, key, timeout, version)
+
+    def ttl(self, key, version=None, client=None):
+        if client is not None:
+            return super().ttl(key, version, client)
+        key = self.make_key(key, version=version)
+        return self._on_shard(key, False, None, super().ttl, key, version)
+
+    def pttl(self, key, version=None, client=None):
+        if client is not None:
+            return super().pttl(key, version, client)
+        key = self.make_key(key, version=version)
+        return self._on_shard(key, False, None, super().pttl, key, version)
+
+    def expire(self, key, timeout, version=None, client=None):
+        if client is not None:
+            return super().expire(key, timeout, version, client)
+        key = self.make_key(key, version=version)
+        return self._on_shard(key, True, False, super().expire, key, timeout, version)
+
+    def persist(self, key, version=None, client=None):
+        if client is not None:
+            return super().persist(key, version, client)
+        key = self.make_key(key, version=version)
+        return self._on_shard(key, True, False, super().persist, key, version)
+
+    def incr(self, key, delta=1, version=None, client=None, ignore_key_check=False):
+        if client is not None:
+            return super().incr(key, delta, version, client, ignore_key_check)
+        key = self.make_key(key, version=version)
+        return self._on_shard(
+            key,
+            True,
+            _RAISE,
+            super().incr,
+            key,
+            delta,
+            version,
+            ignore_key_check=ignore_key_check,
+        )
+
+    def decr(self, key, delta=1, version=None, client=None):
+        if client is not None:
+            return super().decr(key, delta, version, client)
+        key = self.make_key(key, version=version)
+        return self._on_shard(key, True, _RAISE, super().decr, key, delta, version)
+
+    def lock(
+        self,
+        key,
+        version=None,
+        timeout=None,
+        sleep=0.1,
+        blocking_timeout=None,
+        client=None,
+        thread_local=True,
+    ):
+        if client is None:
+            key = self.make_key(key, version=version)
+            client = self.get_client(write=True, key=key)
+        return super().lock(
+            key, version, timeout, sleep, blocking_timeout, client, thread_local
+        )
+
+    def get_many(self, keys, version=None, client=None):
+        if client is not None:
+            return super().get_many(keys, version, client)
+        found = {}
+        for index, _, group in self.group(keys, False, version):
+            if index is not None:
+                key = self.make_key(group[0], version=version)
+                found.update(
+                    self._on_shard(key, False, {}, super().get_many, group, version)
+                )
+        return {key: found[key] for key in keys if key in found}
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None, client=None):
+        if client is not None:
+            return super().set_many(data, timeout, version, client)
+        for index, _, group in self.group(data, True, version):
+            if index is not None:
+                key = self.make_key(group[0], version=version)
+                values = {key: data[key] for key in group}
+                self._on_shard(
+                    key, True, None, super().set_many, values, timeout, version
+                )
+
+    def delete_many(self, keys, version=None, client=None):
+        if client is not None:
+            return super().delete_many(keys, version, client)
+        deleted = 0
+        for index, _, group in self.group(keys, True, version):
+            if index is not None:
+                key = self.make_key(group[0], version=version)
+                deleted += (
+                    self._on_shard(key, True, 0, super().delete_many, group, version)
+                    or 0
+                )
+        return deleted
+
+    def clear(self, client=None):
+        if client is not None:
+            return super().clear(client)
+        self._on_every_shard(super().clear)
+
+    def delete_pattern(
+        self, pattern, version=None, prefix=None, client=None, itersize=None
+    ):
+        if client is not None:
+            return super().delete_pattern(pattern, version, prefix, client, itersize)
+        return sum(
+            self._on_every_shard(
+                super().delete_pattern, pattern, version, prefix, itersize=itersize
+            )
+        )
+
+    def keys(self, search, version=None, client=None):
+        if client is not None:
+            return super().keys(search, version, client)
+        return [
+            key
+            for keys in self._on_every_shard(super().keys, search, version)
+            for key in keys
+        ]
+
+    def iter_keys(self, search, itersize=None, client=None, version=None):
+        if client is not None:
+            yield from super().iter_keys(search, itersize, client, version)
+            return
+        for shard in self.shards:
+            yield from super().iter_keys(
+                search, itersize, self.connection(shard[0]), version
+            )
+
+
+def _safe_url(url):
+    # Redis URLs may hold a password.
+    scheme, separator, rest = url.partition("://")
+    return f"{scheme}{separator}{rest.rpartition('@')[2]}"
@@ -0,0 +1,189 @@
+import asyncio
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import tiers
+
+
+class _Call:
+    """
+    An in-flight fill shared between its leader and the callers waiting on it.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent cache fills for the same key.
+
+    Inside a process, the first caller for a key becomes the leader and every other
+    caller waits for its result. Across processes and hosts, leaders race for a
+    short-lived lock in a shared cache; the losers poll the cache tiers until the winner
+    has filled them, instead of calling upstream too.
+    """
+
+    LOCK_PREFIX = "book-fill"
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fill, lookup):
+        """
+        Runs `fill` for the given key unless another caller is already doing so.
+
+        Args:
+            key (str): The key identifying the fill, e.g. the book ID.
+            fill (callable): Performs the fill and returns its result. Called by at most
+                one caller per key.
+            lookup (callable): Returns the result stored by a fill in another process,
+                or None if there is none yet.
+
+        Returns:
+            The result of `fill` or `lookup`. Callers that waited BOOK_FILL_WAIT_TIMEOUT
+            for another one without getting a result run `fill` themselves.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if call.done.wait(settings.BOOK_FILL_WAIT_TIMEOUT):
+                return call.result
+            result = lookup()
+            return result if result is not None else fill()
+
+        try:
+            call.result = self._fill_once(key, fill, lookup)
+            return call.result
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _fill_once(self, key, fill, lookup):
+        """
+        Runs `fill` while holding the cluster-wide lock for the key, or waits for
+        whoever holds it.
+
+        If the lock cache is unreachable, or the holder has not filled the caches within
+        BOOK_FILL_WAIT_TIMEOUT, the fill runs without the lock rather than failing the
+        request.
+        """
+        cache_name = settings.BOOK_FILL_LOCK_CACHE
+        lock_key = f"{self.LOCK_PREFIX}:{key}"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + settings.BOOK_FILL_WAIT_TIMEOUT
+
+        while True:
+            try:
+                acquired = caches[cache_name].add(
+                    lock_key, token, settings.BOOK_FILL_LOCK_TIMEOUT
+                )
+            except Exception:
+                return fill()
+
+            if acquired:
+                try:
+                    return fill()
+                finally:
+                    self._release(cache_name, lock_key, token)
+
+            result = lookup()
+            if result is not None:
+                return result
+            if time.monotonic() >= deadline:
+                return fill()
+            time.sleep(settings.BOOK_FILL_POLL_INTERVAL)
+
+    @staticmethod
+    def _release(cache_name, lock_key, token):
+        """
+        Releases the lock, unless it has already expired and been taken by another
+        leader.
+        """
+        try:
+            tiers.delete_if(cache_name, lock_key, token)
+        except Exception:
+            pass
+
+
+class AsyncSingleFlight(SingleFlight):
+    """
+    The asyncio counterpart of SingleFlight, for fills running on an event loop.
+
+    `fill` and `lookup` are coroutine functions; waiting followers do not hold a thread.
+    """
+
+    async def do(self, key, fill, lookup):
+        """
+        Awaits `fill` for the given key unless another coroutine is already doing so.
+        See `SingleFlight.do`.
+        """
+        loop = asyncio.get_running_loop()
+        call = self._calls.get((loop, key))
+        if call is not None:
+            try:
+                return await asyncio.wait_for(
+                    asyncio.shield(call), settings.BOOK_FILL_WAIT_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                result = await lookup()
+                return result if result is not None else await fill()
+
+        call = self._calls[(loop, key)] = loop.create_future()
+        result = None
+        try:
+            result = await self._fill_once(key, fill, lookup)
+            return result
+        finally:
+            del self._calls[(loop, key)]
+            call.set_result(result)
+
+    async def _fill_once(self, key, fill, lookup):
+        cache_name = settings.BOOK_FILL_LOCK_CACHE
+        lock_key = f"{self.LOCK_PREFIX}:{key}"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + settings.BOOK_FILL_WAIT_TIMEOUT
+
+        while True:
+            try:
+                acquired = await tiers.aadd(
+                    cache_name, lock_key, token, settings.BOOK_FILL_LOCK_TIMEOUT
+                )
+            except Exception:
+                return await fill()
+
+            if acquired:
+                try:
+                    return await fill()
+                finally:
+                    await self._arelease(cache_name, lock_key, token)
+
+            result = await lookup()
+            if result is not None:
+                return result
+            if time.monotonic() >= deadline:
+                return await fill()
+            await asyncio.sleep(settings.BOOK_FILL_POLL_INTERVAL)
+
+    @staticmethod
+    async def _arelease(cache_name, lock_key, token):
+        try:
+            await tiers.adelete_if(cache_name, lock_key, token)
+        except Exception:
+            pass
+
+
+# Shared by every Book in the process so that concurrent requests coalesce.
+book_fills = SingleFlight()
+async_book_fills = AsyncSingleFlight()
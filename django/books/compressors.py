@@ -0,0 +1,140 @@
+import threading
+import zlib
+
+from django_redis.compressors.base import BaseCompressor
+from django_redis.exceptions import CompressorError
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional and only available with zstandard installed.
+    zstandard = None
+
+# Compressed values start with a format version, then the codec:
+# [version][codec][payload]. Values below the size threshold are stored as serialized,
+# and are told apart by their first byte: pickle (protocol 2+) starts with 0x80, JSON
+# and the other BookSerializer codecs with a printable character, so none starts with a
+# version.
+FORMAT_VERSION = 1
+ZLIB = b"z"
+ZSTD = b"s"
+
+
+class BookCompressor(BaseCompressor):
+    """
+    A django-redis compressor for the Redis tier, compressing large values with zlib or
+    zstd.
+
+    It is configured through the cache OPTIONS:
+
+    - COMPRESSOR_CODEC: "zlib", "zstd" or "none". Values already stored with any codec
+      can always be read, so the codec can be changed without flushing the cache.
+    - COMPRESS_MIN_SIZE: values smaller than this many bytes are stored uncompressed.
+    - COMPRESS_LEVEL: the compression level, or None for the codec's default.
+    - ZSTD_DICTIONARY: the path of a dictionary trained with `train_dictionary`, or
+      None.
+    """
+
+    def __init__(self, options):
+        super().__init__(options)
+        self.codec = options.get("COMPRESSOR_CODEC", "zlib")
+        self.min_size = options.get("COMPRESS_MIN_SIZE", 1024)
+        self.level = options.get("COMPRESS_LEVEL")
+        self.dictionary = None
+        if self.codec not in ("zlib", "zstd", "none"):
+            raise ValueError(f"Unknown compressor codec {self.codec!r}")
+        if self.codec == "zstd" or options.get("ZSTD_DICTIONARY"):
+            if zstandard is None:
+                raise ImportError("The zstd codec requires zstandard to be installed")
+            if options.get("ZSTD_DICTIONARY"):
+                with open(options["ZSTD_DICTIONARY"], "rb") as dictionary_file:
+                    self.dictionary = zstandard.ZstdCompressionDict(
+                        dictionary_file.read()
+                    )
+        # zstd (de)compressors must not be shared between threads.
+        self._local = threading.local()
+
+    def compress(self, value):
+        """
+        Compresses a serialized value, unless it is below the size threshold or the
+        codec is "none".
+
+        Args:
+            value (bytes): The serialized value.
+
+        Returns:
+            bytes: The value to store.
+        """
+        if self.codec == "none" or len(value) < self.min_size:
+            return value
+        if self.codec == "zstd":
+            payload = self._zstd_compressor().compress(value)
+            codec = ZSTD
+        else:
+            payload = zlib.compress(value, 6 if self.level is None else self.level)
+            codec = ZLIB
+        if len(payload) + 2 >= len(value):
+            return value
+        return bytes((FORMAT_VERSION,)) + codec + payload
+
+    def decompress(self, value):
+        """
+        Decompresses a stored value.
+
+        Args:
+            value (bytes): The stored value.
+
+        Returns:
+            bytes: The serialized value.
+
+        Raises:
+            CompressorError: If the value is not compressed, so that django-redis uses
+                it as is.
+        """
+        if value[:1] != bytes((FORMAT_VERSION,)):
+            raise CompressorError("Value is not compressed")
+        codec, payload = value[1:2], value[2:]
+        try:
+            if codec == ZSTD:
+                return self._zstd_decompressor().decompress(payload)
+            if codec == ZLIB:
+                return zlib.decompress(payload)
+        except (zlib.error, getattr(zstandard, "ZstdError", zlib.error)) as error:
+            raise CompressorError(error) from error
+        raise CompressorError(f"Unknown codec {codec!r}")
+
+    def _zstd_compressor(self):
+        if not hasattr(self._local, "compressor"):
+            self._local.compressor = zstandard.ZstdCompressor(
+                level=3 if self.level is None else self.level, dict_data=self.dictionary
+            )
+        return self._local.compressor
+
+    def _zstd_decompressor(self):
+        if zstandard is None:
+            raise CompressorError(
+                "A zstd value was found, but zstandard is not installed"
+            )
+        if not hasattr(self._local, "decompressor"):
+            self._local.decompressor = zstandard.ZstdDecompressor(
+                dict_data=self.dictionary
+            )
+        return self._local.decompressor
+
+
+def train_dictionary(samples, size=112640):
+    """
+    Trains a zstd dictionary on sample values, for the ZSTD_DICTIONARY option.
+
+    A dictionary holds the structure and strings that book payloads share, so that even
+    small values compress well. Retrain it when the shape of the payloads changes.
+
+    Args:
+        samples (list): Serialized values (bytes), e.g. as stored in the Redis tier.
+        size (int, optional): The dictionary size in bytes. Defaults to 110 KiB.
+
+    Returns:
+        bytes: The dictionary, to be saved to a file.
+    """
+    if zstandard is None:
+        raise ImportError("Training a dictionary requires zstandard to be installed")
+    return zstandard.train_dictionary(size, samples).as_bytes()
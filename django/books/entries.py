@@ -0,0 +1,244 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+from .renderers import FastJSONRenderer
+
+# The states a cache entry can be in. Fresh and stale entries may be served; stale ones
+# should be refreshed. Negative entries record that the API had no data for the book;
+# they end the cache lookup too.
+MISSING = "missing"
+FRESH = "fresh"
+STALE = "stale"
+EXPIRED = "expired"
+NEGATIVE = "negative"
+
+SERVABLE = (FRESH, STALE)
+FOUND = (FRESH, STALE, NEGATIVE)
+
+_renderer = FastJSONRenderer()
+
+
+def wrap(data, now=None):
+    """
+    Wraps book data in the envelope stored in every cache tier.
+
+    The envelope records when the data becomes stale (soft expiry) and when it must not
+    be served anymore (hard expiry). Both are absolute timestamps, so they survive
+    copies between tiers. With BOOK_RENDERED_ENTRIES, the data is stored as the exact
+    bytes of its JSON response instead, so that cache hits are served without decoding
+    nor encoding the payload. The hash of the response is stored too, as its ETag.
+
+    Args:
+        data (dict): The book data.
+        now (float, optional): The current timestamp. Defaults to the current time.
+
+    Returns:
+        dict: The cache entry.
+    """
+    now = time.time() if now is None else now
+    entry = {
+        "_entry": 1,
+        "soft": now + settings.BOOK_SOFT_TTL,
+        "hard": now + settings.BOOK_HARD_TTL if settings.BOOK_HARD_TTL else None,
+    }
+    body = _renderer.render(data)
+    if settings.BOOK_RENDERED_ENTRIES:
+        entry["body"] = body
+    else:
+        entry["data"] = data
+    entry["etag"] = body_etag(body)
+    return entry
+
+
+def wrap_negative(status, now=None):
+    """
+    Builds the entry recording that the API answered a book request with an error.
+
+    Not-found answers are kept for BOOK_NOT_FOUND_TTL seconds; server errors and
+    unreachable API for BOOK_ERROR_TTL seconds.
+
+    Args:
+        status (int): The HTTP status of the API's answer.
+        now (float, optional): The current timestamp. Defaults to the current time.
+
+    Returns:
+        dict: The negative cache entry.
+    """
+    now = time.time() if now is None else now
+    ttl = settings.BOOK_ERROR_TTL if status >= 500 else settings.BOOK_NOT_FOUND_TTL
+    return {
+        "_entry": 1,
+        "data": None,
+        "status": status,
+        "soft": now + ttl,
+        "hard": now + ttl,
+    }
+
+
+def revive(value, now=None):
+    """
+    Returns a copy of an expired cache entry that may be served as stale data for
+    BOOK_ERROR_TTL more seconds.
+
+    Used when the API cannot answer, so that expired data is served instead of an error
+    until it can.
+
+    Args:
+        value (dict): An expired cache entry.
+        now (float, optional): The current timestamp. Defaults to the current time.
+
+    Returns:
+        dict: The revived cache entry, with the same data and ETag.
+    """
+    now = time.time() if now is None else now
+    return {**value, "soft": now, "hard": now + settings.BOOK_ERROR_TTL}
+
+
+def is_entry(value):
+    """
+    Tells whether a cached value is an entry envelope, rather than bare data cached
+    before envelopes existed.
+    """
+    return isinstance(value, dict) and value.get("_entry") == 1
+
+
+def is_negative(value):
+    """
+    Tells whether a cached value is a negative entry.
+    """
+    return is_entry(value) and value.get("status") is not None
+
+
+def is_failure(value):
+    """
+    Tells whether a cached value is a negative entry for an API that could not answer (a
+    5xx status: it failed, timed out or was not let through by its guard), as opposed to
+    a book the API has no data for.
+    """
+    return is_negative(value) and value["status"] >= 500
+
+
+def timeout(value, now=None):
+    """
+    Returns the cache timeout to store an entry with.
+
+    Negative entries only live until their hard expiry. Book data outlives it by
+    BOOK_KEEP_EXPIRED seconds, so that it can be served as stale while the API cannot
+    answer (see `revive`); the tier's own timeout would evict it before it even becomes
+    stale.
+
+    Args:
+        value (dict): A cache entry.
+        now (float, optional): The current timestamp. Defaults to the current time.
+
+    Returns:
+        The timeout in seconds, None if the entry never expires, or DEFAULT_TIMEOUT for
+        bare data.
+    """
+    if not is_entry(value):
+        return DEFAULT_TIMEOUT
+    if value["hard"] is None:
+        return None
+    now = time.time() if now is None else now
+    keep = 0 if is_negative(value) else settings.BOOK_KEEP_EXPIRED
+    return max(1, int(value["hard"] - now + keep))
+
+
+def unwrap(value):
+    """
+    Returns the book data held by a cache entry.
+
+    Args:
+        value: A cache entry, bare book data, or None.
+
+    Returns:
+        dict: The book data, or None.
+    """
+    if is_entry(value):
+        if "body" in value:
+            return json.loads(value["body"])
+        return value["data"]
+    return value
+
+
+def render(value):
+    """
+    Returns the JSON response body for the book data held by a cache entry.
+
+    Rendered entries already hold it; other values are rendered like the API's
+    JSONRenderer would.
+
+    Args:
+        value: A cache entry or bare book data.
+
+    Returns:
+        bytes: The response body.
+    """
+    if is_entry(value) and "body" in value:
+        return value["body"]
+    return _renderer.render(unwrap(value))
+
+
+def etag(value):
+    """
+    Returns the ETag of the JSON response for the book data held by a cache entry.
+
+    Entries store it when they are created, so it is read without touching the book
+    data; it is only computed for values cached before ETags existed.
+
+    Args:
+        value: A cache entry or bare book data.
+
+    Returns:
+        str: The quoted ETag.
+    """
+    if is_entry(value) and value.get("etag"):
+        return f'"{value["etag"]}"'
+    return f'"{body_etag(render(value))}"'
+
+
+def body_etag(body):
+    """
+    Returns the unquoted ETag of a JSON response body: a hash of its bytes.
+    """
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def _has_data(value):
+    if is_entry(value):
+        return bool(value.get("body") or value.get("data"))
+    return bool(value)
+
+
+def state(value, now=None):
+    """
+    Tells whether a cached value may be served.
+
+    Bare data cached before envelopes existed is considered stale, so it is served once
+    and replaced.
+
+    Args:
+        value: A cache entry, bare book data, or None.
+        now (float, optional): The current timestamp. Defaults to the current time.
+
+    Returns:
+        str: One of MISSING, FRESH, STALE, EXPIRED or NEGATIVE.
+    """
+    negative = is_negative(value)
+    if not negative and not _has_data(value):
+        return MISSING
+    if not is_entry(value):
+        return STALE
+
+    now = time.time() if now is None else now
+    if value["hard"] is not None and now >= value["hard"]:
+        return EXPIRED
+    if negative:
+        return NEGATIVE
+    if now >= value["soft"]:
+        return STALE
+    return FRESH
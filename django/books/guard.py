@@ -0,0 +1,430 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from collections import deque
+
+import redis
+from django.conf import settings
+from django.core.cache import caches
+
+from . import tiers
+
+logger = logging.getLogger(__name__)
+
+# The states of a circuit breaker. While open, requests are not sent; once the open
+# period is over, a single probe request is let through (half-open) and decides whether
+# the breaker closes or opens again.
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+# The decisions taken before each request.
+ALLOWED = "allowed"
+PROBE = "probe"
+THROTTLED = "throttled"
+
+# Both the breaker and the token bucket of a service are updated by this script,
+# atomically and with the clock of the Redis server, so every process of the cluster
+# shares them. KEYS[1] is the breaker hash, KEYS[2] the token bucket hash; ARGV[1] is
+# the operation:
+#   acquire <rate> <burst> <probe timeout>: returns {decision, seconds to wait before
+#     trying again}
+#   open <seconds> <reason>, close: change the breaker state
+#   state: returns the breaker hash and the server time, as a flat list of fields and
+#     values
+SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local op = ARGV[1]
+
+if op == 'open' then
+    redis.call('HSET', KEYS[1], 'until', now + tonumber(ARGV[2]), 'opened_at', now,
+               'reason', ARGV[3])
+    redis.call('HDEL', KEYS[1], 'probe_until')
+    redis.call('EXPIRE', KEYS[1], 86400)
+    return {'open', '0'}
+elseif op == 'close' then
+    redis.call('DEL', KEYS[1])
+    return {'closed', '0'}
+elseif op == 'state' then
+    local fields = redis.call('HGETALL', KEYS[1])
+    table.insert(fields, 'now')
+    table.insert(fields, tostring(now))
+    return fields
+end
+
+local breaker = redis.call('HMGET', KEYS[1], 'until', 'probe_until')
+local probe = false
+if breaker[1] then
+    if now < tonumber(breaker[1]) then
+        return {'open', tostring(tonumber(breaker[1]) - now)}
+    end
+    if breaker[2] and now < tonumber(breaker[2]) then
+        return {'open', tostring(tonumber(breaker[2]) - now)}
+    end
+    probe = true
+end
+
+local rate = tonumber(ARGV[2])
+if rate > 0 then
+    local burst = tonumber(ARGV[3])
+    local bucket = redis.call('HMGET', KEYS[2], 'tokens', 'updated')
+    local tokens = burst
+    if bucket[1] then
+        local refill = (now - tonumber(bucket[2])) * rate
+        tokens = math.min(burst, tonumber(bucket[1]) + refill)
+    end
+    if tokens < 1 then
+        return {'throttled', tostring((1 - tokens) / rate)}
+    end
+    redis.call('HSET', KEYS[2], 'tokens', tokens - 1, 'updated', now)
+    redis.call('EXPIRE', KEYS[2], math.ceil(burst / rate) + 1)
+end
+
+if probe then
+    redis.call('HSET', KEYS[1], 'probe_until', now + tonumber(ARGV[4]))
+    return {'probe', '0'}
+end
+return {'allowed', '0'}
+"""
+SCRIPT_SHA = hashlib.sha1(SCRIPT.encode()).hexdigest()
+
+
+class Rejected(Exception):
+    """
+    Raised when a request must not be sent: the circuit breaker is open, or the rate
+    limit was reached.
+    """
+
+
+class _LocalState:
+    """
+    The breaker and token bucket of a service for a single process, used when the guard
+    cache is not Redis.
+
+    Runs the same operations as SCRIPT.
+    """
+
+    def __init__(self):
+        self.breaker = {}
+        self.bucket = {}
+        self.lock = threading.Lock()
+
+    def run(self, op, *args):
+        now = time.time()
+        with self.lock:
+            if op == "open":
+                self.breaker = {
+                    "until": now + float(args[0]),
+                    "opened_at": now,
+                    "reason": args[1],
+                }
+                return [OPEN, 0]
+            if op == "close":
+                self.breaker = {}
+                return [CLOSED, 0]
+            if op == "state":
+                return [
+                    item
+                    for field in {**self.breaker, "now": now}.items()
+                    for item in field
+                ]
+
+            probe = bool(self.breaker)
+            if probe:
+                if now < self.breaker["until"]:
+                    return [OPEN, self.breaker["until"] - now]
+                if now < self.breaker.get("probe_until", 0):
+                    return [OPEN, self.breaker["probe_until"] - now]
+
+            rate, burst, probe_timeout = (float(arg) for arg in args)
+            if rate > 0:
+                tokens = burst
+                if self.bucket:
+                    tokens = min(
+                        burst,
+                        self.bucket["tokens"] + (now - self.bucket["updated"]) * rate,
+                    )
+                if tokens < 1:
+                    return [THROTTLED, (1 - tokens) / rate]
+                self.bucket = {"tokens": tokens - 1, "updated": now}
+
+            if probe:
+                self.breaker["probe_until"] = now + probe_timeout
+                return [PROBE, 0]
+            return [ALLOWED, 0]
+
+
+class Guard:
+    """
+    A rate limiter and circuit breaker protecting an upstream service, shared by every
+    process of the cluster.
+
+    Before each request, a token is taken from a token bucket refilled at
+    UPSTREAM_RATE_LIMIT tokens per second; callers wait for one for at most
+    UPSTREAM_RATE_LIMIT_WAIT seconds. Each process watches the outcome of its own
+    requests, and opens the breaker for the whole cluster when too many of them fail or
+    are too slow. While it is open, requests are rejected at once; then a single probe
+    request is let through, and its outcome closes the breaker or opens it again.
+
+    The state is kept in the UPSTREAM_GUARD_CACHE Redis tier. If that cache is not
+    Redis, each process has its own; if Redis cannot be reached, requests are let
+    through rather than failed.
+    """
+
+    def __init__(self, name):
+        """
+        Initializes the guard of a service.
+
+        Args:
+            name (str): The name of the service, which identifies its shared state.
+        """
+        self.name = name
+        self.local_state = _LocalState()
+        # This process' recent requests: (time, failed, slow), and their counts.
+        self.calls = deque()
+        self.failures = 0
+        self.slow = 0
+        self.rejected = 0
+        self.throttled = 0
+        # Whether the shared state could be reached the last time, so that an outage is
+        # logged once.
+        self.available = True
+        self.lock = threading.Lock()
+
+    def before(self):
+        """
+        Waits until a request may be sent.
+
+        Returns:
+            bool: Whether the request is the probe of a half-open breaker; pass it to
+            `after`.
+
+        Raises:
+            Rejected: If the breaker is open, or no token was available in time.
+        """
+        deadline = time.monotonic() + settings.UPSTREAM_RATE_LIMIT_WAIT
+        while True:
+            decision, wait = self._acquire()
+            delay = self._delay(decision, wait, deadline)
+            if delay is None:
+                return decision == PROBE
+            time.sleep(delay)
+
+    async def abefore(self):
+        """
+        Waits until a request may be sent, without blocking the event loop. See
+        `before`.
+        """
+        deadline = time.monotonic() + settings.UPSTREAM_RATE_LIMIT_WAIT
+        while True:
+            decision, wait = await self._aacquire()
+            delay = self._delay(decision, wait, deadline)
+            if delay is None:
+                return decision == PROBE
+            await asyncio.sleep(delay)
+
+    def after(self, probe, failed, elapsed):
+        """
+        Records the outcome of a request, and opens or closes the breaker accordingly.
+
+        Args:
+            probe (bool): What `before` returned.
+            failed (bool): Whether the request failed (no response, or a server error).
+            elapsed (float): How long the request took, in seconds.
+        """
+        change = self._record(probe, failed, elapsed)
+        if change is not None:
+            self._run(*change)
+
+    async def aafter(self, probe, failed, elapsed):
+        """
+        Records the outcome of a request without blocking the event loop. See `after`.
+        """
+        change = self._record(probe, failed, elapsed)
+        if change is not None:
+            await self._arun(*change)
+
+    def stats(self):
+        """
+        Reports the state of the breaker and of the requests of this process.
+
+        Returns:
+            dict: The breaker `state` (closed, open or half-open), when and why it
+            opened, and until when it stays open; the rate limit; and the requests,
+            failures, slow requests, rejected and throttled requests of this process
+            (the first three within the breaker window); and whether the shared state
+            could be reached.
+        """
+        fields = self._run("state") or []
+        fields = dict(zip(*[iter(_text(item) for item in fields)] * 2))
+        now = float(fields.get("now", time.time()))
+        state = CLOSED
+        if "until" in fields:
+            state = OPEN if now < float(fields["until"]) else HALF_OPEN
+        with self.lock:
+            self._expire(time.monotonic())
+            requests = len(self.calls)
+        return {
+            "state": state,
+            "opened_at": float(fields["opened_at"]) if "opened_at" in fields else None,
+            "open_until": float(fields["until"]) if "until" in fields else None,
+            "reason": fields.get("reason"),
+            "rate_limit": settings.UPSTREAM_RATE_LIMIT,
+            "requests": requests,
+            "failures": self.failures,
+            "slow": self.slow,
+            "rejected": self.rejected,
+            "throttled": self.throttled,
+            "available": self.available,
+        }
+
+    def _delay(self, decision, wait, deadline):
+        if decision in (ALLOWED, PROBE):
+            return None
+        remaining = deadline - time.monotonic()
+        if decision == OPEN or remaining <= 0:
+            with self.lock:
+                if decision == OPEN:
+                    self.rejected += 1
+                else:
+                    self.throttled += 1
+            if decision == OPEN:
+                raise Rejected(f"the {self.name} circuit breaker is open")
+            raise Rejected(f"the {self.name} rate limit was reached")
+        return min(wait, remaining)
+
+    def _record(self, probe, failed, elapsed):
+        """
+        Adds a request to the window of this process.
+
+        Returns:
+            tuple: The breaker operation to run, or None.
+        """
+        slow = elapsed >= settings.UPSTREAM_BREAKER_SLOW_CALL
+        if probe:
+            self._reset()
+            if failed or slow:
+                return (
+                    "open",
+                    settings.UPSTREAM_BREAKER_OPEN_SECONDS,
+                    "the probe request failed",
+                )
+            return ("close",)
+
+        now = time.monotonic()
+        with self.lock:
+            self.calls.append((now, failed, slow))
+            self.failures += failed
+            self.slow += slow
+            self._expire(now)
+            total = len(self.calls)
+            reason = None
+            if total >= settings.UPSTREAM_BREAKER_MIN_REQUESTS:
+                if self.failures >= total * settings.UPSTREAM_BREAKER_ERROR_RATE:
+                    reason = f"{self.failures} of {total} requests failed"
+                elif self.slow >= total * settings.UPSTREAM_BREAKER_SLOW_RATE:
+                    reason = f"{self.slow} of {total} requests were slow"
+        if reason is None:
+            return None
+        logger.warning("Opening the %s circuit breaker: %s", self.name, reason)
+        self._reset()
+        return ("open", settings.UPSTREAM_BREAKER_OPEN_SECONDS, reason)
+
+    def _expire(self, now):
+        cutoff = now - settings.UPSTREAM_BREAKER_WINDOW
+        while self.calls and self.calls[0][0] < cutoff:
+            _, failed, slow = self.calls.popleft()
+            self.failures -= failed
+            self.slow -= slow
+
+    def _reset(self):
+        with self.lock:
+            self.calls.clear()
+            self.failures = self.slow = 0
+
+    def _acquire(self):
+        result = self._run(
+            "acquire",
+            settings.UPSTREAM_RATE_LIMIT,
+            settings.UPSTREAM_RATE_BURST,
+            settings.UPSTREAM_BREAKER_PROBE_TIMEOUT,
+        )
+        return _decision(result)
+
+    async def _aacquire(self):
+        result = await self._arun(
+            "acquire",
+            settings.UPSTREAM_RATE_LIMIT,
+            settings.UPSTREAM_RATE_BURST,
+            settings.UPSTREAM_BREAKER_PROBE_TIMEOUT,
+        )
+        return _decision(result)
+
+    def _keys(self, cache):
+        key = cache.make_key(f"upstream-guard:{self.name}")
+        return [key, f"{key}:bucket"]
+
+    def _run(self, op, *args):
+        cache = caches[settings.UPSTREAM_GUARD_CACHE]
+        if not tiers.is_redis(cache):
+            return self.local_state.run(op, *args)
+        client = cache.client.get_client(write=True)
+        try:
+            try:
+                result = client.evalsha(SCRIPT_SHA, 2, *self._keys(cache), op, *args)
+            except redis.exceptions.NoScriptError:
+                result = client.eval(SCRIPT, 2, *self._keys(cache), op, *args)
+        except redis.RedisError as error:
+            self._set_available(False, error)
+            return None
+        self._set_available(True)
+        return result
+
+    async def _arun(self, op, *args):
+        cache_name = settings.UPSTREAM_GUARD_CACHE
+        cache = caches[cache_name]
+        if not tiers.is_redis(cache):
+            return self.local_state.run(op, *args)
+        client = tiers.async_redis(cache_name, cache)
+        try:
+            try:
+                result = await client.evalsha(
+                    SCRIPT_SHA, 2, *self._keys(cache), op, *args
+                )
+            except redis.exceptions.NoScriptError:
+                result = await client.eval(SCRIPT, 2, *self._keys(cache), op, *args)
+        except redis.RedisError as error:
+            self._set_available(False, error)
+            return None
+        self._set_available(True)
+        return result
+
+    def _set_available(self, available, error=None):
+        # Logs when the shared state becomes unreachable or reachable again, rather than
+        # on every request.
+        with self.lock:
+            if available == self.available:
+                return
+            self.available = available
+        if available:
+            logger.info("The %s upstream guard is available again", self.name)
+        else:
+            logger.warning(
+                "The %s upstream guard is unavailable, letting requests through: %r",
+                self.name,
+                error,
+            )
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _decision(result):
+    # Without its state, the guard lets requests through rather than failing them.
+    if result is None:
+        return ALLOWED, 0
+    return _text(result[0]), float(_text(result[1]))
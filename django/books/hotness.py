@@ -0,0 +1,175 @@
+import atexit
+import logging
+import os
+import threading
+import time
+
+import redis
+from django.conf import settings
+from django.core.cache import caches
+
+from . import tiers
+
+logger = logging.getLogger(__name__)
+
+
+def _client():
+    if not settings.BOOK_HOT_CACHE:
+        return None
+    cache = caches[settings.BOOK_HOT_CACHE]
+    return cache.client.get_client(write=True) if tiers.is_redis(cache) else None
+
+
+class Tracker:
+    """
+    Counts the lookups of each book in this process, and adds them to the hot books in
+    Redis in bulk.
+
+    The hot books are a sorted set (BOOK_HOT_KEY) of book IDs scored by their lookups,
+    which `decay` halves every BOOK_HOT_HALF_LIFE seconds: a decayed top-K, shared by
+    every process. Recording a lookup only updates a dict under a lock; the counts are
+    added to the set with one pipelined round-trip by a daemon thread every
+    BOOK_HOT_FLUSH_INTERVAL seconds, and when the process exits.
+    """
+
+    def __init__(self):
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+        atexit.register(self.flush)
+
+    def _reset(self):
+        # A forked process starts with empty counts (its parent flushes its own) and no
+        # flusher thread.
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.thread = None
+
+    def record(self, book_id, count=1):
+        """
+        Counts lookups of a book.
+
+        Args:
+            book_id: The book ID.
+            count (int, optional): The number of lookups. Defaults to 1.
+        """
+        with self.lock:
+            self.counts[book_id] = self.counts.get(book_id, 0) + count
+        if self.thread is None:
+            self._start()
+
+    def flush(self):
+        """
+        Adds the counted lookups to the hot books. Failures are logged and the counts
+        dropped.
+        """
+        with self.lock:
+            counts, self.counts = self.counts, {}
+        if not counts:
+            return
+        try:
+            client = _client()
+            if client is None:
+                return
+            pipeline = client.pipeline(transaction=False)
+            for book_id, count in counts.items():
+                pipeline.zincrby(settings.BOOK_HOT_KEY, count, str(book_id))
+            pipeline.execute()
+        except Exception as error:
+            # Logged without a traceback: it repeats every flush for as long as Redis is
+            # unreachable.
+            logger.warning(
+                "Could not record the lookups of %d books: %r", len(counts), error
+            )
+
+    def _start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(
+                target=self._run, name="book-hotness", daemon=True
+            )
+        self.thread.start()
+
+    def _run(self):
+        thread = self.thread
+        while self.thread is thread:
+            time.sleep(settings.BOOK_HOT_FLUSH_INTERVAL)
+            self.flush()
+
+
+tracker = Tracker()
+
+
+def record(book_id, count=1):
+    """
+    Counts lookups of a book, unless BOOK_HOT_CACHE is empty. See `Tracker.record`.
+    """
+    if settings.BOOK_HOT_CACHE:
+        tracker.record(book_id, count)
+
+
+def top(limit):
+    """
+    Returns the hottest books, hottest first.
+
+    Args:
+        limit (int): The number of books.
+
+    Returns:
+        list: (book_id, score) tuples, or an empty list if the hot books are not tracked
+        or unreachable.
+    """
+    client = _client()
+    if client is None or limit <= 0:
+        return []
+    try:
+        books = client.zrevrange(settings.BOOK_HOT_KEY, 0, limit - 1, withscores=True)
+    except redis.RedisError:
+        logger.warning("Could not read the hot books", exc_info=True)
+        return []
+    return [
+        (int(book_id) if book_id.isdigit() else book_id.decode(), score)
+        for book_id, score in books
+    ]
+
+
+def tracked():
+    """
+    Returns the number of books in the hot books set, or None if it is not available.
+    """
+    client = _client()
+    if client is None:
+        return None
+    try:
+        return client.zcard(settings.BOOK_HOT_KEY)
+    except redis.RedisError:
+        return None
+
+
+def decay(now=None):
+    """
+    Decays the scores of the hot books by the time passed since the last decay, and
+    drops all but the BOOK_HOT_TRACKED hottest, so that the set reflects recent traffic
+    and stays bounded.
+
+    Args:
+        now (float, optional): The current timestamp. Defaults to the current time.
+
+    Returns:
+        float: The factor the scores were multiplied by (1.0 on the first call).
+    """
+    client = _client()
+    if client is None:
+        return 1.0
+    now = time.time() if now is None else now
+    key = settings.BOOK_HOT_KEY
+    last = client.getset(f"{key}:decayed", now)
+    factor = 1.0
+    if last is not None:
+        factor = 0.5 ** (max(0.0, now - float(last)) / settings.BOOK_HOT_HALF_LIFE)
+    pipeline = client.pipeline(transaction=True)
+    if factor < 1.0:
+        pipeline.zunionstore(key, {key: factor})
+    pipeline.zremrangebyrank(key, 0, -settings.BOOK_HOT_TRACKED - 1)
+    pipeline.execute()
+    return factor
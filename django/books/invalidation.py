@@ -0,0 +1,498 @@
+import logging
+import os
+import socket
+import threading
+import time
+
+import redis
+from django.conf import settings
+from django.core.cache import caches
+
+from . import entries, tiers
+from .backends import SharedMemoryCache
+from .serializers import BookSerializer, msgpack, orjson
+
+logger = logging.getLogger(__name__)
+
+# The changes broadcast to the in-process tiers of every process.
+DELETE = "delete"
+SET = "set"
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def origin():
+    """
+    Returns the name of this process in invalidation messages, so that it skips its own.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def local_tiers():
+    """
+    Returns the names of the cache tiers held in the memory of each process, e.g. the L1
+    `default` tier.
+    """
+    return [
+        cache_name
+        for cache_name in settings.CACHES
+        if isinstance(caches[cache_name], tiers.IN_PROCESS_BACKENDS)
+    ]
+
+
+def applied_tiers():
+    """
+    Returns the in-process tiers this process applies the invalidation messages to: its
+    own tiers, and the tiers shared by the processes of its host only if it is the one
+    applying their changes (see `backends.SharedMemoryCache.leads`).
+    """
+    return [
+        cache_name
+        for cache_name in local_tiers()
+        if not isinstance(caches[cache_name], SharedMemoryCache)
+        or caches[cache_name].leads()
+    ]
+
+
+def _bus_cache():
+    if not settings.BOOK_INVALIDATION_CACHE:
+        return None
+    cache = caches[settings.BOOK_INVALIDATION_CACHE]
+    return cache if tiers.is_redis(cache) else None
+
+
+def serializer():
+    """
+    Returns the serializer of the entries sent on the bus: the one of the bus' Redis
+    tier, with its codec.
+
+    Every process deserializes every message of a stream anyone with access to Redis can
+    write to, so entries are never pickled, whatever SERIALIZER_ALLOW_PICKLE allows in
+    the tier: unpickling runs code chosen by whoever wrote the message. With the pickle
+    codec, entries are sent with orjson (or msgpack) instead.
+
+    Returns:
+        BookSerializer: The serializer, or None if neither orjson nor msgpack is
+        installed.
+    """
+    cache = _bus_cache()
+    codec = cache.client._options.get("SERIALIZER_CODEC") if cache is not None else None
+    if codec not in ("orjson", "msgpack"):
+        codec = (
+            "orjson"
+            if orjson is not None
+            else "msgpack" if msgpack is not None else None
+        )
+    if codec is None:
+        return None
+    return BookSerializer({"SERIALIZER_CODEC": codec, "SERIALIZER_ALLOW_PICKLE": False})
+
+
+def publish(book_id, action, entry=None, negative_only=False):
+    """
+    Broadcasts a change of a book in the in-process tiers to every other process, across
+    hosts.
+
+    Messages are appended to a Redis stream (BOOK_INVALIDATION_STREAM), whose IDs number
+    them in order. An entry that cannot be sent without pickling (see `serializer`)
+    evicts the book instead. Failures are logged and ignored: the other processes then
+    serve their copy until it expires.
+
+    Args:
+        book_id: The book ID.
+        action (str): DELETE to evict the book, or SET to replace it with `entry`.
+        entry (dict, optional): The new cache entry, for SET.
+        negative_only (bool, optional): For DELETE, only evict negative entries.
+            Defaults to False.
+
+    Returns:
+        str: The ID of the message in the stream, or None if it was not published.
+    """
+    return publish_many([(book_id, action, entry, negative_only)])[0]
+
+
+def publish_many(messages):
+    """
+    Broadcasts several changes at once, in a single round-trip. See `publish`.
+
+    Args:
+        messages (list): (book_id, action, entry, negative_only) tuples.
+
+    Returns:
+        list: The ID of each message in the stream, or None for each message if they
+        were not published.
+    """
+    cache = _bus_cache()
+    if cache is None or not messages:
+        return [None] * len(messages)
+
+    codec = serializer()
+    pipeline = cache.client.get_client(write=True).pipeline(transaction=False)
+    for message in messages:
+        pipeline.xadd(
+            settings.BOOK_INVALIDATION_STREAM,
+            _fields(codec, *message),
+            maxlen=settings.BOOK_INVALIDATION_MAXLEN,
+            approximate=True,
+        )
+    try:
+        return [message_id.decode() for message_id in pipeline.execute()]
+    except Exception:
+        logger.exception("Could not publish %d book changes", len(messages))
+        return [None] * len(messages)
+
+
+async def apublish(book_id, action, entry=None, negative_only=False):
+    """
+    Broadcasts a change of a book in the in-process tiers without blocking the event
+    loop. See `publish`.
+
+    Returns:
+        str: The ID of the message in the stream, or None if it was not published.
+    """
+    cache = _bus_cache()
+    if cache is None:
+        return None
+
+    client = tiers.async_redis(settings.BOOK_INVALIDATION_CACHE, cache)
+    try:
+        message_id = await client.xadd(
+            settings.BOOK_INVALIDATION_STREAM,
+            _fields(serializer(), book_id, action, entry, negative_only),
+            maxlen=settings.BOOK_INVALIDATION_MAXLEN,
+            approximate=True,
+        )
+    except Exception:
+        logger.exception("Could not publish the change of book %s", book_id)
+        return None
+    return message_id.decode()
+
+
+def _fields(codec, book_id, action, entry, negative_only):
+    # The fields of a bus message. An entry the codec cannot encode evicts the book
+    # instead.
+    fields = {
+        "book_id": str(book_id),
+        "action": action,
+        "origin": origin(),
+        "negative_only": int(negative_only),
+    }
+    if entry is not None:
+        try:
+            if codec is None:
+                raise TypeError("No serializer for the bus")
+            fields["entry"] = codec.dumps(entry)
+        except TypeError:
+            fields["action"] = DELETE
+    return fields
+
+
+def apply(fields, cache_names=None):
+    """
+    Applies an invalidation message to the in-process tiers of this process (see
+    `applied_tiers`).
+
+    An entry that cannot be read, e.g. a pickled one, evicts the book instead of
+    replacing it.
+
+    Args:
+        fields (dict): The message fields, as published by `publish`.
+        cache_names (list, optional): The tiers to apply it to. Defaults to
+            `applied_tiers()`.
+    """
+    from .classes import Book
+
+    book_id = fields["book_id"]
+    cache_names = applied_tiers() if cache_names is None else cache_names
+    if not cache_names:
+        return
+    if fields["action"] == SET:
+        codec = serializer()
+        entry = codec.loads(fields["entry"]) if codec is not None else None
+        if entries.is_entry(entry):
+            Book(book_id=book_id).write_to_caches(cache_names, entry)
+            return
+        fields["negative_only"] = 0
+
+    for cache_name in cache_names:
+        cache = caches[cache_name]
+        if int(fields.get("negative_only", 0)) and not entries.is_negative(
+            cache.get(book_id)
+        ):
+            continue
+        cache.delete(book_id)
+
+
+def _stream_id(message_id):
+    milliseconds, sequence = message_id.split("-")
+    return int(milliseconds), int(sequence)
+
+
+def _decode(fields):
+    # The fields of a message read from the stream, as `apply` takes them.
+    fields = {key.decode(): value for key, value in fields.items()}
+    fields["book_id"] = fields["book_id"].decode()
+    fields["action"] = fields["action"].decode()
+    return fields
+
+
+def _stream_info(client, stream):
+    # The XINFO STREAM reply for the stream, or None if it does not exist (yet).
+    try:
+        return client.xinfo_stream(stream)
+    except redis.ResponseError:
+        return None
+
+
+def _trimmed_after(info, message_id, position):
+    """
+    Tells whether messages published after a message were trimmed from the stream, so
+    they cannot be read.
+
+    Redis 7 counts the messages ever added to a stream, so the messages trimmed are
+    those not left in it: some were missed only if they include the one right after the
+    message. Older versions only report the first message still in the stream: if it
+    comes after the message, messages may have been missed, or the message may as well
+    have been the last one trimmed.
+
+    Args:
+        info (dict): The XINFO STREAM reply for the stream.
+        message_id (str): The ID of the last message read.
+        position (int): The number of messages added to the stream up to that one, or
+            None if unknown.
+
+    Returns:
+        bool: True if messages may have been missed.
+    """
+    if "entries-added" in info and position is not None:
+        return info["entries-added"] - info["length"] > position
+    first = info.get("first-entry")
+    return first is not None and _stream_id(first[0].decode()) > _stream_id(message_id)
+
+
+def _position(info):
+    # The number of messages added to the stream up to its last one, if the Redis server
+    # counts them.
+    return info.get("entries-added") if info is not None else 0
+
+
+class Listener(threading.Thread):
+    """
+    A daemon thread applying the invalidation messages of other processes to this
+    process' in-process tiers.
+
+    It connects to the bus itself, so that an unreachable Redis server never holds up a
+    request, and keeps retrying every RETRY_INTERVAL seconds. It reads the stream from
+    the last message it has seen, so after losing its connection it catches up on every
+    message published meanwhile. If some of them were already trimmed from the stream,
+    it cannot tell which books changed, so it clears its in-process tiers instead. Tiers
+    shared by the processes of a host are only updated and cleared by one of them (see
+    `applied_tiers`). It saves how far it applied the messages in the tier, so that the
+    process taking over after it exits applies the messages it had not, or clears the
+    tier if it cannot tell which.
+    """
+
+    BLOCK = 1  # How long a read waits for new messages, in seconds.
+    RETRY_INTERVAL = 1
+
+    def __init__(self):
+        super().__init__(name="book-invalidation", daemon=True)
+        self.client = None
+        self.last_id = None
+        self.position = (
+            None  # The number of messages added to the stream up to last_id, if known.
+        )
+        self.applied = 0
+        self.resyncs = 0
+        self.leading = set()  # The shared tiers this process took over.
+        self.origin = origin()
+        self.pid = os.getpid()
+        self.connected = (
+            threading.Event()
+        )  # Set once messages published from then on are guaranteed to be applied.
+        self.available = True
+
+    def run(self):
+        stream = settings.BOOK_INVALIDATION_STREAM
+        check_gap = False
+        while True:
+            try:
+                if self.client is None:
+                    self._connect(stream)
+                elif check_gap:
+                    self._check_gap(stream)
+                check_gap = False
+                cache_names = self._tiers(stream)
+                response = self.client.xread(
+                    {stream: self.last_id}, count=500, block=self.BLOCK * 1000
+                )
+            except redis.RedisError as error:
+                # Logged once per outage: every retry would flood the logs while the bus
+                # is down.
+                if self.available:
+                    logger.warning(
+                        "Book invalidation stream unavailable, retrying: %r", error
+                    )
+                self.available = False
+                check_gap = True
+                time.sleep(self.RETRY_INTERVAL)
+                continue
+            if not self.available:
+                logger.warning("Book invalidation stream available again")
+                self.available = True
+
+            for _, messages in response or ():
+                for message_id, fields in messages:
+                    self.last_id = message_id.decode()
+                    if self.position is not None:
+                        self.position += 1
+                    if fields[b"origin"].decode() == self.origin:
+                        continue
+                    try:
+                        apply(_decode(fields), cache_names)
+                    except Exception:
+                        logger.exception(
+                            "Could not apply invalidation %s", self.last_id
+                        )
+                    self.applied += 1
+            self._save()
+
+    def _connect(self, stream):
+        cache = _bus_cache()
+        if cache is None:
+            raise redis.ConnectionError("No invalidation bus is configured")
+        options = tiers.redis_options(cache)
+        # A read blocks for up to BLOCK seconds on top of the tier's own socket timeout.
+        options["socket_timeout"] = (
+            options.get("socket_timeout", self.BLOCK) + self.BLOCK
+        )
+        client = redis.Redis.from_url(tiers.redis_url(cache), **options)
+        info = _stream_info(client, stream)
+        # A process starting now has nothing cached yet: it only needs the messages
+        # published from now on.
+        last = info.get("last-entry") if info is not None else None
+        self.last_id = last[0].decode() if last else "0-0"
+        self.position = _position(info)
+        self.client = client
+        self.connected.set()
+
+    def _check_gap(self, stream):
+        info = _stream_info(self.client, stream)
+        if info is not None and _trimmed_after(info, self.last_id, self.position):
+            for cache_name in applied_tiers():
+                caches[cache_name].clear()
+            self.resyncs += 1
+            self.last_id = "0-0"
+            # Reading from the start, the first message still in the stream comes right
+            # after the trimmed ones.
+            added = _position(info)
+            self.position = added - info["length"] if added is not None else None
+
+    def _tiers(self, stream):
+        # The tiers to apply the messages to (see `applied_tiers`), once the shared ones
+        # this process has just started leading caught up with it.
+        cache_names = applied_tiers()
+        for cache_name in cache_names:
+            if (
+                isinstance(caches[cache_name], SharedMemoryCache)
+                and cache_name not in self.leading
+            ):
+                self._take_over(stream, cache_name)
+                self.leading.add(cache_name)
+                self._save()
+        return cache_names
+
+    def _take_over(self, stream, cache_name):
+        # Applies to a shared tier the messages its previous leader had not, up to the
+        # last one this process read.
+        cache = caches[cache_name]
+        state = cache.leader_state()
+        info = _stream_info(self.client, stream)
+        if state is not None:
+            milliseconds, sequence, position = state
+            start = f"{milliseconds}-{sequence}"
+            position = position if position >= 0 else None
+        if state is None or (
+            info is not None and _trimmed_after(info, start, position)
+        ):
+            cache.clear()
+            self.resyncs += 1
+            return
+        while True:
+            messages = self.client.xrange(stream, f"({start}", self.last_id, count=500)
+            for message_id, fields in messages:
+                try:
+                    apply(_decode(fields), [cache_name])
+                except Exception:
+                    logger.exception(
+                        "Could not apply invalidation %s", message_id.decode()
+                    )
+            if len(messages) < 500:
+                return
+            start = messages[-1][0].decode()
+
+    def _save(self):
+        # Saves how far the messages were applied to the shared tiers this process
+        # leads.
+        milliseconds, sequence = _stream_id(self.last_id)
+        for cache_name in self.leading:
+            caches[cache_name].save_leader_state(
+                milliseconds,
+                sequence,
+                self.position if self.position is not None else -1,
+            )
+
+
+def start_listener():
+    """
+    Starts the invalidation listener of this process, unless it is already running.
+
+    It is only started by the processes serving books: gunicorn workers
+    (config/gunicorn.py), ASGI servers at startup (config.asgi) and Celery worker
+    processes (see `tasks`), not by management commands or tests. A process forked from
+    one that listens starts its own listener. It connects in the background: messages
+    published once its `connected` event is set are guaranteed to be applied.
+
+    Returns:
+        Listener: The listener, or None if there is no invalidation bus.
+    """
+    global _listener
+    with _listener_lock:
+        if _listener is not None and _listener.pid == os.getpid():
+            return _listener
+        if _bus_cache() is None or not local_tiers():
+            return None
+        _listener = Listener()
+        _listener.start()
+        return _listener
+
+
+def _after_fork():
+    # The listener thread does not survive a fork, and the lock may have been held by
+    # another thread.
+    global _listener, _listener_lock
+    listening = _listener is not None
+    _listener = None
+    _listener_lock = threading.Lock()
+    if listening:
+        start_listener()
+
+
+def stats():
+    """
+    Reports the state of the invalidation listener of this process.
+
+    Returns:
+        dict: The ID of the last message seen, the number of messages applied and of
+        full resyncs, and whether the stream is reachable, or None if the listener is
+        not running.
+    """
+    if _listener is None or _listener.pid != os.getpid():
+        return None
+    return {
+        "last_id": _listener.last_id,
+        "applied": _listener.applied,
+        "resyncs": _listener.resyncs,
+        "available": _listener.available and _listener.connected.is_set(),
+    }
@@ -0,0 +1,227 @@
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from books import entries, invalidation, tiers
+from books.classes import Book
+
+
+class RateLimiter:
+    """
+    Spaces calls evenly so that at most `rate` of them start per second, across threads.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def read_ids(lines):
+    """
+    Yields the book IDs of a stream of lines, one per line, skipping blank lines and #
+    comments.
+    """
+    for line in lines:
+        line = line.split("#", 1)[0].strip()
+        if line:
+            try:
+                yield int(line)
+            except ValueError:
+                raise CommandError(f"Invalid book ID {line!r}")
+
+
+class Command(BaseCommand):
+    help = (
+        "Pre-populates the shared cache tiers with books fetched from the Taaghche "
+        "API. Book IDs are streamed from a file, stdin or a range, so any number of "
+        "them can be warmed."
+    )
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument(
+            "--file", help='A file with one book ID per line, or "-" for stdin.'
+        )
+        source.add_argument(
+            "--range",
+            nargs=2,
+            type=int,
+            metavar=("FIRST", "LAST"),
+            help="An inclusive range of IDs.",
+        )
+        parser.add_argument(
+            "--cache",
+            action="append",
+            dest="caches",
+            help="A cache to warm; may be repeated. Defaults to every cache shared "
+            "between processes.",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=settings.BOOK_BULK_UPSTREAM_CONCURRENCY,
+            help="How many books are fetched at the same time.",
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=0,
+            help="At most this many API requests per second (0 - unlimited).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.BOOK_BULK_CHUNK_SIZE,
+            help="How many books are checked and written per pipelined batch.",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            help="A file recording how many IDs were handled, updated after every "
+            "batch. If it exists, warming resumes after the IDs it records.",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Fetch books even if every cache already holds them.",
+        )
+
+    def handle(self, *args, **options):
+        cache_names = options["caches"] or [
+            cache_name
+            for cache_name in settings.CACHES
+            if cache_name not in invalidation.local_tiers()
+        ]
+        if not cache_names:
+            raise CommandError(
+                "No cache is shared between processes; choose caches with --cache"
+            )
+        unknown = set(cache_names) - set(settings.CACHES)
+        if unknown:
+            raise CommandError(f"Unknown caches: {', '.join(sorted(unknown))}")
+        if options["concurrency"] < 1 or options["batch_size"] < 1:
+            raise CommandError("--concurrency and --batch-size must be positive")
+
+        ids, close = self._open_ids(options)
+        checkpoint = options["checkpoint"]
+        position = self._read_checkpoint(checkpoint)
+        if position:
+            self.stdout.write(f"Resuming after {position} IDs")
+            ids = itertools.islice(ids, position, None)
+
+        throttle = RateLimiter(options["rate"]) if options["rate"] > 0 else None
+        totals = dict.fromkeys(
+            ("seen", "skipped", "found", "not_found", "failed", "failed_writes"), 0
+        )
+        start = time.monotonic()
+
+        try:
+            while True:
+                batch = list(itertools.islice(ids, options["batch_size"]))
+                if not batch:
+                    break
+                self._warm_batch(batch, cache_names, options, throttle, totals)
+                position += len(batch)
+                if checkpoint:
+                    self._write_checkpoint(checkpoint, position)
+                self._progress(totals, position, start)
+        finally:
+            close()
+
+        elapsed = time.monotonic() - start
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Warmed {', '.join(cache_names)}: {totals['seen']} IDs in "
+                f"{elapsed:.1f}s, {totals['found']} fetched, {totals['not_found']} not "
+                f"found, {totals['failed']} failed, {totals['skipped']} skipped"
+            )
+        )
+        if totals["failed_writes"]:
+            raise CommandError(f"{totals['failed_writes']} batch writes failed")
+        if totals["failed"]:
+            raise CommandError(
+                f"The API could not answer for {totals['failed']} books; they were "
+                "not cached"
+            )
+
+    def _warm_batch(self, batch, cache_names, options, throttle, totals):
+        book_ids = list(dict.fromkeys(batch))
+        if not options["force"]:
+            present = set(book_ids)
+            for cache_name in cache_names:
+                present &= tiers.existing(cache_name, book_ids)
+            book_ids = [book_id for book_id in book_ids if book_id not in present]
+
+        fetched = Book.fetch_many(book_ids, options["concurrency"], throttle)
+        # Failures of the API (errors, timeouts, rejections by its guard) are not
+        # cached, nor counted as fetched.
+        failed = [
+            book_id for book_id, entry in fetched.items() if entries.is_failure(entry)
+        ]
+        for book_id in failed:
+            del fetched[book_id]
+            self.stderr.write(f"Book {book_id} could not be fetched from the API")
+        results = Book.store_many(fetched, cache_names) if fetched else {}
+
+        negative = sum(1 for entry in fetched.values() if entries.is_negative(entry))
+        totals["seen"] += len(batch)
+        totals["skipped"] += len(batch) - len(book_ids)
+        totals["found"] += len(fetched) - negative
+        totals["not_found"] += negative
+        totals["failed"] += len(failed)
+        for result in results.values():
+            if not result["success"]:
+                totals["failed_writes"] += 1
+                self.stderr.write(
+                    f"Writing to {result['cache']} failed: {result['error']}"
+                )
+
+    def _progress(self, totals, position, start):
+        elapsed = max(time.monotonic() - start, 1e-9)
+        self.stdout.write(
+            f"{position} IDs handled ({totals['found']} fetched, {totals['not_found']} "
+            f"not found, {totals['failed']} failed, {totals['skipped']} skipped), "
+            f"{totals['seen'] / elapsed:.1f} IDs/s, "
+            f"{(totals['found'] + totals['not_found']) / elapsed:.1f} fetches/s"
+        )
+
+    @staticmethod
+    def _open_ids(options):
+        if options["range"]:
+            first, last = options["range"]
+            return iter(range(first, last + 1)), lambda: None
+        if options["file"] == "-":
+            return read_ids(sys.stdin), lambda: None
+        try:
+            ids_file = open(options["file"])
+        except OSError as error:
+            raise CommandError(f"Cannot read {options['file']}: {error}")
+        return read_ids(ids_file), ids_file.close
+
+    @staticmethod
+    def _read_checkpoint(path):
+        if not path or not os.path.exists(path):
+            return 0
+        with open(path) as checkpoint_file:
+            return json.load(checkpoint_file)["position"]
+
+    @staticmethod
+    def _write_checkpoint(path, position):
+        # Written atomically, so an interrupted run never leaves a truncated checkpoint.
+        with open(f"{path}.tmp", "w") as checkpoint_file:
+            json.dump({"position": position, "updated": time.time()}, checkpoint_file)
+        os.replace(f"{path}.tmp", path)
@@ -0,0 +1,358 @@
+import atexit
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    values,
+)
+
+from . import entries
+
+_host = socket.gethostname()
+
+
+def process_name(pid):
+    """
+    Returns the name of a process in the sample files of PROMETHEUS_MULTIPROC_DIR: the
+    host as well as the pid, so that containers sharing the directory do not overwrite
+    each other's files.
+
+    Args:
+        pid (int): The process id.
+
+    Returns:
+        str: The name.
+    """
+    return f"{_host}-{pid}"
+
+
+if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+    # Every process (gunicorn and Celery workers) writes its samples to its own
+    # memory-mapped files in this directory, and /metrics sums them.
+    values.ValueClass = values.MultiProcessValue(lambda: process_name(os.getpid()))
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# From 100µs (in-process hits) to seconds (fills waiting on the API).
+LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+
+LOOKUPS = Counter(
+    "books_cache_lookups",
+    "Book lookups in each cache tier, by result (hit, miss, expired or negative).",
+    ["cache", "result"],
+)
+WRITES = Counter(
+    "books_cache_writes",
+    "Book writes to each cache tier, by result (written, kept when the tier kept the "
+    "data it had, error).",
+    ["cache", "result"],
+)
+REQUESTS = Histogram(
+    "books_request_seconds",
+    "Time to retrieve a book, by where it came from (a cache tier, upstream or none) "
+    "and its state.",
+    ["origin", "state"],
+    buckets=LATENCY_BUCKETS,
+)
+FILLS = Histogram(
+    "books_fill_seconds",
+    "Time to fill a cache miss: fetching the book from the API and writing it to the "
+    "cache tiers.",
+    buckets=LATENCY_BUCKETS,
+)
+UPSTREAM = Histogram(
+    "books_upstream_request_seconds",
+    "Latency of book requests to the Taaghche API, by status class (2xx, 4xx, 5xx, "
+    "error, rejected, timeout).",
+    ["status"],
+    buckets=LATENCY_BUCKETS,
+)
+HEDGES = Counter(
+    "books_upstream_hedges",
+    "Duplicate requests sent to the Taaghche API when the first one was late, and how "
+    "many answered first.",
+    ["result"],
+)
+TASKS = Histogram(
+    "books_task_seconds",
+    "Run time of the Celery tasks, by task and final state.",
+    ["task", "state"],
+    buckets=LATENCY_BUCKETS,
+)
+
+
+class Recorder:
+    """
+    Buffers the samples recorded by this process, and adds them to the Prometheus
+    metrics off the request path.
+
+    Recording a sample only updates a dict under a lock. Updating a metric costs a few
+    microseconds in multi-process mode (each value is written to a memory-mapped file),
+    so the metrics are updated by a daemon thread every BOOK_METRICS_FLUSH_INTERVAL
+    seconds, before rendering, and when the process exits.
+    """
+
+    def __init__(self):
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+        atexit.register(self.flush)
+
+    def _reset(self):
+        # A forked process starts with empty buffers (its parent flushes its own) and no
+        # flusher thread.
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.samples = {}
+        self.thread = None
+
+    def inc(self, metric, labels, amount=1):
+        """
+        Adds `amount` to a counter.
+
+        Args:
+            metric (Counter): The counter.
+            labels (tuple): The label values.
+            amount (float, optional): The increment. Defaults to 1.
+        """
+        key = (metric, labels)
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + amount
+        if self.thread is None:
+            self._start()
+
+    def observe(self, metric, labels, value):
+        """
+        Observes a value in a histogram.
+
+        Args:
+            metric (Histogram): The histogram.
+            labels (tuple): The label values.
+            value (float): The observed value.
+        """
+        key = (metric, labels)
+        with self.lock:
+            observed = self.samples.get(key)
+            if observed is None:
+                observed = self.samples[key] = []
+            observed.append(value)
+        if self.thread is None:
+            self._start()
+
+    def flush(self):
+        """
+        Adds the buffered samples to the Prometheus metrics.
+        """
+        with self.lock:
+            counts, self.counts = self.counts, {}
+            samples, self.samples = self.samples, {}
+        for (metric, labels), amount in counts.items():
+            (metric.labels(*labels) if labels else metric).inc(amount)
+        for (metric, labels), observed in samples.items():
+            child = metric.labels(*labels) if labels else metric
+            for value in observed:
+                child.observe(value)
+
+    def _start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(
+                target=self._run, name="book-metrics", daemon=True
+            )
+        self.thread.start()
+
+    def _run(self):
+        thread = self.thread
+        while self.thread is thread:
+            time.sleep(settings.BOOK_METRICS_FLUSH_INTERVAL)
+            self.flush()
+
+
+recorder = Recorder()
+_enabled = settings.BOOK_METRICS
+
+
+def _update_enabled(setting, value, **kwargs):
+    global _enabled
+    if setting == "BOOK_METRICS":
+        _enabled = value
+
+
+setting_changed.connect(_update_enabled)
+
+
+def lookup_result(entry):
+    """
+    Classifies what a lookup in a cache tier found, so that only servable book data
+    counts as a hit.
+
+    Args:
+        entry: The cache entry found, or None.
+
+    Returns:
+        str: "miss" if there was none, "negative" for a negative entry, "expired" for
+        expired book data, "hit" otherwise.
+    """
+    if entry is None:
+        return "miss"
+    if entries.is_negative(entry):
+        return "negative"
+    return "expired" if entries.state(entry) == entries.EXPIRED else "hit"
+
+
+def lookup(cache_name, result, count=1):
+    """
+    Counts lookups in a cache tier.
+
+    Args:
+        cache_name (str): The name of the cache tier.
+        result (str): What the lookups found (see `lookup_result`).
+        count (int, optional): The number of lookups. Defaults to 1.
+    """
+    if _enabled and count:
+        recorder.inc(LOOKUPS, (cache_name, result), count)
+
+
+def writes(results, count=1):
+    """
+    Counts writes to cache tiers, from their write results.
+
+    Args:
+        results (dict): Each cache name mapped to its write result (see
+            `tiers.write_many`).
+        count (int, optional): The number of keys written to each tier. Defaults to 1.
+    """
+    if not _enabled:
+        return
+    for cache_name, result in results.items():
+        if not result["success"]:
+            recorder.inc(WRITES, (cache_name, "error"), count)
+            continue
+        if result["written"]:
+            recorder.inc(WRITES, (cache_name, "written"), result["written"])
+        if count > result["written"]:
+            recorder.inc(WRITES, (cache_name, "kept"), count - result["written"])
+
+
+def request(origin, state, seconds):
+    """
+    Records the retrieval of a book by `Book.get_entry`.
+
+    Args:
+        origin (str): Where the entry came from: a cache name, "upstream", or None.
+        state (str): The state of the entry (see `entries.state`).
+        seconds (float): How long the retrieval took.
+    """
+    if _enabled:
+        recorder.observe(REQUESTS, (origin or "none", state), seconds)
+
+
+def fill(seconds):
+    """
+    Records the time taken to fill a cache miss.
+    """
+    if _enabled:
+        recorder.observe(FILLS, (), seconds)
+
+
+def upstream_request(status, seconds):
+    """
+    Records a book request to the Taaghche API.
+
+    Args:
+        status: The HTTP status of the answer, or "error", "rejected" or "timeout" if
+            there was none.
+        seconds (float): How long the request took.
+    """
+    if _enabled:
+        status = f"{status // 100}xx" if isinstance(status, int) else status
+        recorder.observe(UPSTREAM, (status,), seconds)
+
+
+def hedge(result):
+    """
+    Records a hedged request to the Taaghche API.
+
+    Args:
+        result (str): "sent" when the duplicate is sent, "won" when it answered first.
+    """
+    if _enabled:
+        recorder.inc(HEDGES, (result,))
+
+
+def task(name, state, seconds):
+    """
+    Records the run of a Celery task.
+
+    Args:
+        name (str): The task name.
+        state (str): The final state of the task, e.g. "SUCCESS".
+        seconds (float): How long the task ran.
+    """
+    if _enabled:
+        recorder.observe(TASKS, (name, state.lower()), seconds)
+
+
+def render():
+    """
+    Renders the metrics in the Prometheus text format.
+
+    With PROMETHEUS_MULTIPROC_DIR set, the samples of every process writing to that
+    directory are aggregated: counters and histograms are summed, whichever worker
+    serves the request. The other processes' samples are at most
+    BOOK_METRICS_FLUSH_INTERVAL seconds old. Otherwise only the metrics of this process
+    are rendered.
+
+    Returns:
+        bytes: The metrics.
+    """
+    recorder.flush()
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
+
+def mark_process_dead(pid, path=None):
+    """
+    Removes the live gauge files of a dead process from PROMETHEUS_MULTIPROC_DIR, so
+    that its values are no longer exported. Called by gunicorn when a worker exits (see
+    config/gunicorn.py).
+
+    Args:
+        pid (int): The id of the dead process.
+        path (str, optional): The directory. Defaults to PROMETHEUS_MULTIPROC_DIR.
+    """
+    path = path or os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        multiprocess.mark_process_dead(process_name(pid), path)
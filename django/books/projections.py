@@ -0,0 +1,238 @@
+import functools
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import entries, tiers
+from .renderers import FastJSONRenderer
+
+_renderer = FastJSONRenderer()
+
+# How many times each set of fields was requested from this process. Counts are
+# approximate (they are updated without a lock), which is enough to tell the sets of
+# fields listing pages ask for from one-off requests.
+_requests = {}
+_MAX_TRACKED = 1024
+
+
+def parse(value):
+    """
+    Parses the `fields` query parameter of a book request.
+
+    Fields are comma separated, and nested fields are reached with dots, e.g.
+    `book.title,book.authors.lastName`. Fields inside lists apply to each of their
+    items.
+
+    Args:
+        value (str): The query parameter, or None.
+
+    Returns:
+        tuple: The requested fields as tuples of keys, sorted, without duplicates nor
+        fields already covered by a requested parent, or None if no field is requested.
+
+    Raises:
+        ValueError: If a field is malformed, or more than BOOK_PROJECTION_MAX_FIELDS
+            fields are requested.
+    """
+    if not value:
+        return None
+    fields = _parse(value)
+    if len(fields) > settings.BOOK_PROJECTION_MAX_FIELDS:
+        raise ValueError(
+            f"at most {settings.BOOK_PROJECTION_MAX_FIELDS} fields are allowed"
+        )
+    return fields or None
+
+
+@functools.lru_cache(maxsize=_MAX_TRACKED)
+def _parse(value):
+    # Listing pages send the same few parameters over and over, so their parsing is
+    # memoized.
+    paths = set()
+    for field in value.split(","):
+        field = field.strip()
+        if not field:
+            continue
+        keys = tuple(field.split("."))
+        if not all(keys):
+            raise ValueError(f"Invalid field {field!r}")
+        paths.add(keys)
+    return tuple(
+        sorted(
+            keys
+            for keys in paths
+            if not any(keys[:i] in paths for i in range(1, len(keys)))
+        )
+    )
+
+
+def project(data, fields):
+    """
+    Returns the subset of book data made of the requested fields, in the order of the
+    data.
+
+    Missing fields are left out.
+
+    Args:
+        data (dict): The book data.
+        fields (tuple): The requested fields (see `parse`).
+
+    Returns:
+        dict: The projected data.
+    """
+    tree = {}
+    for keys in fields:
+        node = tree
+        for key in keys[:-1]:
+            node = node.setdefault(key, {})
+        node[keys[-1]] = None
+    return _project(data, tree)
+
+
+def _project(value, tree):
+    if isinstance(value, list):
+        return [
+            _project(item, tree) for item in value if isinstance(item, (dict, list))
+        ]
+    result = {}
+    for key, child in value.items():
+        if key not in tree:
+            continue
+        if tree[key] is None:
+            result[key] = child
+        elif isinstance(child, (dict, list)):
+            result[key] = _project(child, tree[key])
+    return result
+
+
+def build(entry, fields):
+    """
+    Projects the book data held by a cache entry, and renders it.
+
+    Args:
+        entry (dict): A servable cache entry.
+        fields (tuple): The requested fields (see `parse`).
+
+    Returns:
+        dict: The JSON response `body` of the projection and its unquoted `etag`.
+    """
+    body = _renderer.render(project(entries.unwrap(entry), fields))
+    return {"body": body, "etag": entries.body_etag(body)}
+
+
+def cache_key(book_id, entry, fields):
+    """
+    Returns the cache key of a projection.
+
+    Projections are keyed by the ETag of the data they were taken from, so one is never
+    served once the book data changes, and they need no invalidation: outdated
+    projections are evicted or expire.
+
+    Args:
+        book_id: The book ID.
+        entry (dict): The cache entry the projection is taken from.
+        fields (tuple): The requested fields (see `parse`).
+
+    Returns:
+        str: The cache key.
+    """
+    # Short keys are cheaper to validate and store: the ETag and the fields are hashed
+    # together.
+    digest = hashlib.blake2b(entries.etag(entry).encode(), digest_size=12)
+    digest.update(",".join(".".join(keys) for keys in fields).encode())
+    return f"book-projection:{book_id}:{digest.hexdigest()}"
+
+
+def is_cached(fields):
+    """
+    Counts a request for a set of fields, and tells whether their projections are stored
+    in the cache.
+
+    Only sets of fields requested at least BOOK_PROJECTION_CACHE_AFTER times by this
+    process are stored, so that one-off requests do not fill BOOK_PROJECTION_CACHE.
+
+    Args:
+        fields (tuple): The requested fields (see `parse`).
+
+    Returns:
+        bool: True if the projections for these fields are read from and written to the
+        cache.
+    """
+    if not settings.BOOK_PROJECTION_CACHE:
+        return False
+    if len(_requests) >= _MAX_TRACKED and fields not in _requests:
+        _requests.clear()
+    count = _requests[fields] = _requests.get(fields, 0) + 1
+    return count >= settings.BOOK_PROJECTION_CACHE_AFTER
+
+
+def render_many(values, fields):
+    """
+    Returns the rendered projections of the data of several books.
+
+    Cached projections are read with a single `get_many` and served as is, so they cost
+    no decoding nor encoding; the others are built and, for frequently requested fields,
+    written back in a single write.
+
+    Args:
+        values (dict): Each book ID mapped to a servable cache entry.
+        fields (tuple): The requested fields (see `parse`).
+
+    Returns:
+        dict: Each book ID mapped to its projection (see `build`).
+    """
+    if not is_cached(fields):
+        return {book_id: build(entry, fields) for book_id, entry in values.items()}
+
+    keys = {
+        book_id: cache_key(book_id, entry, fields) for book_id, entry in values.items()
+    }
+    found = caches[settings.BOOK_PROJECTION_CACHE].get_many(list(keys.values()))
+    results = {}
+    built = {}
+    for book_id, entry in values.items():
+        results[book_id] = found.get(keys[book_id])
+        if results[book_id] is None:
+            results[book_id] = built[keys[book_id]] = build(entry, fields)
+    if built:
+        tiers.write_many(
+            [settings.BOOK_PROJECTION_CACHE], built, settings.BOOK_PROJECTION_TTL
+        )
+    return results
+
+
+def render(book_id, entry, fields):
+    """
+    Returns the rendered projection of the data of a book. See `render_many`.
+
+    Args:
+        book_id: The book ID.
+        entry (dict): A servable cache entry.
+        fields (tuple): The requested fields (see `parse`).
+
+    Returns:
+        dict: The projection (see `build`).
+    """
+    return render_many({book_id: entry}, fields)[book_id]
+
+
+async def arender(book_id, entry, fields):
+    """
+    Returns the rendered projection of the data of a book without blocking the event
+    loop. See `render`.
+    """
+    if not is_cached(fields):
+        return build(entry, fields)
+
+    key = cache_key(book_id, entry, fields)
+    projection = await tiers.aget(settings.BOOK_PROJECTION_CACHE, key)
+    if projection is None:
+        projection = build(entry, fields)
+        await tiers.aset(
+            settings.BOOK_PROJECTION_CACHE,
+            key,
+            projection,
+            settings.BOOK_PROJECTION_TTL,
+        )
+    return projection
@@ -0,0 +1,53 @@
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except (
+    ImportError
+):  # orjson is optional: without it, FastJSONRenderer renders like JSONRenderer.
+    orjson = None
+
+_OPTIONS = (
+    (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+    if orjson is not None
+    else 0
+)
+_LINE_SEPARATORS = (
+    b"\xe2\x80"  # The UTF-8 prefix of U+2028 and U+2029, which JSONRenderer escapes.
+)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    A JSONRenderer encoding with orjson, to the same bytes as DRF's JSONRenderer.
+
+    Book data is plain JSON, which orjson encodes several times faster than the standard
+    library. Values orjson does not handle itself (dates, decimals, lazy strings...) go
+    through DRF's encoder, and U+2028 and U+2029 are escaped like DRF does. Whatever
+    orjson cannot render identically (indented or ASCII-only output, integers over 64
+    bits) is rendered by JSONRenderer, as is everything when orjson is not installed.
+    NaN and infinities, which JSONRenderer rejects, are rendered as null.
+    """
+
+    def _default(self, value):
+        return self.encoder_class().default(value)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None
+            or self.ensure_ascii
+            or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b""
+        try:
+            body = orjson.dumps(data, default=self._default, option=_OPTIONS)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        if _LINE_SEPARATORS in body:
+            body = body.replace("\u2028".encode(), b"\\u2028").replace(
+                "\u2029".encode(), b"\\u2029"
+            )
+        return body
@@ -0,0 +1,153 @@
+import logging
+import pickle
+import struct
+
+from django_redis.serializers.base import BaseSerializer
+
+try:
+    import orjson
+except ImportError:  # orjson is optional and only available with orjson installed.
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional and only available with msgpack installed.
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+# Serialized values start with their codec, so that values stored with any codec stay
+# readable: pickle (protocol 2+) starts with 0x80, and the other codecs with a letter.
+# None starts with the compressors' format version.
+PICKLE = b"\x80"
+ORJSON = b"O"
+MSGPACK = b"M"
+CODECS = ("pickle", "orjson", "msgpack")
+
+_LENGTH = struct.Struct("<I")
+
+
+class BookSerializer(BaseSerializer):
+    """
+    A django-redis serializer for the Redis tier, storing values with pickle, orjson or
+    msgpack.
+
+    JSON has no bytes type, so orjson values are stored as a JSON header followed by the
+    raw bytes of the value's top-level bytes fields, such as the rendered body of a
+    cache entry, which are neither copied into the JSON nor escaped. Values the codec
+    cannot represent are pickled, if pickle is allowed. Values are read whatever codec
+    they were stored with, except pickled ones when pickle is not allowed, as unpickling
+    runs code chosen by whoever wrote the value. Values that cannot be read (not ours,
+    corrupted, or pickled) are logged and read as missing, so that they are replaced on
+    the next write. It is configured
+    through the cache OPTIONS:
+
+    - SERIALIZER_CODEC: "pickle", "orjson" or "msgpack". Defaults to "pickle".
+    - SERIALIZER_ALLOW_PICKLE: whether pickled values may be read and written. Defaults
+      to True.
+    """
+
+    def __init__(self, options):
+        super().__init__(options)
+        self.codec = options.get("SERIALIZER_CODEC", "pickle")
+        self.allow_pickle = options.get("SERIALIZER_ALLOW_PICKLE", True)
+        if self.codec not in CODECS:
+            raise ValueError(f"Unknown serializer codec {self.codec!r}")
+        if self.codec == "pickle" and not self.allow_pickle:
+            raise ValueError("The pickle codec requires SERIALIZER_ALLOW_PICKLE")
+        if self.codec == "orjson" and orjson is None:
+            raise ImportError("The orjson codec requires orjson to be installed")
+        if self.codec == "msgpack" and msgpack is None:
+            raise ImportError("The msgpack codec requires msgpack to be installed")
+
+    def dumps(self, value):
+        """
+        Serializes a value with the configured codec.
+
+        Args:
+            value: The value to store.
+
+        Returns:
+            bytes: The serialized value, starting with its codec.
+
+        Raises:
+            TypeError: If the codec cannot represent the value and pickle is not
+                allowed.
+        """
+        try:
+            if self.codec == "orjson":
+                return _orjson_dumps(value)
+            if self.codec == "msgpack":
+                return MSGPACK + msgpack.packb(value, use_bin_type=True)
+        except (TypeError, ValueError, OverflowError):
+            if not self.allow_pickle:
+                raise TypeError(
+                    f"Cannot serialize {type(value).__name__} with {self.codec}"
+                )
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, value):
+        """
+        Deserializes a stored value, whatever codec it was stored with.
+
+        Args:
+            value (bytes): The stored value, decompressed.
+
+        Returns:
+            The value, or None if it cannot be read.
+        """
+        codec = value[:1]
+        try:
+            if codec == ORJSON and orjson is not None:
+                return _orjson_loads(value)
+            if codec == MSGPACK and msgpack is not None:
+                return msgpack.unpackb(
+                    memoryview(value)[1:], raw=False, strict_map_key=False
+                )
+            if codec == PICKLE and self.allow_pickle:
+                return pickle.loads(value)
+        except Exception as error:
+            logger.warning("Could not deserialize a cached value: %r", error)
+            return None
+        logger.warning(
+            "Ignoring a cached value of unknown or disallowed format %r", codec
+        )
+        return None
+
+
+def _orjson_dumps(value):
+    # [ORJSON][header length][header: [value without its top-level bytes, [[key,
+    # length], ...]]][bytes, ...]
+    fields = []
+    if isinstance(value, dict):
+        raw = [
+            (key, field)
+            for key, field in value.items()
+            if isinstance(field, (bytes, bytearray))
+        ]
+        if raw:
+            value = {
+                key: field
+                for key, field in value.items()
+                if not isinstance(field, (bytes, bytearray))
+            }
+            fields = [[key, len(field)] for key, field in raw]
+    header = orjson.dumps([value, fields])
+    if not fields:
+        return b"".join((ORJSON, _LENGTH.pack(len(header)), header))
+    return b"".join(
+        (ORJSON, _LENGTH.pack(len(header)), header, *(field for _, field in raw))
+    )
+
+
+def _orjson_loads(value):
+    view = memoryview(value)
+    start = 1 + _LENGTH.size
+    end = start + _LENGTH.unpack_from(view, 1)[0]
+    result, fields = orjson.loads(view[start:end])
+    for key, length in fields:
+        start, end = end, end + length
+        result[key] = bytes(view[start:end])
+    if end != len(view):
+        raise ValueError("Trailing data after the serialized value")
+    return result
@@ -1,22 +1,56 @@
 from config.celery import app
+from celery.signals import task_postrun, task_prerun, worker_process_init
 from django.conf import settings
-from requests import request
+from django.core.cache import caches
 from django.urls import reverse
 from .classes import Book
+from . import entries
+from . import hotness
+from . import invalidation
+from . import metrics
+from . import upstream
 import json
+import time
+
+_task_starts = {}  # When each running task started, by task ID.
+
+
+@worker_process_init.connect
+def _worker_started(**kwargs):
+    # Worker processes keep in-process tiers too, so they apply the invalidations of the
+    # other processes.
+    invalidation.start_listener()
+
+
+@task_prerun.connect
+def _task_started(task_id=None, **kwargs):
+    _task_starts[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def _task_finished(task_id=None, task=None, state=None, **kwargs):
+    # Records the run time of every task in the /metrics histograms, by task name and
+    # final state.
+    start = _task_starts.pop(task_id, None)
+    if start is not None and state:
+        metrics.task(task.name.rsplit(".", 1)[-1], state, time.perf_counter() - start)
 
 
 @app.task
-def clear_book_cache(book_id, delete_from=None):
+def clear_book_cache(book_id, delete_from=None, negative_only=False):
     """
     Celery task to clear the cached data for a specific book across multiple caches.
 
-    This function sends DELETE requests to the specified caches to remove the book data.
+    This function sends DELETE requests, over the shared pooled client, to the specified
+    caches to remove the book data.
 
     Args:
         book_id (str): The unique identifier for the book.
         delete_from (list, optional): A list of cache names from which to delete the data.
                                       Defaults to all caches defined in settings.CACHES.
+        negative_only (bool, optional): Only purge negative entries (books the API had
+                                        no data for), keeping actual book data. Defaults
+                                        to False.
 
     Returns:
         dict: A dictionary with cache names as keys and the server's response as values.
@@ -26,13 +60,16 @@ def clear_book_cache(book_id, delete_from=None):
 
     result = {}
     endpoint = reverse("get-book", kwargs={"book_id": book_id})
-    url = f"http://django:8000{endpoint}"
+    client = upstream.get_client("internal")
     headers = {"Authorization": f"Bearer {settings.CELERY_SECRET_KEY}"}
 
     # Iterate through the specified caches and send a DELETE request to clear the cache.
     for cache in delete_from:
-        response = request(
-            method="DELETE", url=url, data={"cache": cache}, headers=headers
+        response = client.request(
+            "DELETE",
+            endpoint,
+            data={"cache": cache, "negative_only": int(negative_only)},
+            headers=headers,
         )
         if response.status_code != 200:
             result[cache] = (
@@ -52,6 +89,8 @@ def refresh_book_cache(book_id, update_in=None):
     Celery task to refresh (update) the cached data for a specific book across multiple caches.
 
     This function fetches the latest book data from the Taaghche API and updates the specified caches.
+    Both the fetch and the updates reuse the pooled, keep-alive upstream clients of the
+    worker process.
 
     Args:
         book_id (str): The unique identifier for the book.
@@ -59,28 +98,34 @@ def refresh_book_cache(book_id, update_in=None):
                                     Defaults to all caches defined in settings.CACHES.
 
     Returns:
-        dict: A dictionary with cache names as keys and the server's response as values.
-              If the Taaghche API is down, returns a dictionary with an error message.
+        dict: A dictionary with cache names as keys and the server's response as values,
+              i.e. the write result acknowledged by each cache (`success`, `written`,
+              `error`). If the Taaghche API did not return the book, nothing is updated
+              (stale data keeps being served) and a dictionary with an error message,
+              the status and the reason is returned instead. If the API has no data for
+              the book, it is remembered in each cache like data would be, and the write
+              result of each cache is returned under `caches`.
     """
     if update_in is None:
         update_in = settings.CACHES
 
     result = {}
     endpoint = reverse("get-book", kwargs={"book_id": book_id})
-    url = f"http://django:8000{endpoint}"
+    client = upstream.get_client("internal")
     headers = {"Authorization": f"Bearer {settings.CELERY_SECRET_KEY}"}
 
     book = Book(book_id=book_id)
-    data = json.dumps(
-        book.fetch_book_data()
+    data = book.fetch_book_data(
+        store=False
     )  # Fetch the latest book data from the Taaghche API
 
-    if data:
+    if data is not None:
+        data = json.dumps(data)
         # Iterate through the specified caches and send a PUT request to update the cache.
         for cache in update_in:
-            response = request(
-                method="PUT",
-                url=url,
+            response = client.request(
+                "PUT",
+                endpoint,
                 data={"cache": cache, "data": data},
                 headers=headers,
             )
@@ -89,10 +134,161 @@ def refresh_book_cache(book_id, update_in=None):
                     response.json()
                 )  # Record the JSON response if the request failed
             else:
-                result[cache] = (
-                    response.text
-                )  # Record the text response if the request succeeded
+                result[cache] = response.json()[
+                    "result"
+                ]  # Record the write result acknowledged by the cache
 
         return result
+    elif book.upstream_failed:
+        return {
+            "error": "Taaghche API is unavailable",
+            "status": book.entry["status"],
+            "reason": book.upstream_error
+            or f"Taaghche API answered with {book.entry['status']}",
+        }
     else:
-        return {"error": "It seems Taaghche API is down!"}
+        # Remember that the API has no data for it, like a cache miss would, in the same
+        # caches and through the same path as the data.
+        return {
+            "error": "Taaghche API has no data for this book",
+            "status": book.entry["status"],
+            "caches": {
+                cache: book.set_in_cache(cache, book.entry) for cache in update_in
+            },
+        }
+
+
+def _chunks(book_ids):
+    for start in range(0, len(book_ids), settings.BOOK_BULK_CHUNK_SIZE):
+        end = start + settings.BOOK_BULK_CHUNK_SIZE
+        yield book_ids[start:end]
+
+
+@app.task
+def clear_books_cache(book_ids, delete_from=None, negative_only=False):
+    """
+    Celery task to clear the cached data of many books across multiple caches.
+
+    The books are handled in chunks of BOOK_BULK_CHUNK_SIZE. For each chunk, the shared
+    caches are written directly with one pipelined delete, and the in-process caches of
+    every Django process are notified through the invalidation bus, without any HTTP
+    request (see `Book.delete_many`).
+
+    Args:
+        book_ids (list): The unique identifiers of the books.
+        delete_from (list, optional): A list of cache names from which to delete the
+                                      data. Defaults to all caches defined in
+                                      settings.CACHES.
+        negative_only (bool, optional): Only purge negative entries (books the API had
+                                        no data for), keeping actual book data. Defaults
+                                        to False.
+
+    Returns:
+        dict: The number of books, and for each chunk its number of books and the result
+        of each cache.
+    """
+    chunks = []
+    for chunk in _chunks(book_ids):
+        chunks.append(
+            {
+                "books": len(chunk),
+                "caches": Book.delete_many(
+                    chunk, delete_from, negative_only=negative_only
+                ),
+            }
+        )
+    return {"books": len(book_ids), "chunks": chunks}
+
+
+@app.task
+def refresh_books_cache(book_ids, update_in=None):
+    """
+    Celery task to refresh (update) the cached data of many books across multiple
+    caches.
+
+    The books are handled in chunks of BOOK_BULK_CHUNK_SIZE. For each chunk, the books
+    are fetched from the Taaghche API concurrently, the shared caches are written
+    directly with pipelined writes, and the in-process caches of every Django process
+    get the new data through the invalidation bus, without any HTTP request (see
+    `Book.refresh_many`).
+
+    Args:
+        book_ids (list): The unique identifiers of the books.
+        update_in (list, optional): A list of cache names in which to update the data.
+                                    Defaults to all caches defined in settings.CACHES.
+
+    Returns:
+        dict: The number of books, and for each chunk its number of books, how many were
+              found or not by the API, how many the API could not answer for (`failed`:
+              errors, timeouts and rejections by its guard), and the result of each
+              cache.
+    """
+    chunks = []
+    for chunk in _chunks(book_ids):
+        fetched, results = Book.refresh_many(chunk, update_in)
+        negative = sum(1 for entry in fetched.values() if entries.is_negative(entry))
+        failed = sum(1 for entry in fetched.values() if entries.is_failure(entry))
+        chunks.append(
+            {
+                "books": len(chunk),
+                "found": len(fetched) - negative,
+                "not_found": negative - failed,
+                "failed": failed,
+                "caches": results,
+            }
+        )
+    return {"books": len(book_ids), "chunks": chunks}
+
+
+@app.task
+def refresh_hot_books():
+    """
+    Celery beat task keeping the hottest books cached (see `hotness`), every
+    BOOK_HOT_REFRESH_INTERVAL seconds.
+
+    The BOOK_HOT_TOP_K hottest books are looked up in the shared caches (Redis). Those
+    missing from them, stale, or becoming stale within BOOK_HOT_REFRESH_AHEAD seconds
+    are refreshed from the API by `refresh_books_cache`, before any request takes the
+    miss. The others are sent again to the in-process caches of every process through
+    the invalidation bus, which restarts their timeout there. The scores of the hot
+    books are then decayed.
+
+    Returns:
+        dict: The number of hot books, the IDs of the books being refreshed, and the
+              number of books sent to the in-process caches.
+    """
+    hot = [book_id for book_id, _ in hotness.top(settings.BOOK_HOT_TOP_K)]
+    hotness.decay()
+    local = invalidation.local_tiers()
+    found = {}
+    for cache_name in settings.CACHES:
+        remaining = [book_id for book_id in hot if book_id not in found]
+        if cache_name in local or not remaining:
+            continue
+        found.update(caches[cache_name].get_many(remaining))
+
+    now = time.time()
+    refreshed, renewed = [], {}
+    for book_id in hot:
+        entry = found.get(book_id)
+        if entries.is_negative(entry):
+            continue  # The API had no data for it: its own short timeout applies.
+        state = entries.state(entry, now)
+        if (
+            state != entries.FRESH
+            or entry["soft"] - now <= settings.BOOK_HOT_REFRESH_AHEAD
+        ):
+            refreshed.append(book_id)
+        else:
+            renewed[book_id] = entry
+
+    if refreshed:
+        refresh_books_cache.delay(refreshed)
+    if renewed and local:
+        invalidation.publish_many(
+            [
+                (book_id, invalidation.SET, entry, False)
+                for book_id, entry in renewed.items()
+            ]
+        )
+    return {"hot": len(hot), "refreshed": refreshed, "renewed": len(renewed)}
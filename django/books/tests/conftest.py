@@ -0,0 +1,28 @@
+import pytest
+
+
+@pytest.fixture
+def local_caches(settings):
+    """
+    Fixture replacing every cache tier with an isolated in-memory cache.
+
+    This lets the caching logic be tested without Redis or the rest of the
+    docker-compose stack.
+
+    Returns:
+        list: The names of the cache tiers, in lookup order.
+    """
+    settings.CACHES = {
+        name: {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": f"test-{name}",
+        }
+        for name in ("default", "redis_cache")
+    }
+    settings.BOOK_FILL_LOCK_CACHE = "redis_cache"
+    yield list(settings.CACHES)
+
+    from django.core.cache import caches
+
+    for name in settings.CACHES:
+        caches[name].clear()
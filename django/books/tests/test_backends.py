@@ -0,0 +1,163 @@
+import multiprocessing
+import time
+
+from .. import backends
+from ..backends import L1Cache, SharedMemoryCache, sizeof
+
+
+def make_cache(name, max_bytes, shards=1):
+    cache = L1Cache(name, {"OPTIONS": {"MAX_BYTES": max_bytes, "SHARDS": shards}})
+    cache.clear()
+    return cache
+
+
+def test_values_are_shared_and_bounded_by_bytes():
+    """
+    Test that the L1 cache returns stored values without copying, and stays within its
+    memory budget.
+
+    Asserts:
+        - A read returns the very object that was stored.
+        - Writing more than the budget evicts entries, and the counters report it.
+        - A value larger than a shard is not stored.
+    """
+    value = {"_entry": 1, "body": b"x" * 1000}
+    cache = make_cache("test-l1-bytes", max_bytes=20 * sizeof(value))
+    cache.set(1, value)
+    assert cache.get(1) is value
+
+    for key in range(2, 100):
+        cache.set(key, {"_entry": 1, "body": b"x" * 1000})
+    stats = cache.stats()
+    assert stats["bytes"] <= stats["max_bytes"]
+    assert stats["evictions"] > 0
+    assert stats["entries"] < 99
+
+    cache.set("huge", b"x" * stats["max_bytes"])
+    assert cache.get("huge") is None
+
+
+def test_hot_keys_survive_a_scan():
+    """
+    Test that keys read repeatedly are not evicted by a scan of keys read once
+    (segmented LRU).
+
+    Asserts:
+        - The hot keys are still cached after scanning many more keys than the cache can
+          hold.
+        - Hits and misses are counted.
+    """
+    cache = make_cache("test-l1-scan", max_bytes=100 * sizeof(b"x" * 500), shards=2)
+    for key in range(10):
+        cache.set(f"hot-{key}", b"x" * 500)
+        cache.get(f"hot-{key}")
+
+    for key in range(1000):
+        cache.set(f"scan-{key}", b"x" * 500)
+
+    assert all(cache.get(f"hot-{key}") is not None for key in range(10))
+    assert cache.get("scan-0") is None
+    stats = cache.stats()
+    assert stats["hits"] == 20
+    assert stats["misses"] == 1
+
+
+def test_expiry_and_add():
+    """
+    Test the timeouts and the add semantics of the L1 cache.
+
+    Asserts:
+        - An expired key is missing, and counted as an expiration.
+        - add() only writes missing or expired keys.
+    """
+    cache = make_cache("test-l1-expiry", max_bytes=2**20)
+    cache.set("short", 1, timeout=0.05)
+    assert cache.add("short", 2) is False
+    time.sleep(0.06)
+
+    assert cache.get("short") is None
+    assert cache.stats()["expirations"] == 1
+    assert cache.add("short", 3) is True
+    assert cache.get("short") == 3
+    assert cache.delete("short") is True
+    assert not cache.has_key("short")
+
+
+def make_shared_cache(path, max_bytes=2**20, slot_bytes=4096):
+    return SharedMemoryCache(
+        str(path), {"OPTIONS": {"MAX_BYTES": max_bytes, "SLOT_BYTES": slot_bytes}}
+    )
+
+
+def write_in_child(path, key, value):
+    # Maps the file again, as an unrelated worker process would.
+    backends._tables.clear()
+    make_shared_cache(path).set(key, value)
+
+
+def test_shared_memory_cache_is_shared_by_processes(tmp_path):
+    """
+    Test that the shared-memory cache is shared by every process mapping its file, and
+    survives them.
+
+    Asserts:
+        - A value written by another process is read by this one.
+        - Values are still there after the file is mapped again, as by a restarted
+          worker.
+        - A file of another layout is replaced by an empty one.
+    """
+    path = tmp_path / "l1"
+    cache = make_shared_cache(path)
+    child = multiprocessing.get_context("spawn").Process(
+        target=write_in_child, args=(path, 1, {"_entry": 1, "body": b"x" * 1000})
+    )
+    child.start()
+    child.join()
+    assert child.exitcode == 0
+    assert cache.get(1) == {"_entry": 1, "body": b"x" * 1000}
+    assert cache.stats()["entries"] == 1
+
+    backends._tables.clear()
+    assert make_shared_cache(path).get(1) == {"_entry": 1, "body": b"x" * 1000}
+
+    backends._tables.clear()
+    assert make_shared_cache(path, slot_bytes=8192).get(1) is None
+    backends._tables.clear()
+
+
+def test_shared_memory_cache_semantics(tmp_path):
+    """
+    Test the timeouts, add, touch and delete semantics, and the bounds, of the
+    shared-memory cache.
+
+    Asserts:
+        - An expired key is missing; add() only writes missing or expired keys; touch()
+          extends a timeout.
+        - A value larger than a slot is not stored, and counted as rejected.
+        - Writing more keys than a bucket holds evicts some, keeping the ones read since
+          they were written.
+    """
+    cache = make_shared_cache(tmp_path / "l1", max_bytes=8 * 4096)
+    cache.set("short", 1, timeout=0.05)
+    assert cache.add("short", 2) is False
+    assert cache.touch("short", timeout=10) is True
+    cache.set("shorter", 1, timeout=0.05)
+    time.sleep(0.06)
+    assert cache.get("short") == 1
+    assert cache.get("shorter") is None
+    assert cache.add("shorter", 3) is True
+    assert cache.get("shorter") == 3
+    assert cache.delete("shorter") is True
+    assert not cache.has_key("shorter")
+
+    cache.set("huge", b"x" * 4096)
+    assert cache.get("huge") is None
+    assert cache.stats()["rejected"] == 1
+
+    for key in range(20):
+        cache.set(key, key)
+    assert cache.get("short") == 1
+    stats = cache.stats()
+    assert stats["entries"] == stats["slots"] == 8
+    assert stats["evictions"] > 0
+    backends._tables.clear()
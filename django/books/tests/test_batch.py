@@ -0,0 +1,96 @@
+from django.core.cache import caches
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from .. import entries
+from ..classes import Book
+
+
+def test_get_many_entries_reads_each_tier_once(local_caches, monkeypatch):
+    """
+    Test that a batch lookup only fetches books missing from every cache, and backfills
+    the caches.
+
+    Asserts:
+        - Each book is reported with the cache it was found in, or "upstream".
+        - Only the missing book is fetched from the API.
+        - Every cache that missed a found book holds it afterwards.
+        - A book unknown to the API has no data, and is cached as a negative entry.
+    """
+    fetched = []
+
+    def fetch_book_data(self, store=True):
+        fetched.append(self.book_id)
+        if self.book_id == 30:
+            self.entry = entries.wrap_negative(404)
+            return None
+        data = {"book": {"id": self.book_id}}
+        self.entry = entries.wrap(data)
+        return data
+
+    monkeypatch.setattr(Book, "fetch_book_data", fetch_book_data)
+    caches["default"].set(1, entries.wrap({"book": {"id": 1}}))
+    caches["redis_cache"].set(2, entries.wrap({"book": {"id": 2}}))
+
+    results = {
+        book_id: (entries.unwrap(entry), place)
+        for book_id, (entry, place) in Book.get_many_entries([1, 2, 3, 30]).items()
+    }
+
+    assert results == {
+        1: ({"book": {"id": 1}}, "default"),
+        2: ({"book": {"id": 2}}, "redis_cache"),
+        3: ({"book": {"id": 3}}, "upstream"),
+        30: (None, "upstream"),
+    }
+    assert sorted(fetched) == [3, 30]
+    assert sorted(caches["default"].get_many([1, 2, 3, 30])) == [1, 2, 3, 30]
+    assert sorted(caches["redis_cache"].get_many([1, 2, 3, 30])) == [2, 3, 30]
+    assert entries.is_negative(caches["redis_cache"].get(30))
+
+
+def test_get_books_view(local_caches):
+    """
+    Test that the batch view lists each book with its data origin, and rejects malformed
+    ids.
+
+    Asserts:
+        - A valid request returns every book in the requested order, once per time it
+          was requested.
+        - A non numeric id returns a 400 status.
+    """
+    caches["default"].set(1, entries.wrap({"book": {"id": 1}}))
+    caches["default"].set(2, entries.wrap({"book": {"id": 2}}))
+    client = APIClient()
+    url = reverse("get-books")
+
+    response = client.get(url, {"ids": "2,1,2"})
+    assert response.status_code == 200
+    assert response.json() == {
+        "books": [
+            {
+                "id": 2,
+                "data-origin": "default",
+                "data-negative": None,
+                "data-stale": False,
+                "data": {"book": {"id": 2}},
+            },
+            {
+                "id": 1,
+                "data-origin": "default",
+                "data-negative": None,
+                "data-stale": False,
+                "data": {"book": {"id": 1}},
+            },
+            {
+                "id": 2,
+                "data-origin": "default",
+                "data-negative": None,
+                "data-stale": False,
+                "data": {"book": {"id": 2}},
+            },
+        ]
+    }
+
+    response = client.get(url, {"ids": "1,abc"})
+    assert response.status_code == 400
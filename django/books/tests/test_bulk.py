@@ -0,0 +1,87 @@
+import threading
+
+from django.core.cache import caches
+
+from .. import entries, tasks, upstream
+
+
+class FakeResponse:
+    def __init__(self, book_id):
+        self.status_code = 404 if book_id == 30 else 200
+        self.book_id = book_id
+
+    def json(self):
+        return {"book": {"id": self.book_id}}
+
+
+def test_refresh_books_cache_in_chunks(local_caches, monkeypatch, settings):
+    """
+    Test that the bulk refresh fetches every book and writes every cache directly, chunk
+    by chunk.
+
+    Asserts:
+        - Every book is fetched once, and no request is sent to the Django API.
+        - Each chunk reports its books, how many were found, not found or failed, and
+          what each cache acknowledged.
+        - Every cache holds the new entries, including the negative one.
+    """
+    settings.BOOK_BULK_CHUNK_SIZE = 2
+    fetched = []
+    lock = threading.Lock()
+
+    def get(path):
+        book_id = int(path.strip("/").split("/")[-1])
+        with lock:
+            fetched.append(book_id)
+        if book_id == 31:
+            raise upstream.UpstreamError("connection reset")
+        return FakeResponse(book_id)
+
+    monkeypatch.setattr(upstream.get_client(), "get", get)
+    monkeypatch.setattr(
+        upstream.get_client("internal"), "request", lambda *args, **kwargs: 1 / 0
+    )
+    caches["redis_cache"].set(1, entries.wrap({"book": {"id": 1, "old": True}}))
+
+    result = tasks.refresh_books_cache([1, 2, 30, 31])
+
+    assert sorted(fetched) == [1, 2, 30, 31]
+    assert result["books"] == 4
+    counts = [
+        (chunk["books"], chunk["found"], chunk["not_found"], chunk["failed"])
+        for chunk in result["chunks"]
+    ]
+    assert counts == [(2, 2, 0, 0), (2, 0, 1, 1)]
+    assert result["chunks"][0]["caches"]["redis_cache"] == {
+        "cache": "redis_cache",
+        "success": True,
+        "written": 2,
+        "error": None,
+    }
+    for cache_name in local_caches:
+        assert entries.unwrap(caches[cache_name].get(1)) == {"book": {"id": 1}}
+        assert entries.is_negative(caches[cache_name].get(30))
+
+
+def test_clear_books_cache_negative_only(local_caches):
+    """
+    Test that the bulk clear only removes negative entries when asked to.
+
+    Asserts:
+        - Negative entries are deleted and counted; book data is kept.
+        - Without negative_only, everything is deleted.
+    """
+    for cache_name in local_caches:
+        caches[cache_name].set(1, entries.wrap({"book": {"id": 1}}))
+        caches[cache_name].set(30, entries.wrap_negative(404))
+
+    result = tasks.clear_books_cache([1, 30], negative_only=True)
+
+    assert [
+        chunk["caches"]["redis_cache"]["deleted"] for chunk in result["chunks"]
+    ] == [1]
+    assert caches["default"].get(30) is None
+    assert caches["default"].get(1) is not None
+
+    tasks.clear_books_cache([1, 30])
+    assert caches["redis_cache"].get_many([1, 30]) == {}
@@ -0,0 +1,140 @@
+import asyncio
+import os
+
+import pytest
+import redis
+from django.core.cache import caches
+
+from .. import clients, tiers
+from ..clients import HashRing
+
+TEST_REDIS_URL = os.getenv("TEST_REDIS_URL", "redis://localhost:6379/15")
+DEAD_REDIS_URL = "redis://127.0.0.1:1/0"
+
+
+def test_hash_ring_balances_keys_and_moves_few_when_growing():
+    """
+    Test that the hash ring spreads keys evenly, and only moves keys to a node added to
+    it.
+
+    Asserts:
+        - Each of 4 nodes gets within 20% of a quarter of the keys, whatever order the
+          nodes are listed in.
+        - Adding a fifth node only moves keys to it, about a fifth of them.
+    """
+    keys = [f":1:{book_id}" for book_id in range(20000)]
+    nodes = [f"redis://redis-{name}:6379/1" for name in "abcd"]
+    ring = HashRing(nodes)
+    before = {key: ring.node(key) for key in keys}
+    assert before == {key: HashRing(reversed(nodes)).node(key) for key in keys}
+    for node in nodes:
+        assert abs(list(before.values()).count(node) / len(keys) - 0.25) < 0.05
+
+    grown = HashRing(nodes + ["redis://redis-e:6379/1"])
+    moved = [key for key in keys if grown.node(key) != before[key]]
+    assert {grown.node(key) for key in moved} == {"redis://redis-e:6379/1"}
+    assert 0.15 < len(moved) / len(keys) < 0.25
+
+
+@pytest.fixture
+def sharded_cache(settings):
+    """
+    Fixture returning a function that configures the Redis tier with the given shards,
+    on two databases of TEST_REDIS_URL's server. Skips the test if that server is not
+    reachable.
+
+    Returns:
+        tuple: The function, taking a LOCATION, and the URLs of the two databases.
+    """
+    base = TEST_REDIS_URL.rsplit("/", 1)[0]
+    urls = [f"{base}/14", f"{base}/15"]
+    try:
+        for url in urls:
+            redis.Redis.from_url(url, socket_connect_timeout=0.5).flushdb()
+    except redis.RedisError:
+        pytest.skip(f"No Redis server at {base}")
+
+    def configure(location):
+        clients._down.clear()
+        settings.CACHES = {
+            "default": {
+                "BACKEND": "books.backends.L1Cache",
+                "LOCATION": "test-shards-l1",
+            },
+            "redis_cache": {
+                "BACKEND": "django_redis.cache.RedisCache",
+                "LOCATION": location,
+                "OPTIONS": {
+                    "CLIENT_CLASS": "books.clients.ShardedClient",
+                    "SOCKET_CONNECT_TIMEOUT": 0.5,
+                },
+            },
+        }
+        return caches["redis_cache"]
+
+    yield configure, urls
+    clients._down.clear()
+    for url in urls:
+        redis.Redis.from_url(url).flushdb()
+
+
+def test_sharded_tier_spreads_keys_and_degrades_when_a_shard_is_down(sharded_cache):
+    """
+    Test that the sharded Redis tier spreads keys over its shards, and misses instead of
+    failing on a dead one.
+
+    Asserts:
+        - Keys written in bulk or one by one are spread over both shards, and read back.
+        - Keys are only deleted by `delete_if` when they hold the given value, and never
+          by expired writes that must not overwrite them.
+        - Reads go to the primary when the replica of a shard is unreachable, sync and
+          async, and the async clients get the tier's connection options.
+        - With a dead shard, its keys are missed (sync and async) and its writes
+          reported as failed, while the keys of the other shard are still read and
+          written.
+    """
+    configure, urls = sharded_cache
+    cache = configure(";".join(urls))
+    values = {book_id: {"book": {"id": book_id}} for book_id in range(40)}
+    assert tiers.write_many(["redis_cache"], values)["redis_cache"]["written"] == 40
+    cache.set(40, {"book": {"id": 40}})
+    counts = [redis.Redis.from_url(url).dbsize() for url in urls]
+    assert sum(counts) == 41 and min(counts) > 5
+    assert cache.get_many(list(range(41))) == {**values, 40: {"book": {"id": 40}}}
+    assert tiers.existing("redis_cache", [1, 2, 99]) == {1, 2}
+    assert not tiers.delete_if("redis_cache", 1, {"book": {"id": 2}})
+    assert tiers.delete_if("redis_cache", 1, values[1]) and cache.get(1) is None
+    assert (
+        asyncio.run(tiers.adelete_if("redis_cache", 2, values[2]))
+        and cache.get(2) is None
+    )
+    cache.set_many({1: values[1], 2: values[2]})
+    result = asyncio.run(
+        tiers.awrite_many(["redis_cache"], {1: values[2]}, timeout=0, nx=True)
+    )["redis_cache"]
+    assert result["success"] and result["written"] == 0 and cache.get(1) == values[1]
+
+    cache = configure(f"{urls[0]},{DEAD_REDIS_URL};{urls[1]}")
+    replicated = next(
+        key for key in values if cache.client.shard(cache.make_key(key))[0] == 0
+    )
+
+    async def aread(key):
+        pool = tiers.async_redis("redis_cache", cache, 1).connection_pool
+        return pool.connection_kwargs["socket_connect_timeout"], await tiers.aget(
+            "redis_cache", key
+        )
+
+    assert asyncio.run(aread(replicated)) == (0.5, values[replicated])
+    assert not cache.client.available(1)
+    clients._down.clear()
+    assert cache.get_many(list(range(40))) == values
+    assert not cache.client.available(1)
+
+    cache = configure(f"{urls[0]};{DEAD_REDIS_URL}")
+    live = {key for key in values if cache.client.shard(cache.make_key(key))[0] == 0}
+    result = tiers.write_many(["redis_cache"], values)["redis_cache"]
+    assert not result["success"] and result["written"] == len(live) and result["error"]
+    assert cache.get_many(list(values)) == {key: values[key] for key in live}
+    assert all((cache.get(key) is None) == (key not in live) for key in values)
+    assert asyncio.run(tiers.aget("redis_cache", max(set(values) - live))) is None
@@ -0,0 +1,138 @@
+import asyncio
+import threading
+import time
+
+from django.core.cache import caches
+
+from .. import entries, tiers
+from ..classes import AsyncBook, Book
+
+
+def test_concurrent_misses_fetch_once(local_caches, monkeypatch):
+    """
+    Test that concurrent misses for the same book send a single request upstream.
+
+    Asserts:
+        - `fetch_book_data` is called exactly once.
+        - Every caller receives the fetched data.
+    """
+    calls = []
+
+    def fetch_book_data(self):
+        calls.append(self.book_id)
+        time.sleep(0.2)
+        data = {"book": {"id": self.book_id}}
+        self.set_cached_data(data)
+        return data
+
+    monkeypatch.setattr(Book, "fetch_book_data", fetch_book_data)
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(Book(book_id=30749).get_data()))
+        for _ in range(20)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [30749]
+    assert len(results) == 20
+    assert all(data == {"book": {"id": 30749}} for data, _ in results)
+
+
+def test_missing_book_is_not_retried_by_followers(local_caches, monkeypatch):
+    """
+    Test that followers share the leader's negative result instead of calling upstream
+    themselves.
+
+    Asserts:
+        - `fetch_book_data` is called exactly once.
+        - Every caller receives (None, None).
+    """
+    calls = []
+
+    def fetch_book_data(self):
+        calls.append(self.book_id)
+        time.sleep(0.2)
+        return None
+
+    monkeypatch.setattr(Book, "fetch_book_data", fetch_book_data)
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(Book(book_id=30).get_data()))
+        for _ in range(10)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [30]
+    assert results == [(None, None)] * 10
+
+
+def test_async_concurrent_misses_fetch_once(local_caches, monkeypatch):
+    """
+    Test that concurrent misses on the event loop send a single request upstream.
+
+    Asserts:
+        - `afetch_book_data` is called exactly once.
+        - Every coroutine receives the fetched data, from upstream.
+    """
+    calls = []
+
+    async def afetch_book_data(self):
+        calls.append(self.book_id)
+        await asyncio.sleep(0.2)
+        data = {"book": {"id": self.book_id}}
+        await self.aset_cached_data(data)
+        return data
+
+    monkeypatch.setattr(AsyncBook, "afetch_book_data", afetch_book_data)
+
+    async def fetch_all():
+        return await asyncio.gather(
+            *(AsyncBook(book_id=30749).aget_data() for _ in range(50))
+        )
+
+    results = asyncio.run(fetch_all())
+
+    assert calls == [30749]
+    assert results == [({"book": {"id": 30749}}, "upstream")] * 50
+
+
+def test_fill_runs_when_another_process_holds_the_lock_too_long(
+    local_caches, monkeypatch, settings
+):
+    """
+    Test that a caller waiting on another process' fill fetches the book itself once the
+    wait times out.
+
+    Asserts:
+        - The book is fetched and returned, sync and async, instead of being reported as
+          not found.
+        - The other process' lock is left in place: only its owner releases it.
+    """
+    settings.BOOK_FILL_WAIT_TIMEOUT = 0.1
+
+    def fetch_book_data(self):
+        self.entry = entries.wrap({"book": {"id": self.book_id}})
+
+    async def afetch_book_data(self):
+        fetch_book_data(self)
+
+    monkeypatch.setattr(Book, "fetch_book_data", fetch_book_data)
+    monkeypatch.setattr(AsyncBook, "afetch_book_data", afetch_book_data)
+    lock_cache = caches[settings.BOOK_FILL_LOCK_CACHE]
+    lock_cache.set("book-fill:5", "other-process")
+
+    assert Book(book_id=5).get_data() == ({"book": {"id": 5}}, "upstream")
+    assert asyncio.run(AsyncBook(book_id=5).aget_data()) == (
+        {"book": {"id": 5}},
+        "upstream",
+    )
+    assert not tiers.delete_if(settings.BOOK_FILL_LOCK_CACHE, "book-fill:5", "token")
+    assert lock_cache.get("book-fill:5") == "other-process"
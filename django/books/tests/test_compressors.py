@@ -0,0 +1,67 @@
+import pickle
+
+import pytest
+from django_redis.exceptions import CompressorError
+
+from .. import entries
+from ..compressors import BookCompressor, train_dictionary
+
+
+def serialized_entry(book_id, words=200):
+    data = {
+        "book": {"id": book_id, "description": " ".join(["کتاب", str(book_id)] * words)}
+    }
+    return pickle.dumps(entries.wrap(data), pickle.HIGHEST_PROTOCOL)
+
+
+def test_zlib_round_trip_and_threshold():
+    """
+    Test that large values are compressed with a version header, and small ones are
+    stored as is.
+
+    Asserts:
+        - A large value is stored smaller, starting with the format version, and
+          decompresses to itself.
+        - A value below the threshold is stored as is, and is reported as not
+          compressed.
+    """
+    compressor = BookCompressor({"COMPRESSOR_CODEC": "zlib", "COMPRESS_MIN_SIZE": 1024})
+    value = serialized_entry(1)
+    stored = compressor.compress(value)
+
+    assert len(stored) < len(value)
+    assert stored[:2] == b"\x01z"
+    assert compressor.decompress(stored) == value
+
+    small = pickle.dumps({"book": {"id": 1}}, pickle.HIGHEST_PROTOCOL)
+    assert compressor.compress(small) == small
+    with pytest.raises(CompressorError):
+        compressor.decompress(small)
+
+
+def test_values_stay_readable_across_codecs(tmp_path):
+    """
+    Test that changing the codec does not make stored values unreadable.
+
+    Asserts:
+        - Values stored with zlib or zstd (with a trained dictionary) are read by a
+          compressor set to "none".
+    """
+    pytest.importorskip("zstandard")
+    dictionary = tmp_path / "books.dict"
+    dictionary.write_bytes(
+        train_dictionary([serialized_entry(i, 20 + i % 50) for i in range(500)], 8192)
+    )
+    zstd = BookCompressor(
+        {"COMPRESSOR_CODEC": "zstd", "ZSTD_DICTIONARY": str(dictionary)}
+    )
+    zlib = BookCompressor({"COMPRESSOR_CODEC": "zlib"})
+    reader = BookCompressor(
+        {"COMPRESSOR_CODEC": "none", "ZSTD_DICTIONARY": str(dictionary)}
+    )
+    value = serialized_entry(7)
+
+    assert zstd.compress(value)[:2] == b"\x01s"
+    assert reader.decompress(zstd.compress(value)) == value
+    assert reader.decompress(zlib.compress(value)) == value
+    assert reader.compress(value) == value
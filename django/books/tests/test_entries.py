@@ -0,0 +1,331 @@
+import asyncio
+import copy
+import json
+import os
+import time
+
+import pytest
+import redis
+from django.core.cache import caches
+from django.test import RequestFactory
+from django.urls import reverse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from .. import entries, invalidation, tasks, upstream
+from ..classes import Book
+from ..views import AsyncGetBookData
+
+
+def test_entry_states(settings):
+    """
+    Test the soft and hard expiry of cache entries.
+
+    Asserts:
+        - An entry is fresh until its soft expiry, stale until its hard expiry, and
+          expired afterwards.
+        - Bare data cached before entries existed is stale, and None is missing.
+    """
+    settings.BOOK_SOFT_TTL = 10
+    settings.BOOK_HARD_TTL = 20
+    entry = entries.wrap({"book": {"id": 1}}, now=1000)
+
+    assert entries.state(entry, now=1005) == entries.FRESH
+    assert entries.state(entry, now=1015) == entries.STALE
+    assert entries.state(entry, now=1025) == entries.EXPIRED
+    assert entries.state({"book": {"id": 1}}) == entries.STALE
+    assert entries.state(None) == entries.MISSING
+
+
+def test_book_data_outlives_its_hard_expiry_in_the_tiers(settings, monkeypatch):
+    """
+    Test that the tiers keep book data, with the default settings, long enough for it to
+    be served as stale.
+
+    Asserts:
+        - Redis keeps the data past its hard expiry, and negative entries only until
+          theirs.
+        - The in-process tier still holds the data, as stale, after its own timeout and
+          the soft expiry, and as expired after the hard expiry.
+    """
+    redis_url = os.getenv("TEST_REDIS_URL", "redis://localhost:6379/15")
+    try:
+        redis.Redis.from_url(redis_url, socket_connect_timeout=0.5).flushdb()
+    except redis.RedisError:
+        pytest.skip(f"No Redis server at {redis_url}")
+    settings.CACHES = copy.deepcopy(settings.CACHES)
+    settings.CACHES["default"]["LOCATION"] = "test-keep-expired"
+    settings.CACHES["redis_cache"]["LOCATION"] = redis_url
+    settings.BOOK_INVALIDATION_CACHE = ""
+    now = time.time()
+    Book(book_id=1).set_cached_data({"book": {"id": 1}})
+    Book(book_id=2).set_cached_data(entries.wrap_negative(404))
+
+    assert caches["redis_cache"].ttl(1) > settings.BOOK_HARD_TTL
+    assert caches["redis_cache"].ttl(2) <= settings.BOOK_NOT_FOUND_TTL
+    monkeypatch.setattr(
+        time,
+        "time",
+        lambda: now + settings.BOOK_SOFT_TTL + settings.IN_MEMORY_CACHE_TIMEOUT,
+    )
+    assert entries.state(caches["default"].get(1)) == entries.STALE
+    monkeypatch.setattr(time, "time", lambda: now + settings.BOOK_HARD_TTL + 1)
+    assert entries.state(caches["default"].get(1)) == entries.EXPIRED
+    monkeypatch.undo()
+    caches["default"].clear()
+    redis.Redis.from_url(redis_url).flushdb()
+
+
+def test_stale_data_is_served_and_refreshed_once(local_caches, monkeypatch):
+    """
+    Test that stale data is served at once, with a single background refresh.
+
+    Asserts:
+        - The stale data is returned from the cache, and flagged as stale.
+        - The API is not called on the request path.
+        - `refresh_book_cache` is scheduled only once for repeated requests.
+    """
+    refreshes = []
+    monkeypatch.setattr(tasks.refresh_book_cache, "delay", refreshes.append)
+    monkeypatch.setattr(Book, "fetch_book_data", lambda self, store=True: 1 / 0)
+    caches["redis_cache"].set(
+        30749, entries.wrap({"book": {"id": 30749}}, now=time.time() - 7200)
+    )
+
+    for place in ("redis_cache", "default", "default"):
+        book = Book(book_id=30749)
+        assert book.get_data() == ({"book": {"id": 30749}}, place)
+        assert book.stale
+
+    assert refreshes == [30749]
+
+
+def test_expired_data_is_fetched_again(local_caches, monkeypatch):
+    """
+    Test that data past its hard expiry is not served.
+
+    Asserts:
+        - The data is fetched from upstream and is fresh.
+    """
+
+    def fetch_book_data(self, store=True):
+        self.set_cached_data({"new": 1})
+        return {"new": 1}
+
+    monkeypatch.setattr(Book, "fetch_book_data", fetch_book_data)
+    caches["default"].set(1, entries.wrap({"old": 1}, now=time.time() - 10 * 86400))
+
+    book = Book(book_id=1)
+    assert book.get_data() == ({"new": 1}, "upstream")
+    assert not book.stale
+
+
+def test_missing_book_is_answered_from_cache(local_caches, monkeypatch):
+    """
+    Test that a book the API did not find is answered from the cache until its negative
+    entry expires.
+
+    Asserts:
+        - The first request reaches the API; the second one does not.
+        - Both return no data, the second one from the first cache.
+        - Purging negative entries makes the next request reach the API again.
+    """
+    calls = []
+
+    class NotFound:
+        status_code = 404
+
+    def get(path):
+        calls.append(path)
+        return NotFound()
+
+    monkeypatch.setattr(upstream.get_client(), "get", get)
+
+    book = Book(book_id=30)
+    assert book.get_data() == (None, "upstream")
+    assert book.negative
+    book = Book(book_id=30)
+    assert book.get_data() == (None, "default")
+    assert book.negative
+    assert len(calls) == 1
+
+    for cache_name in local_caches:
+        book.delete_in_cache(cache_name, negative_only=True)
+    Book(book_id=30).get_data()
+    assert len(calls) == 2
+
+
+def test_api_error_does_not_replace_data(local_caches):
+    """
+    Test that a negative entry for an API error never replaces data that can still be
+    served.
+
+    Asserts:
+        - The stale data stays in the cache.
+    """
+    stale = entries.wrap({"book": {"id": 1}}, now=time.time() - 7200)
+    caches["default"].set(1, stale)
+
+    Book(book_id=1).set_in_cache("default", entries.wrap_negative(503))
+
+    assert caches["default"].get(1) == stale
+
+
+def test_rendered_entry_is_served_as_is(local_caches, monkeypatch, settings):
+    """
+    Test that a cache hit sends the stored JSON body without decoding or re-encoding it.
+
+    Asserts:
+        - The response body is the one rendered when the cache was filled.
+        - The stored body is never decoded on the request path.
+        - Entries holding Python objects are rendered like before.
+    """
+    settings.BOOK_RENDERED_ENTRIES = True
+    caches["default"].set(1, entries.wrap({"book": {"id": 1, "title": "کتاب"}}))
+    monkeypatch.setattr(entries.json, "loads", lambda *args, **kwargs: 1 / 0)
+
+    response = APIClient().get(reverse("get-book", kwargs={"book_id": 1}))
+
+    assert response.status_code == 200
+    assert response["Content-Type"] == "application/json"
+    assert response.content == caches["default"].get(1)["body"]
+    assert response.content == JSONRenderer().render(
+        {"book": {"id": 1, "title": "کتاب"}}
+    )
+
+    monkeypatch.undo()
+    settings.BOOK_RENDERED_ENTRIES = False
+    caches["default"].set(2, entries.wrap({"book": {"id": 2}}))
+    response = APIClient().get(reverse("get-book", kwargs={"book_id": 2}))
+    assert "body" not in caches["default"].get(2)
+    assert response.json() == {"book": {"id": 2}}
+
+
+def test_conditional_get_is_answered_from_stored_etag(
+    local_caches, monkeypatch, settings
+):
+    """
+    Test that the ETag stored with an entry answers conditional requests without
+    rendering the body.
+
+    Asserts:
+        - A hit returns the stored ETag, and a Cache-Control capped at
+          BOOK_CLIENT_MAX_AGE.
+        - A request with a matching If-None-Match gets a 304 with no body, and the body
+          is not rendered.
+        - A request with another ETag gets the full response.
+    """
+    settings.BOOK_CLIENT_MAX_AGE = 60
+    caches["default"].set(1, entries.wrap({"book": {"id": 1}}))
+    url = reverse("get-book", kwargs={"book_id": 1})
+
+    response = APIClient().get(url)
+    etag = response["ETag"]
+    assert etag == f'"{caches["default"].get(1)["etag"]}"'
+    assert response["Cache-Control"] == "public, max-age=60"
+
+    monkeypatch.setattr(entries, "render", lambda *args, **kwargs: 1 / 0)
+    response = APIClient().get(url, HTTP_IF_NONE_MATCH=f"W/{etag}")
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response["ETag"] == etag
+
+    monkeypatch.undo()
+    response = APIClient().get(url, HTTP_IF_NONE_MATCH='"other"')
+    assert response.status_code == 200
+    assert response.json() == {"book": {"id": 1}}
+
+
+def test_expired_data_is_served_while_api_is_unavailable(local_caches, monkeypatch):
+    """
+    Test that expired data is served as stale while the API's guard does not let
+    requests through.
+
+    Asserts:
+        - The expired data is served, as stale, from the cache that held it.
+        - The refresh task reports why the API is unavailable, and leaves the data in
+          place.
+    """
+
+    def get(path):
+        raise upstream.UpstreamUnavailable("the taaghche circuit breaker is open")
+
+    monkeypatch.setattr(upstream.get_client(), "get", get)
+    monkeypatch.setattr(Book, "schedule_refresh", lambda self: False)
+    caches["redis_cache"].set(
+        1, entries.wrap({"book": {"id": 1}}, now=time.time() - 2 * 86400)
+    )
+
+    response = APIClient().get(reverse("get-book", kwargs={"book_id": 1}))
+
+    assert response.status_code == 200
+    assert response.json() == {"book": {"id": 1}}
+    assert (response["data-origin"], response["data-stale"]) == ("redis_cache", "true")
+    assert entries.state(caches["default"].get(1)) == entries.STALE
+
+    assert tasks.refresh_book_cache(1) == {
+        "error": "Taaghche API is unavailable",
+        "status": 503,
+        "reason": "the taaghche circuit breaker is open",
+    }
+    assert entries.unwrap(caches["redis_cache"].get(1)) == {"book": {"id": 1}}
+
+
+def test_api_failures_are_not_answered_as_missing_books(
+    local_caches, monkeypatch, settings
+):
+    """
+    Test that a book the API could not answer for gets the status of the failure, not a
+    404.
+
+    Asserts:
+        - A failing API gives a 502, and its cached answer too.
+        - A guarded API gives a 503 with a Retry-After until the negative entry expires,
+          sync and async.
+        - A book the API did not find still gives a 404.
+        - A refresh that finds no book only writes to the requested caches, and notifies
+          the other processes.
+    """
+    failures = {
+        1: upstream.UpstreamError("connection reset"),
+        2: upstream.UpstreamUnavailable("breaker open"),
+    }
+
+    class NotFound:
+        status_code = 404
+
+    def get(path):
+        book_id = int(path.split("/")[-2])
+        if book_id in failures:
+            raise failures[book_id]
+        return NotFound()
+
+    monkeypatch.setattr(upstream.get_client(), "get", get)
+    settings.UPSTREAM_DEADLINE = 0
+
+    for attempt in ("upstream", "default"):
+        response = APIClient().get(reverse("get-book", kwargs={"book_id": 1}))
+        assert (response.status_code, response["data-negative"]) == (502, attempt)
+
+    response = APIClient().get(reverse("get-book", kwargs={"book_id": 2}))
+    assert response.status_code == 503
+    assert 0 < int(response["Retry-After"]) <= settings.BOOK_ERROR_TTL
+    request = RequestFactory().get("/api/book/2")
+    response = asyncio.run(AsyncGetBookData.as_view()(request, book_id=2))
+    assert (response.status_code, response["data-negative"]) == (503, "default")
+    assert json.loads(response.content) == {"error": "The book API is unavailable"}
+
+    response = APIClient().get(reverse("get-book", kwargs={"book_id": 3}))
+    assert (response.status_code, response.json()) == (404, {"error": "No book found"})
+
+    published = []
+    monkeypatch.setattr(
+        invalidation, "publish", lambda *args, **kwargs: published.append(args)
+    )
+    result = tasks.refresh_book_cache(4, update_in=["redis_cache"])
+    assert (result["status"], result["caches"]["redis_cache"]["written"]) == (404, 1)
+    assert (
+        entries.is_negative(caches["redis_cache"].get(4))
+        and caches["default"].get(4) is None
+    )
+    assert published == [(4, invalidation.SET)]
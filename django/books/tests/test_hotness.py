@@ -0,0 +1,122 @@
+import os
+import time
+
+import pytest
+import redis
+from django.core.cache import caches
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from .. import entries, hotness, tasks
+from ..classes import Book
+
+TEST_REDIS_URL = os.getenv("TEST_REDIS_URL", "redis://localhost:6379/15")
+
+
+@pytest.fixture
+def hot_caches(settings):
+    """
+    Fixture configuring an L1 tier and a Redis tier holding the hot books and the
+    invalidation bus, on TEST_REDIS_URL.
+
+    Skips the test if that Redis server is not reachable.
+    """
+    try:
+        redis.Redis.from_url(TEST_REDIS_URL, socket_connect_timeout=0.5).flushdb()
+    except redis.RedisError:
+        pytest.skip(f"No Redis server at {TEST_REDIS_URL}")
+
+    settings.CACHES = {
+        "default": {"BACKEND": "books.backends.L1Cache", "LOCATION": "test-hot-l1"},
+        "redis_cache": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": TEST_REDIS_URL,
+        },
+    }
+    settings.BOOK_HOT_CACHE = "redis_cache"
+    settings.BOOK_INVALIDATION_CACHE = "redis_cache"
+    settings.BOOK_INVALIDATION_STREAM = "test-book-invalidations"
+    with hotness.tracker.lock:
+        hotness.tracker.counts.clear()  # Lookups counted by other tests.
+    yield
+    caches["default"].clear()
+    caches["redis_cache"].clear()
+
+
+def test_hot_books_are_counted_and_decayed(hot_caches, settings):
+    """
+    Test that book lookups are counted towards the hot books, which decay and are listed
+    by the admin endpoint.
+
+    Asserts:
+        - The endpoint requires the bearer key, and lists the books by lookups, hottest
+          first.
+        - Decaying by one half-life halves the scores, and keeps only the
+          BOOK_HOT_TRACKED hottest books.
+    """
+    for book_id, lookups in ((1, 1), (2, 3), (3, 2)):
+        Book(book_id=book_id).set_cached_data({"id": book_id})
+        for _ in range(lookups):
+            Book(book_id=book_id).get_entry()
+    hotness.tracker.flush()
+
+    client = APIClient()
+    url = reverse("hot-books")
+    assert client.get(url).status_code == 401
+    response = client.get(
+        url, HTTP_AUTHORIZATION=f"Bearer {settings.CELERY_SECRET_KEY}"
+    )
+    assert response.json() == {
+        "books": [
+            {"book_id": 2, "score": 3.0},
+            {"book_id": 3, "score": 2.0},
+            {"book_id": 1, "score": 1.0},
+        ],
+        "tracked": 3,
+    }
+
+    settings.BOOK_HOT_TRACKED = 2
+    now = time.time()
+    assert hotness.decay(now) == 1.0
+    assert hotness.decay(now + settings.BOOK_HOT_HALF_LIFE) == 0.5
+    assert hotness.top(10) == [(2, 1.5), (3, 1.0)]
+
+
+def test_refresh_hot_books(hot_caches, settings, monkeypatch):
+    """
+    Test that the beat task refreshes the hot books about to go stale, and sends the
+    others to the L1 tiers.
+
+    Asserts:
+        - Books missing from Redis, or stale within BOOK_HOT_REFRESH_AHEAD seconds, are
+          refreshed.
+        - Books with a negative entry are left alone.
+        - The other hot books are published on the invalidation bus.
+    """
+    now = time.time()
+    cache = caches["redis_cache"]
+    cache.set(1, entries.wrap({"id": 1}, now=now))
+    cache.set(
+        2,
+        entries.wrap(
+            {"id": 2},
+            now=now - settings.BOOK_SOFT_TTL + settings.BOOK_HOT_REFRESH_AHEAD / 2,
+        ),
+    )
+    cache.set(4, entries.wrap_negative(404))
+    for book_id in (1, 2, 3, 4):
+        hotness.record(book_id, 5 - book_id)
+    hotness.tracker.flush()
+    refreshed = []
+    monkeypatch.setattr(tasks.refresh_books_cache, "delay", refreshed.append)
+
+    result = tasks.refresh_hot_books()
+
+    assert result == {"hot": 4, "refreshed": [2, 3], "renewed": 1}
+    assert refreshed == [[2, 3]]
+    messages = redis.Redis.from_url(TEST_REDIS_URL).xrange(
+        settings.BOOK_INVALIDATION_STREAM
+    )
+    assert [(fields[b"book_id"], fields[b"action"]) for _, fields in messages] == [
+        (b"1", b"set")
+    ]
@@ -0,0 +1,278 @@
+import asyncio
+import multiprocessing
+import pickle
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+import redis
+from django.core.cache import caches
+
+from .. import backends, entries, invalidation
+from ..classes import AsyncBook, Book
+
+TEST_REDIS_URL = os.getenv("TEST_REDIS_URL", "redis://localhost:6379/15")
+
+
+@pytest.fixture
+def bus_caches(settings):
+    """
+    Fixture configuring an L1 tier and a Redis tier carrying the invalidation bus, on
+    TEST_REDIS_URL.
+
+    Skips the test if that Redis server is not reachable.
+    """
+    try:
+        redis.Redis.from_url(TEST_REDIS_URL, socket_connect_timeout=0.5).flushdb()
+    except redis.RedisError:
+        pytest.skip(f"No Redis server at {TEST_REDIS_URL}")
+
+    settings.CACHES = {
+        "default": {"BACKEND": "books.backends.L1Cache", "LOCATION": "test-bus-l1"},
+        "redis_cache": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": TEST_REDIS_URL,
+        },
+    }
+    settings.BOOK_INVALIDATION_CACHE = "redis_cache"
+    settings.BOOK_INVALIDATION_STREAM = "test-book-invalidations"
+    yield
+    caches["default"].clear()
+    caches["redis_cache"].clear()
+
+
+def worker(ready, results):
+    """
+    Caches a book in this process' L1 tier, then reports how it changes after the
+    invalidations.
+    """
+    cache = caches["default"]
+    cache.set(7, entries.wrap({"version": 1}))
+    cache.set(8, entries.wrap({"version": 1}))
+    cache.set(9, entries.wrap({"version": 1}))
+    assert invalidation.start_listener().connected.wait(5)
+    ready.put(os.getpid())
+
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        replaced = (
+            entries.unwrap(cache.get(7))
+            == entries.unwrap(cache.get(9))
+            == {"version": 2}
+        )
+        evicted = cache.get(8) is None
+        if replaced and evicted:
+            results.put((os.getpid(), time.monotonic()))
+            return
+        time.sleep(0.001)
+    results.put((os.getpid(), None))
+
+
+def test_l1_changes_reach_every_worker(bus_caches):
+    """
+    Test that a change to the L1 tier of one process reaches the L1 tier of every other
+    worker process.
+
+    Asserts:
+        - Every worker replaces the updated books, set by the sync and the async views,
+          and evicts the deleted one.
+        - They all do so within a fraction of a second.
+    """
+    context = multiprocessing.get_context("fork")
+    ready, results = context.Queue(), context.Queue()
+    workers = [context.Process(target=worker, args=(ready, results)) for _ in range(3)]
+    for process in workers:
+        process.start()
+    for _ in workers:
+        ready.get(timeout=10)
+
+    start = time.monotonic()
+    Book(book_id=7).set_in_cache("default", {"version": 2})
+    Book(book_id=8).delete_in_cache("default")
+    asyncio.run(AsyncBook(book_id=9).aset_in_cache("default", {"version": 2}))
+
+    reports = [results.get(timeout=10) for _ in workers]
+    for process in workers:
+        process.join(timeout=10)
+
+    assert all(done is not None for _, done in reports)
+    assert max(done for _, done in reports) - start < 0.5
+
+
+class Payload:
+    """
+    A value running code when it is unpickled.
+    """
+
+    unpickled = False
+
+    def __reduce__(self):
+        return setattr, (Payload, "unpickled", True)
+
+
+def test_bus_entries_are_never_unpickled(local_caches, monkeypatch):
+    """
+    Test that the entries sent on the invalidation bus are read without pickle.
+
+    Asserts:
+        - An entry serialized for the bus replaces the book in the in-process tiers.
+        - A pickled entry is not unpickled, and evicts the book instead.
+        - The bus uses the codec of its Redis tier, and orjson instead of pickle.
+    """
+    entry = entries.wrap({"book": {"id": 1}})
+    invalidation.apply(
+        {
+            "book_id": "1",
+            "action": invalidation.SET,
+            "entry": invalidation.serializer().dumps(entry),
+        }
+    )
+    assert caches["default"].get("1") == entry
+
+    message = {
+        "book_id": "1",
+        "action": invalidation.SET,
+        "entry": pickle.dumps(Payload()),
+    }
+    invalidation.apply(message)
+    assert not Payload.unpickled
+    assert caches["default"].get("1") is None
+
+    for codec, expected in (("msgpack", "msgpack"), ("pickle", "orjson")):
+        # The options of a Redis bus tier, without connecting to one.
+        bus = SimpleNamespace(
+            client=SimpleNamespace(_options={"SERIALIZER_CODEC": codec})
+        )
+        monkeypatch.setattr(invalidation, "_bus_cache", lambda: bus)
+        assert invalidation.serializer().codec == expected
+
+
+def test_gaps_are_told_from_trimmed_messages_already_read():
+    """
+    Test that the listener only resyncs when messages it has not read were trimmed from
+    the stream.
+
+    Asserts:
+        - With Redis 7, which counts the messages added, trimming up to the last message
+          read is no gap.
+        - Older versions only tell that the last message read is not in the stream
+          anymore.
+    """
+    # Five messages 1-0 to 5-0 were published, and the first two trimmed.
+    info = {"length": 3, "entries-added": 5, "first-entry": (b"3-0", {})}
+    assert not invalidation._trimmed_after(info, "2-0", 2)
+    assert invalidation._trimmed_after(info, "1-0", 1)
+    assert not invalidation._trimmed_after(info, "4-0", 4)
+
+    del info["entries-added"]
+    assert invalidation._trimmed_after(info, "2-0", None)
+    assert not invalidation._trimmed_after(info, "3-0", None)
+
+
+def follower(results):
+    """
+    Reports which tiers this process applies the invalidations to, and applies one.
+    """
+    invalidation.apply(
+        {
+            "book_id": "7",
+            "action": invalidation.SET,
+            "entry": invalidation.serializer().dumps(entries.wrap(3)),
+        }
+    )
+    results.put(
+        (invalidation.applied_tiers(), entries.unwrap(caches["default"].get("7")))
+    )
+
+
+def test_shared_tier_invalidations_are_applied_once_per_host(settings, tmp_path):
+    """
+    Test that the invalidations of a tier shared by the processes of a host are applied
+    by one of them.
+
+    Asserts:
+        - The first process to apply a message leads, and updates the shared tier.
+        - Another process of the host does not apply them to the shared tier, nor clear
+          it after a gap.
+    """
+    settings.CACHES = {
+        "default": {
+            "BACKEND": "books.backends.SharedMemoryCache",
+            "LOCATION": str(tmp_path / "l1"),
+        },
+    }
+    settings.BOOK_INVALIDATION_CACHE = ""
+    invalidation.apply(
+        {
+            "book_id": "7",
+            "action": invalidation.SET,
+            "entry": invalidation.serializer().dumps(entries.wrap(2)),
+        }
+    )
+    assert invalidation.applied_tiers() == ["default"]
+    assert entries.unwrap(caches["default"].get("7")) == 2
+
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    child = context.Process(target=follower, args=(results,))
+    child.start()
+    assert results.get(timeout=10) == ([], 2)
+    child.join(timeout=10)
+
+
+def test_new_leader_applies_the_messages_its_predecessor_had_not(
+    bus_caches, settings, tmp_path
+):
+    """
+    Test that the process taking over a shared tier resumes from the last message its
+    previous leader applied.
+
+    Asserts:
+        - The messages published after that one are applied to the shared tier, and the
+          new leader saves how far.
+        - If the previous leader saved nothing, or some messages after its last one were
+          trimmed, the shared tier is cleared instead.
+    """
+    settings.CACHES = {
+        "default": {
+            "BACKEND": "books.backends.SharedMemoryCache",
+            "LOCATION": str(tmp_path / "l1"),
+        },
+        "redis_cache": settings.CACHES["redis_cache"],
+    }
+    stream = settings.BOOK_INVALIDATION_STREAM
+    shared = caches["default"]
+    applied = invalidation.publish(7, invalidation.SET, entries.wrap(1))
+    shared.set(7, entries.wrap(1))
+    shared.save_leader_state(*invalidation._stream_id(applied), -1)
+    last = invalidation.publish(7, invalidation.SET, entries.wrap(2))
+
+    listener = take_over(stream)
+    assert entries.unwrap(shared.get(7)) == 2
+    assert shared.leader_state()[:2] == invalidation._stream_id(last)
+    assert listener.resyncs == 0
+
+    # Nothing saved, as in a new file.
+    start, end = backends._LEADER_STATE_OFFSET, backends._SLOTS_OFFSET
+    shared._table.map[start:end] = bytes(end - start)
+    assert shared.leader_state() is None
+    assert take_over(stream).resyncs == 1
+    assert shared.get(7) is None
+
+    # The messages after the last one saved were trimmed.
+    shared.set(7, entries.wrap(2))
+    shared.save_leader_state(0, 0, -1)
+    assert take_over(stream).resyncs == 1
+    assert shared.get(7) is None
+
+
+def take_over(stream):
+    """
+    Connects a listener to the stream, and lets it take over the shared tiers, as a new
+    leader would.
+    """
+    listener = invalidation.Listener()
+    listener._connect(stream)
+    assert listener._tiers(stream) == ["default"]
+    return listener
@@ -0,0 +1,53 @@
+import json
+
+from django.core.cache import caches
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from config import settings_lean
+
+from .. import entries
+
+
+def test_book_api_works_with_lean_settings(local_caches, settings):
+    """
+    Test that the book endpoints work without the apps and middleware left out by the
+    lean settings.
+
+    Asserts:
+        - GET serves the cached book.
+        - PUT and DELETE are accepted with the bearer key, and refused without it.
+    """
+    for name in (
+        "INSTALLED_APPS",
+        "MIDDLEWARE",
+        "TEMPLATES",
+        "USE_I18N",
+        "REST_FRAMEWORK",
+    ):
+        setattr(settings, name, getattr(settings_lean, name))
+    caches["default"].set(1, entries.wrap({"book": {"id": 1}}))
+    client = APIClient()
+    url = reverse("get-book", kwargs={"book_id": 1})
+    authorization = f"Bearer {settings.CELERY_SECRET_KEY}"
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.json() == {"book": {"id": 1}}
+
+    data = {
+        "cache": "redis_cache",
+        "data": json.dumps({"book": {"id": 1, "new": True}}),
+    }
+    assert client.put(url, data).status_code == 401
+    response = client.put(url, data, HTTP_AUTHORIZATION=authorization)
+    assert response.json()["success"] is True
+    assert entries.unwrap(caches["redis_cache"].get(1)) == {
+        "book": {"id": 1, "new": True}
+    }
+
+    response = client.delete(
+        url, {"cache": "redis_cache"}, HTTP_AUTHORIZATION=authorization
+    )
+    assert response.json()["message"] == "Deleted data in redis_cache cache"
+    assert caches["redis_cache"].get(1) is None
@@ -0,0 +1,175 @@
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings as django_settings
+from django.core.cache import caches
+from django.urls import reverse
+from prometheus_client import REGISTRY, CollectorRegistry, multiprocess
+from rest_framework.test import APIClient
+
+from .. import entries, metrics, upstream
+from ..classes import Book
+
+
+class FakeResponse:
+    status_code = 200
+
+    def json(self):
+        return {"book": {"id": 1}}
+
+
+def sample(name, registry=REGISTRY, **labels):
+    return registry.get_sample_value(name, labels) or 0
+
+
+def test_lookups_fills_and_upstream_requests_are_recorded(local_caches, monkeypatch):
+    """
+    Test that a miss and a hit are recorded per tier, and exposed on /metrics.
+
+    Asserts:
+        - The miss is counted in every tier, and the hit in the first one.
+        - The fill, the API request and both writes are recorded.
+        - /metrics renders them in the Prometheus format, for authorized requests only.
+    """
+    monkeypatch.setattr(upstream.get_client(), "get", lambda path: FakeResponse())
+    metrics.recorder.flush()
+    before = {
+        "miss": sample("books_cache_lookups_total", cache="redis_cache", result="miss"),
+        "hit": sample("books_cache_lookups_total", cache="default", result="hit"),
+        "written": sample(
+            "books_cache_writes_total", cache="redis_cache", result="written"
+        ),
+        "fills": sample("books_fill_seconds_count"),
+        "upstream": sample("books_upstream_request_seconds_count", status="2xx"),
+        "hits": sample("books_request_seconds_count", origin="default", state="fresh"),
+    }
+
+    Book(book_id=1).get_data()
+    Book(book_id=1).get_data()
+    metrics.recorder.flush()
+
+    assert (
+        sample("books_cache_lookups_total", cache="redis_cache", result="miss")
+        == before["miss"] + 1
+    )
+    assert (
+        sample("books_cache_lookups_total", cache="default", result="hit")
+        == before["hit"] + 1
+    )
+    assert (
+        sample("books_cache_writes_total", cache="redis_cache", result="written")
+        == before["written"] + 1
+    )
+    assert sample("books_fill_seconds_count") == before["fills"] + 1
+    assert (
+        sample("books_upstream_request_seconds_count", status="2xx")
+        == before["upstream"] + 1
+    )
+    assert (
+        sample("books_request_seconds_count", origin="default", state="fresh")
+        == before["hits"] + 1
+    )
+
+    client = APIClient()
+    assert client.get(reverse("metrics")).status_code == 401
+    response = client.get(
+        reverse("metrics"),
+        HTTP_AUTHORIZATION=f"Bearer {django_settings.CELERY_SECRET_KEY}",
+    )
+    assert response.status_code == 200
+    assert response["Content-Type"].startswith("text/plain")
+    assert (
+        b'books_cache_lookups_total{cache="default",result="hit"}' in response.content
+    )
+
+
+def test_expired_and_negative_entries_are_not_counted_as_hits(
+    local_caches, monkeypatch
+):
+    """
+    Test that batch lookups count expired and negative entries apart from hits.
+
+    Asserts:
+        - Book data, expired data, a negative entry and a missing book are each counted
+          under their result.
+    """
+    monkeypatch.setattr(
+        Book, "_fetch_many", classmethod(lambda cls, book_ids, cache_names: {})
+    )
+    caches["default"].set(1, entries.wrap({"book": {"id": 1}}))
+    caches["default"].set(2, entries.wrap({"book": {"id": 2}}, now=time.time() - 10**6))
+    caches["default"].set(3, entries.wrap_negative(404))
+    metrics.recorder.flush()
+    results = ("hit", "expired", "negative", "miss")
+    before = {
+        result: sample("books_cache_lookups_total", cache="default", result=result)
+        for result in results
+    }
+
+    Book.get_many_entries([1, 2, 3, 4], ["default"])
+    metrics.recorder.flush()
+
+    for result in results:
+        assert (
+            sample("books_cache_lookups_total", cache="default", result=result)
+            == before[result] + 1
+        )
+
+
+def test_metrics_are_summed_across_processes(tmp_path):
+    """
+    Test that, with PROMETHEUS_MULTIPROC_DIR set, the samples of every process are
+    aggregated.
+
+    Asserts:
+        - The lookups counted by two separate processes are summed, including those
+          still buffered at exit.
+        - Each process wrote its own files.
+    """
+    env = {
+        **os.environ,
+        "PROMETHEUS_MULTIPROC_DIR": str(tmp_path),
+        "SECRET_KEY": "metrics-test",
+    }
+    script = (
+        "import django; django.setup(); "
+        "from books import metrics; metrics.lookup('default', 'hit', {count})"
+    )
+    for count in (3, 4):
+        subprocess.run(
+            [sys.executable, "-c", script.format(count=count)],
+            cwd=django_settings.BASE_DIR,
+            env=env,
+            check=True,
+        )
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=str(tmp_path))
+    assert (
+        sample("books_cache_lookups_total", registry, cache="default", result="hit")
+        == 7
+    )
+    assert (
+        len([name for name in os.listdir(tmp_path) if name.startswith("counter_")]) == 2
+    )
+
+
+def test_dead_processes_stop_exporting_their_gauges(tmp_path):
+    """
+    Test that the live gauges of a dead process are removed, and its counters kept.
+
+    Asserts:
+        - Only the live gauge files of the dead process are removed.
+    """
+    names = [
+        f"gauge_liveall_{metrics.process_name(123)}.db",
+        f"gauge_liveall_{metrics.process_name(456)}.db",
+        f"counter_{metrics.process_name(123)}.db",
+    ]
+    for name in names:
+        (tmp_path / name).touch()
+
+    metrics.mark_process_dead(123, str(tmp_path))
+    assert sorted(os.listdir(tmp_path)) == sorted(names[1:])
@@ -0,0 +1,117 @@
+import pytest
+from django.core.cache import caches
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from .. import entries, projections
+
+BOOK = {
+    "book": {
+        "id": 1,
+        "title": "کتاب",
+        "authors": [{"id": 7, "firstName": "نام", "lastName": "نویسنده"}],
+        "price": 10000,
+        "description": "متن طولانی",
+    },
+    "comments": [],
+}
+
+
+def test_parse_and_project():
+    """
+    Test that requested fields are normalized and projected from nested data, lists
+    included.
+
+    Asserts:
+        - Duplicates and fields covered by a requested parent are dropped, and the
+          fields are sorted.
+        - Fields inside a list apply to each item; missing fields are left out.
+        - Malformed fields are rejected.
+    """
+    assert projections.parse("") is None
+    assert projections.parse("book.title, comments,book.title,comments.text") == (
+        ("book", "title"),
+        ("comments",),
+    )
+
+    fields = projections.parse(
+        "book.title,book.authors.lastName,book.isbn,book.price.amount"
+    )
+    assert projections.project(BOOK, fields) == {
+        "book": {"title": "کتاب", "authors": [{"lastName": "نویسنده"}]}
+    }
+
+    with pytest.raises(ValueError):
+        projections.parse("book..title")
+
+
+def test_projection_is_cached_by_etag(local_caches, monkeypatch, settings):
+    """
+    Test that a frequently requested projection is stored rendered, and served with its
+    own ETag.
+
+    Asserts:
+        - Only the requested fields are sent, with an ETag of their own that answers
+          conditional requests.
+        - Once the fields were requested BOOK_PROJECTION_CACHE_AFTER times, the
+          projection is served from the cache without decoding the book data.
+        - New book data gets a new projection.
+        - Invalid fields get a 400.
+    """
+    settings.BOOK_PROJECTION_CACHE_AFTER = 2
+    monkeypatch.setattr(projections, "_requests", {})
+    caches["redis_cache"].set(1, entries.wrap(BOOK))
+    client = APIClient()
+    url = reverse("get-book", kwargs={"book_id": 1})
+
+    response = client.get(url, {"fields": "book.title,book.price"})
+    assert response.status_code == 200
+    assert response.json() == {"book": {"title": "کتاب", "price": 10000}}
+    assert response["ETag"] != f'"{caches["default"].get(1)["etag"]}"'
+    assert (
+        client.get(
+            url,
+            {"fields": "book.title,book.price"},
+            HTTP_IF_NONE_MATCH=response["ETag"],
+        ).status_code
+        == 304
+    )
+
+    with monkeypatch.context() as patch:
+        patch.setattr(projections, "project", lambda *args: 1 / 0)
+        assert (
+            client.get(url, {"fields": "book.price,book.title"}).content
+            == response.content
+        )
+
+    caches["default"].set(1, entries.wrap({"book": {**BOOK["book"], "price": 20000}}))
+    assert (
+        client.get(url, {"fields": "book.title,book.price"}).json()["book"]["price"]
+        == 20000
+    )
+
+    assert client.get(url, {"fields": "book."}).status_code == 400
+
+
+def test_get_books_view_with_fields(local_caches):
+    """
+    Test that the batch view projects the data of each book, and leaves books without
+    data empty.
+
+    Asserts:
+        - Every book with data only holds the requested fields.
+        - A book the API has no data for has no data.
+    """
+    caches["default"].set(1, entries.wrap(BOOK))
+    caches["default"].set(30, entries.wrap_negative(404))
+
+    response = APIClient().get(
+        reverse("get-books"), {"ids": "30,1", "fields": "book.id,book.title"}
+    )
+
+    assert response.status_code == 200
+    assert [book["data"] for book in response.json()["books"]] == [
+        None,
+        {"book": {"id": 1, "title": "کتاب"}},
+    ]
+    assert response.json()["books"][0]["data-negative"] == "default"
@@ -0,0 +1,88 @@
+import datetime
+import decimal
+import pickle
+
+import pytest
+from rest_framework.renderers import JSONRenderer
+
+from .. import entries
+from ..renderers import FastJSONRenderer
+from ..serializers import BookSerializer
+
+
+def test_codecs_round_trip_and_read_each_other(settings):
+    """
+    Test that every codec stores cache entries losslessly, and reads values stored with
+    the others.
+
+    Asserts:
+        - Rendered, data and negative entries are read back equal, with the rendered
+          body stored verbatim.
+        - Values stored with any codec are read by a serializer using another one.
+        - Pickled values are only read, and unsupported values only pickled, when pickle
+          is allowed.
+        - Values not produced by a serializer are read as missing.
+    """
+    values = [
+        entries.wrap({"book": {"id": 1, "title": "کتاب"}}),
+        entries.wrap_negative(404),
+        {"id": 1},
+        "token",
+    ]
+    settings.BOOK_RENDERED_ENTRIES = False
+    values.append(entries.wrap({"book": {"id": 2}}))
+    serializers = {
+        codec: BookSerializer({"SERIALIZER_CODEC": codec})
+        for codec in ("pickle", "orjson", "msgpack")
+    }
+
+    for codec, serializer in serializers.items():
+        for value in values:
+            stored = serializer.dumps(value)
+            assert all(
+                other.loads(stored) == value for other in serializers.values()
+            ), codec
+    assert values[0]["body"] in serializers["orjson"].dumps(values[0])
+
+    strict = BookSerializer(
+        {"SERIALIZER_CODEC": "orjson", "SERIALIZER_ALLOW_PICKLE": False}
+    )
+    assert strict.loads(pickle.dumps(values[0])) is None
+    assert strict.loads(b"Onot ours") is None
+    assert strict.loads(b"{}") is None
+    assert serializers["orjson"].loads(serializers["orjson"].dumps({1, 2})) == {1, 2}
+    with pytest.raises(TypeError):
+        strict.dumps({1, 2})
+
+
+def test_fast_renderer_matches_json_renderer():
+    """
+    Test that FastJSONRenderer renders the same bytes as DRF's JSONRenderer.
+
+    Asserts:
+        - Book data, line separators, dates, decimals, non-string keys and huge integers
+          render identically.
+        - Indented output is rendered like JSONRenderer does.
+    """
+    data = {
+        "book": {
+            "id": 1,
+            "title": "کتاب\u2028شماره\u2029",
+            "rating": 4.2,
+            "authors": [{"id": 7}],
+            "cover": None,
+        },
+        "published": datetime.datetime(
+            2024, 1, 2, 3, 4, 5, 678901, tzinfo=datetime.timezone.utc
+        ),
+        "date": datetime.date(2024, 1, 2),
+        "price": decimal.Decimal("10.50"),
+        1: "one",
+    }
+    slow, fast = JSONRenderer(), FastJSONRenderer()
+    assert fast.render(data) == slow.render(data)
+    assert fast.render({"id": 2**70}) == slow.render({"id": 2**70})
+    assert fast.render(None) == slow.render(None) == b""
+    assert fast.render(data, "application/json; indent=2") == slow.render(
+        data, "application/json; indent=2"
+    )
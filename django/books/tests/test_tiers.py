@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+from django.core.cache import caches
+
+from .. import entries, tiers
+from ..classes import AsyncBook, Book
+
+
+def test_write_reports_each_tier(local_caches, monkeypatch):
+    """
+    Test that writes report the acknowledged result of every tier, without reading the
+    data back.
+
+    Asserts:
+        - Every tier reports a successful write of the book.
+        - No tier is read while writing.
+        - A failing tier reports its error, without hiding the result of the other
+          tiers.
+    """
+    monkeypatch.setattr(caches["default"], "get", lambda *args, **kwargs: 1 / 0)
+    result = Book(book_id=1).set_cached_data({"book": {"id": 1}})
+
+    assert {
+        name: (tier["success"], tier["written"]) for name, tier in result.items()
+    } == {
+        "default": (True, 1),
+        "redis_cache": (True, 1),
+    }
+
+    monkeypatch.setattr(
+        caches["redis_cache"], "set_many", lambda *args, **kwargs: 1 / 0
+    )
+    result = Book(book_id=2).set_cached_data({"book": {"id": 2}})
+
+    assert result["default"]["success"]
+    assert not result["redis_cache"]["success"]
+    assert "ZeroDivisionError" in result["redis_cache"]["error"]
+
+
+def test_api_error_write_keeps_data(local_caches):
+    """
+    Test that a negative entry for an API error is acknowledged as not written where
+    data exists.
+
+    Asserts:
+        - The tier holding data reports no write and keeps its data, in both the sync
+          and async paths.
+        - The empty tier gets the negative entry.
+    """
+    stale = entries.wrap({"book": {"id": 1}}, now=time.time() - 7200)
+    caches["default"].set(1, stale)
+
+    result = Book(book_id=1).set_cached_data(entries.wrap_negative(503))
+    assert result["default"]["written"] == 0
+    assert result["redis_cache"]["written"] == 1
+
+    caches["redis_cache"].set(1, stale)
+    result = asyncio.run(
+        AsyncBook(book_id=1).aset_cached_data(entries.wrap_negative(503))
+    )
+    assert [tier["written"] for tier in result.values()] == [0, 0]
+    assert caches["default"].get(1) == caches["redis_cache"].get(1) == stale
+
+    assert tiers.write_many(["default"], {2: stale}, nx=True)["default"]["written"] == 1
@@ -0,0 +1,394 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import redis
+from django.core.cache import caches
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from .. import entries, invalidation, upstream
+from ..classes import Book
+from ..guard import Guard
+
+TEST_REDIS_URL = os.getenv("TEST_REDIS_URL", "redis://localhost:6379/15")
+
+
+class _BookHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    hits = 0
+
+    def do_GET(self):
+        _BookHandler.hits += 1
+        if self.path.startswith("/slow"):
+            time.sleep(0.5)
+        elif self.path.startswith("/v2/book/99/"):
+            time.sleep(0.4)
+        elif self.path.startswith("/late-once") and self.hits == 1:
+            time.sleep(0.15)
+        body = json.dumps({"book": {"id": 1}}).encode()
+        try:
+            if self.path.startswith("/fail"):
+                self.send_response(500)
+            elif self.path.startswith("/busy"):
+                self.send_response(503)
+            else:
+                self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client gave up waiting, as intended by the timeout test.
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def local_upstream(settings):
+    """
+    Fixture serving fake book data on a local port and pointing the Taaghche client at
+    it.
+
+    Returns:
+        str: The base URL of the local server.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _BookHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    settings.TAAGHCHE_API_URL = base_url
+    settings.UPSTREAM_READ_TIMEOUT = 0.2
+    settings.UPSTREAM_RETRIES = 0
+    settings.UPSTREAM_GUARD_CACHE = "default"
+    _BookHandler.hits = 0
+    upstream._clients.clear()
+    upstream._guards.clear()
+    upstream._latencies.clear()
+    yield base_url
+    upstream._clients.clear()
+    upstream._guards.clear()
+    upstream._latencies.clear()
+    server.shutdown()
+
+
+def test_connections_are_reused(local_upstream):
+    """
+    Test that consecutive requests share one keep-alive connection.
+
+    Asserts:
+        - Every request succeeds.
+        - The pool opened a single connection for all of them.
+    """
+    client = upstream.get_client()
+    for _ in range(5):
+        assert client.get("/v2/book/1/").json() == {"book": {"id": 1}}
+
+    stats = upstream.stats()["taaghche"]
+    assert stats["requests"] == 5
+    assert [pool["connections"] for pool in stats["pools"]] == [1]
+
+
+def test_http2_client_pool_is_bounded(local_upstream, settings):
+    """
+    Test that the httpx client opens at most UPSTREAM_POOL_SIZE connections.
+
+    Asserts:
+        - Concurrent requests beyond the pool size wait for a connection, and succeed.
+        - The pool reports its connections and size.
+    """
+    settings.UPSTREAM_HTTP2 = True
+    settings.UPSTREAM_POOL_SIZE = 2
+    settings.UPSTREAM_READ_TIMEOUT = 1
+    client = upstream.get_client()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        statuses = list(
+            executor.map(lambda _: client.get("/v2/book/99/").status_code, range(4))
+        )
+
+    assert statuses == [200] * 4
+    assert upstream.stats()["taaghche"]["pools"] == [
+        {"maxsize": 2, "connections": 2, "idle": 2}
+    ]
+
+
+def test_async_clients_are_closed_at_asgi_shutdown(local_upstream, monkeypatch):
+    """
+    Test that the ASGI application closes the async upstream clients when the server
+    shuts down.
+
+    Asserts:
+        - The lifespan events are acknowledged, and the invalidation listener is started
+          at startup.
+        - The session of the client is closed, and a new client is built afterwards.
+    """
+    from config import asgi
+
+    started = []
+    monkeypatch.setattr(invalidation, "start_listener", lambda: started.append(True))
+
+    async def serve():
+        client = upstream.get_async_client()
+        assert (await client.get("/v2/book/1/")).status_code == 200
+        messages = iter([{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}])
+        sent = []
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            sent.append(message["type"])
+
+        await asgi.application({"type": "lifespan"}, receive, send)
+        new_client = upstream.get_async_client()
+        await upstream.aclose_clients()
+        return client, sent, new_client
+
+    client, sent, new_client = asyncio.run(serve())
+    assert sent == [
+        "lifespan.startup.complete",
+        "lifespan.shutdown.complete",
+    ] and started == [True]
+    assert client.session.closed and new_client is not client
+
+
+def test_read_timeout_raises_upstream_error(local_upstream):
+    """
+    Test that a slow upstream fails fast with an UpstreamError instead of hanging the
+    worker.
+
+    Asserts:
+        - The request raises UpstreamError within the read timeout.
+        - The error is counted in the client statistics.
+    """
+    client = upstream.get_client()
+    start = time.monotonic()
+    with pytest.raises(upstream.UpstreamError):
+        client.get("/slow")
+    assert time.monotonic() - start < 0.5
+    assert client.stats()["errors"] == 1
+
+
+def test_circuit_breaker_opens_and_probes(local_upstream, settings):
+    """
+    Test that the circuit breaker opens when most requests fail, and lets a single probe
+    close it.
+
+    Asserts:
+        - Once enough requests failed, requests are rejected without being sent.
+        - After the open period, a successful probe closes the breaker.
+    """
+    settings.UPSTREAM_BREAKER_MIN_REQUESTS = 4
+    settings.UPSTREAM_BREAKER_OPEN_SECONDS = 0.2
+    client = upstream.get_client()
+    for _ in range(4):
+        assert client.get("/fail").status_code == 500
+
+    with pytest.raises(upstream.UpstreamUnavailable):
+        client.get("/v2/book/1/")
+    guard = upstream.guard_stats()["taaghche"]
+    assert (guard["state"], guard["rejected"], client.stats()["requests"]) == (
+        "open",
+        1,
+        4,
+    )
+
+    time.sleep(0.2)
+    assert upstream.guard_stats()["taaghche"]["state"] == "half-open"
+    assert client.get("/v2/book/1/").status_code == 200
+    assert upstream.guard_stats()["taaghche"]["state"] == "closed"
+
+
+def test_rate_limit(local_upstream, settings):
+    """
+    Test that requests beyond the rate limit wait for their turn, or are rejected if it
+    does not come in time.
+
+    Asserts:
+        - A burst is sent at once, and the next request waits for a token.
+        - Without waiting, the request is rejected and counted.
+    """
+    settings.UPSTREAM_RATE_LIMIT = 10
+    settings.UPSTREAM_RATE_BURST = 2
+    client = upstream.get_client()
+    start = time.monotonic()
+    for _ in range(3):
+        client.get("/v2/book/1/")
+    assert 0.05 < time.monotonic() - start < 0.5
+
+    settings.UPSTREAM_RATE_LIMIT_WAIT = 0
+    with pytest.raises(upstream.UpstreamUnavailable):
+        client.get("/v2/book/1/")
+    assert upstream.guard_stats()["taaghche"]["throttled"] == 1
+
+
+def test_retries_pass_the_guard(local_upstream, settings):
+    """
+    Test that retries of a request answered with 503 each take a token of the rate
+    limit.
+
+    Asserts:
+        - The request is sent UPSTREAM_RETRIES more times, and its last answer is
+          returned.
+        - The retries used up the burst, so the next request is rejected.
+    """
+    settings.UPSTREAM_RETRIES = 2
+    settings.UPSTREAM_BACKOFF_FACTOR = 0
+    settings.UPSTREAM_RATE_LIMIT = 0.1
+    settings.UPSTREAM_RATE_BURST = 3
+    settings.UPSTREAM_RATE_LIMIT_WAIT = 0
+    client = upstream.get_client()
+    assert client.get("/busy").status_code == 503
+    assert (_BookHandler.hits, client.stats()["requests"]) == (3, 3)
+
+    with pytest.raises(upstream.UpstreamUnavailable):
+        client.get("/v2/book/1/")
+    assert _BookHandler.hits == 3
+
+
+def test_late_requests_are_hedged_within_the_deadline(local_upstream, settings):
+    """
+    Test that a request not answered after the hedge delay is duplicated, and that the
+    deadline is enforced.
+
+    Asserts:
+        - A late request is answered by its duplicate, well before the first attempt
+          would have answered.
+        - The hedge delay becomes the 95th percentile of the observed latencies.
+        - A request not answered by its deadline raises UpstreamTimeout at the deadline,
+          handing over its attempts.
+    """
+    settings.UPSTREAM_HEDGE_DELAY = 0.03
+    client = upstream.get_client()
+    start = time.monotonic()
+    assert client.get_within("/late-once", time.monotonic() + 1).status_code == 200
+    assert time.monotonic() - start < 0.12
+    assert (client.stats()["hedging"]["hedges"], client.stats()["hedging"]["won"]) == (
+        1,
+        1,
+    )
+
+    for _ in range(upstream.LatencyTracker.MIN_SAMPLES):
+        client.latency.observe(0.01)
+    assert client.latency.delay() == 0.01
+
+    start = time.monotonic()
+    with pytest.raises(upstream.UpstreamTimeout) as error:
+        client.get_within("/slow", time.monotonic() + 0.1)
+    assert 0.1 <= time.monotonic() - start < 0.15
+    assert len(error.value.pending) == 2
+
+
+def test_deadline_serves_expired_data_or_504_and_caches_the_late_answer(
+    local_caches, local_upstream, settings, monkeypatch
+):
+    """
+    Test that a book the API does not answer in time is served expired data or a 504,
+    and cached once answered.
+
+    Asserts:
+        - With expired data in a tier, it is served as stale when the deadline is
+          reached.
+        - Without any, the view answers with a 504 at the deadline.
+        - The late answers of the API are cached, and served by the next request.
+    """
+    settings.UPSTREAM_READ_TIMEOUT = 1
+    settings.UPSTREAM_DEADLINE = 0.1
+    settings.UPSTREAM_HEDGE_MAX_RATIO = 0
+    monkeypatch.setattr(Book, "schedule_refresh", lambda self: True)
+    caches["redis_cache"].set(
+        99, entries.wrap({"book": {"id": 98}}, now=time.time() - 10**6), None
+    )
+    book = Book(book_id=99)
+    entry, place = book.get_entry()
+    assert (entries.unwrap(entry), place, book.stale) == (
+        {"book": {"id": 98}},
+        "redis_cache",
+        True,
+    )
+    time.sleep(0.5)
+    assert entries.unwrap(caches["redis_cache"].get(99)) == {"book": {"id": 1}}
+
+    for name in local_caches:
+        caches[name].clear()
+    start = time.monotonic()
+    response = APIClient().get(reverse("get-book", kwargs={"book_id": 99}))
+    assert response.status_code == 504 and time.monotonic() - start < 0.3
+
+    time.sleep(0.5)
+    entry, place = Book(book_id=99).get_entry()
+    assert (entries.unwrap(entry), place) == ({"book": {"id": 1}}, "default")
+
+
+def test_guard_state_is_shared_through_redis(settings):
+    """
+    Test that a breaker opened by one process is open for every process, when its state
+    is kept in Redis.
+
+    Asserts:
+        - A guard sees the breaker opened by another guard of the same service.
+        - Only one of them gets the half-open probe.
+    """
+    try:
+        redis.Redis.from_url(TEST_REDIS_URL, socket_connect_timeout=0.5).flushdb()
+    except redis.RedisError:
+        pytest.skip(f"No Redis server at {TEST_REDIS_URL}")
+    settings.CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "redis_cache": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": TEST_REDIS_URL,
+        },
+    }
+    settings.UPSTREAM_GUARD_CACHE = "redis_cache"
+    settings.UPSTREAM_BREAKER_MIN_REQUESTS = 2
+    settings.UPSTREAM_BREAKER_OPEN_SECONDS = 0.1
+    first, second = Guard("test"), Guard("test")
+
+    for _ in range(2):
+        first.after(first.before(), True, 0.01)
+    assert second.stats()["state"] == "open"
+    with pytest.raises(Exception):
+        second.before()
+
+    time.sleep(0.1)
+    assert second.before() is True
+    with pytest.raises(Exception):
+        first.before()
+    second.after(True, False, 0.01)
+    assert first.before() is False
+    caches["redis_cache"].clear()
+
+
+def test_guard_without_redis_lets_requests_through_and_logs_once(settings, caplog):
+    """
+    Test that a guard whose Redis tier is down lets requests through, and logs the
+    outage once.
+
+    Asserts:
+        - Requests are let through.
+        - A single warning is logged for the outage, and the guard reports it.
+    """
+    settings.CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "redis_cache": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": "redis://127.0.0.1:1/0",
+            "OPTIONS": {"SOCKET_CONNECT_TIMEOUT": 0.5},
+        },
+    }
+    settings.UPSTREAM_GUARD_CACHE = "redis_cache"
+    guard = Guard("down")
+    with caplog.at_level("WARNING", logger="books.guard"):
+        for _ in range(3):
+            assert guard.before() is False
+            guard.after(False, True, 0.01)
+
+    assert len(caplog.records) == 1
+    assert guard.stats()["available"] is False
@@ -0,0 +1,73 @@
+import io
+
+import pytest
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from .. import entries
+from ..classes import Book
+
+
+def test_warm_books_skips_cached_books_and_resumes(local_caches, monkeypatch, tmp_path):
+    """
+    Test that warm_books fetches the books missing from the caches, and resumes from its
+    checkpoint.
+
+    Asserts:
+        - Only books missing from the cache are fetched, and they are written to it.
+        - The checkpoint records the number of IDs handled, and a second run resumes
+          after them.
+        - A book the API fails for is reported as failed, not cached, and fails the
+          command.
+        - Invalid IDs stop the command with an error.
+    """
+    fetched = []
+
+    def fetch_book_data(self, store=True):
+        fetched.append(self.book_id)
+        if self.book_id == 5:
+            self.entry = entries.wrap_negative(502)
+            return None
+        self.entry = entries.wrap({"book": {"id": self.book_id}})
+        return {"book": {"id": self.book_id}}
+
+    monkeypatch.setattr(Book, "fetch_book_data", fetch_book_data)
+    caches["redis_cache"].set(2, entries.wrap({"book": {"id": 2}}))
+    ids_file = tmp_path / "ids.txt"
+    ids_file.write_text("1\n2\n# comment\n3\n\n4\n")
+    checkpoint = tmp_path / "checkpoint.json"
+    output = io.StringIO()
+
+    options = {
+        "cache": ["redis_cache"],
+        "batch_size": 2,
+        "checkpoint": str(checkpoint),
+        "stdout": output,
+    }
+    call_command("warm_books", file=str(ids_file), **options)
+
+    assert sorted(fetched) == [1, 3, 4]
+    assert sorted(caches["redis_cache"].get_many([1, 2, 3, 4])) == [1, 2, 3, 4]
+    assert (
+        "4 IDs handled (3 fetched, 0 not found, 0 failed, 1 skipped)"
+        in output.getvalue()
+    )
+
+    ids_file.write_text("1\n2\n3\n4\n5\n")
+    with pytest.raises(CommandError):
+        call_command("warm_books", file=str(ids_file), force=True, **options)
+    assert sorted(fetched) == [1, 3, 4, 5]
+    assert (
+        "5 IDs handled (0 fetched, 0 not found, 1 failed, 0 skipped)"
+        in output.getvalue()
+    )
+    assert caches["redis_cache"].get(5) is None
+
+    with pytest.raises(CommandError):
+        call_command("warm_books", range=[1, 1], stdout=output)
+    ids_file.write_text("1\nx\n")
+    with pytest.raises(CommandError):
+        call_command(
+            "warm_books", file=str(ids_file), cache=["redis_cache"], stdout=output
+        )
@@ -0,0 +1,560 @@
+import asyncio
+import weakref
+
+import redis.asyncio
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+from django_redis.cache import RedisCache
+
+from .backends import L1Cache, SharedMemoryCache
+from .clients import UNAVAILABLE, ShardedClient
+
+# Async Redis clients, one per event loop and cache name: their connections are bound to
+# the loop that opened them.
+_async_clients = weakref.WeakKeyDictionary()
+
+# Deletes KEYS[1] only if it holds ARGV[1], atomically: a lock is only released by its
+# owner, even once it expired.
+COMPARE_AND_DELETE = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# In-process backends never wait on I/O, so they are called directly from the event
+# loop. The shared-memory one counts as in-process: it is held in the memory of each
+# host, so changes made on other hosts reach it through the invalidation bus too.
+IN_PROCESS_BACKENDS = (LocMemCache, L1Cache, SharedMemoryCache)
+
+
+def is_redis(cache):
+    """
+    Tells whether a cache tier is served by django-redis.
+
+    Args:
+        cache: A Django cache backend instance.
+
+    Returns:
+        bool: True for django-redis caches, False otherwise.
+    """
+    return isinstance(cache, RedisCache)
+
+
+def redis_timeout_ms(cache, timeout=DEFAULT_TIMEOUT):
+    """
+    Converts a Django cache timeout into the PX argument of a Redis SET, the way
+    django-redis does.
+
+    Args:
+        cache: A django-redis cache backend instance.
+        timeout (float, optional): The timeout in seconds. Defaults to the cache's own
+            timeout.
+
+    Returns:
+        int: The timeout in milliseconds, or None if the key must not expire.
+    """
+    if timeout is DEFAULT_TIMEOUT:
+        timeout = cache.default_timeout
+    if timeout is None:
+        return None
+    return int(timeout * 1000)
+
+
+def redis_groups(cache, keys, write):
+    """
+    Groups keys by the Redis server to send them to: the server of their shard on
+    sharded tiers (see `clients.ShardedClient`), the primary or a replica of the tier
+    otherwise.
+
+    Args:
+        cache: A django-redis cache backend instance.
+        keys (list): The cache keys.
+        write (bool): Whether the keys are written.
+
+    Returns:
+        list: (server index, Redis client, keys) tuples. The keys of unreachable shards
+        come with None for the index and the client.
+    """
+    if isinstance(cache.client, ShardedClient):
+        return cache.client.group(keys, write)
+    client, index = cache.client.get_client(write=write, show_index=True)
+    return [(index, client, list(keys))]
+
+
+def redis_servers(cache, key, write):
+    """
+    Returns the Redis servers to send a command on a key to, in the order to try them.
+    See `redis_groups`.
+
+    Args:
+        cache: A django-redis cache backend instance.
+        key (str): The key, made with `make_key`.
+        write (bool): Whether the command writes.
+
+    Returns:
+        list: The indexes of the servers, empty if the shard of the key cannot be
+        reached.
+    """
+    if isinstance(cache.client, ShardedClient):
+        return cache.client.candidates(key, write)
+    return [0]
+
+
+def skip_server(cache, index, error):
+    """
+    Handles a failed command: an unreachable server of a sharded tier is skipped for a
+    while (see `clients.ShardedClient.mark_down`), while any other error is raised
+    again.
+
+    Args:
+        cache: A django-redis cache backend instance.
+        index (int): The index of the server.
+        error (Exception): The error of the command.
+    """
+    if not isinstance(cache.client, ShardedClient) or not isinstance(
+        error, UNAVAILABLE
+    ):
+        raise error
+    cache.client.mark_down(index, error)
+
+
+def _write_result(cache_name, written=0, error=None):
+    return {
+        "cache": cache_name,
+        "success": error is None,
+        "written": written,
+        "error": error,
+    }
+
+
+def write_many(cache_names, values, timeout=DEFAULT_TIMEOUT, nx=False):
+    """
+    Writes several keys to several cache tiers, trusting the write acknowledgements
+    instead of reading back.
+
+    Each Redis tier gets all its writes in one MULTI/EXEC pipeline per shard, i.e. a
+    single round-trip to each; other tiers get a single `set_many` (or one `add` per key
+    when `nx` is set). The writes to an unreachable shard are dropped and reported as an
+    error.
+
+    Args:
+        cache_names (list): The names of the cache tiers.
+        values (dict): The values to write, by cache key.
+        timeout (float, optional): The timeout in seconds. Defaults to each cache's own
+            timeout.
+        nx (bool, optional): Only write keys that do not exist yet. Defaults to False.
+
+    Returns:
+        dict: Each cache name mapped to its write result: `success` tells whether the
+        tier acknowledged the writes, `written` how many keys were actually written, and
+        `error` why the tier failed, if it did.
+    """
+    results = {}
+    for cache_name in cache_names:
+        cache = caches[cache_name]
+        errors = []
+        try:
+            if is_redis(cache):
+                written = 0
+                for index, client, keys in redis_groups(cache, values, write=True):
+                    if client is None:
+                        errors.append(f"No reachable Redis server for {len(keys)} keys")
+                        continue
+                    pipeline = client.pipeline(transaction=True)
+                    for key in keys:
+                        cache.client.set(
+                            key, values[key], timeout, client=pipeline, nx=nx
+                        )
+                    try:
+                        written += sum(1 for ack in pipeline.execute() if ack)
+                    except UNAVAILABLE as error:
+                        skip_server(cache, index, error)
+                        errors.append(repr(error))
+            elif nx:
+                written = sum(
+                    1 for key, value in values.items() if cache.add(key, value, timeout)
+                )
+            else:
+                written = len(values) - len(cache.set_many(values, timeout) or [])
+        except Exception as error:
+            results[cache_name] = _write_result(cache_name, error=repr(error))
+        else:
+            results[cache_name] = _write_result(
+                cache_name, written, "; ".join(errors) or None
+            )
+    return results
+
+
+def redis_url(cache, index=0):
+    """
+    Returns the URL of a server of a django-redis cache tier.
+
+    Args:
+        cache: A django-redis cache backend instance.
+        index (int, optional): The index of the server. Defaults to the primary server,
+            of the first shard on sharded tiers.
+
+    Returns:
+        str: The Redis URL.
+    """
+    # django-redis splits its comma separated list of servers, primary first; the
+    # sharded client lists the servers of every shard.
+    return list(cache.client._server)[index]
+
+
+def redis_options(cache):
+    """
+    Returns the connection options of a django-redis cache tier, as keyword arguments of
+    a redis-py client.
+
+    Clients opened outside of django-redis (the invalidation listener, the asyncio
+    clients) use them so that they authenticate, and give up on an unreachable server,
+    the way the tier's own clients do.
+
+    Args:
+        cache: A django-redis cache backend instance.
+
+    Returns:
+        dict: The password, socket timeouts and connection pool options of the tier.
+    """
+    options = cache.client._options
+    kwargs = dict(options.get("CONNECTION_POOL_KWARGS", {}))
+    for option, name in (
+        ("PASSWORD", "password"),
+        ("SOCKET_TIMEOUT", "socket_timeout"),
+        ("SOCKET_CONNECT_TIMEOUT", "socket_connect_timeout"),
+    ):
+        if options.get(option):
+            kwargs[name] = options[option]
+    return kwargs
+
+
+def existing(cache_name, keys):
+    """
+    Tells which keys a cache tier holds, with one round-trip on Redis and without
+    reading the values.
+
+    Args:
+        cache_name (str): The name of the cache tier.
+        keys (list): The cache keys.
+
+    Returns:
+        set: The keys that exist.
+    """
+    cache = caches[cache_name]
+    if is_redis(cache) and keys:
+        found = set()
+        for index, client, group in redis_groups(cache, keys, write=False):
+            if client is None:
+                continue
+            pipeline = client.pipeline(transaction=False)
+            for key in group:
+                pipeline.exists(cache.make_key(key))
+            try:
+                found.update(
+                    key for key, exists in zip(group, pipeline.execute()) if exists
+                )
+            except UNAVAILABLE as error:
+                skip_server(cache, index, error)
+        return found
+    return {key for key in keys if cache.has_key(key)}
+
+
+def delete_many(cache_names, keys):
+    """
+    Deletes several keys from several cache tiers, with one round-trip per Redis tier.
+    See `write_many`.
+
+    Args:
+        cache_names (list): The names of the cache tiers.
+        keys (list): The cache keys.
+
+    Returns:
+        dict: Each cache name mapped to its result: `success`, `deleted` (how many keys
+        existed) and `error`.
+    """
+    results = {}
+    for cache_name in cache_names:
+        cache = caches[cache_name]
+        result = {"cache": cache_name, "success": True, "deleted": 0, "error": None}
+        try:
+            if is_redis(cache) and keys:
+                errors = []
+                for index, client, group in redis_groups(cache, keys, write=True):
+                    if client is None:
+                        errors.append(
+                            f"No reachable Redis server for {len(group)} keys"
+                        )
+                        continue
+                    pipeline = client.pipeline(transaction=False)
+                    for key in group:
+                        pipeline.delete(cache.make_key(key))
+                    try:
+                        result["deleted"] += sum(pipeline.execute())
+                    except UNAVAILABLE as error:
+                        skip_server(cache, index, error)
+                        errors.append(repr(error))
+                if errors:
+                    result.update(success=False, error="; ".join(errors))
+            else:
+                result["deleted"] = sum(1 for key in keys if cache.delete(key))
+        except Exception as error:
+            result.update(success=False, error=repr(error))
+        results[cache_name] = result
+    return results
+
+
+def delete_if(cache_name, key, value):
+    """
+    Deletes a key from a cache tier only if it holds the given value, e.g. a lock
+    released by its owner.
+
+    On Redis tiers the comparison and the deletion run as one script, so a key that
+    expired and was set again by someone else in between is never deleted. Other tiers
+    are not shared between processes, and compare then delete.
+
+    Args:
+        cache_name (str): The name of the cache tier.
+        key: The cache key.
+        value: The value the key must hold.
+
+    Returns:
+        bool: True if the key was deleted.
+    """
+    cache = caches[cache_name]
+    if is_redis(cache):
+        [(index, client, _)] = redis_groups(cache, [key], write=True)
+        if client is None:
+            return False
+        try:
+            return bool(
+                client.eval(
+                    COMPARE_AND_DELETE,
+                    1,
+                    cache.make_key(key),
+                    cache.client.encode(value),
+                )
+            )
+        except UNAVAILABLE as error:
+            skip_server(cache, index, error)
+            return False
+    return cache.get(key) == value and cache.delete(key)
+
+
+def async_redis(cache_name, cache, index=0):
+    """
+    Returns the asyncio Redis client of a server of a django-redis cache tier, for the
+    running event loop.
+
+    Args:
+        cache_name (str): The name of the cache tier.
+        cache: The django-redis cache backend instance.
+        index (int, optional): The index of the server. See `redis_url`.
+
+    Returns:
+        redis.asyncio.Redis: The client.
+    """
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.setdefault(loop, {})
+    if (cache_name, index) not in clients:
+        clients[(cache_name, index)] = redis.asyncio.from_url(
+            redis_url(cache, index), **redis_options(cache)
+        )
+    return clients[(cache_name, index)]
+
+
+async def _on_server(cache_name, cache, key, write, command):
+    # Runs `command` with the asyncio client of each reachable server of the key in
+    # turn, like the sync client's `ShardedClient._on_shard`: an unreachable server is
+    # skipped (see `skip_server`) and the next one is tried. Returns the result of the
+    # command, or None if no server could run it.
+    for index in redis_servers(cache, key, write):
+        try:
+            return await command(async_redis(cache_name, cache, index))
+        except UNAVAILABLE as error:
+            skip_server(cache, index, error)
+    return None
+
+
+async def aget(cache_name, key):
+    """
+    Reads a key from a cache tier without blocking the event loop.
+
+    Redis tiers are read with a native asyncio client and decoded like django-redis
+    would; in-process tiers are read directly as they never wait on I/O; any other
+    backend goes through Django's `aget`.
+
+    Args:
+        cache_name (str): The name of the cache tier.
+        key: The cache key.
+
+    Returns:
+        The cached value, or None if the key is missing.
+    """
+    cache = caches[cache_name]
+    if is_redis(cache):
+        key = cache.make_key(key)
+        value = await _on_server(
+            cache_name, cache, key, False, lambda client: client.get(key)
+        )
+        return None if value is None else cache.client.decode(value)
+    if isinstance(cache, IN_PROCESS_BACKENDS):
+        return cache.get(key)
+    return await cache.aget(key)
+
+
+async def aset(cache_name, key, value, timeout=DEFAULT_TIMEOUT, nx=False):
+    """
+    Writes a key to a cache tier without blocking the event loop. See `aget`.
+
+    Args:
+        cache_name (str): The name of the cache tier.
+        key: The cache key.
+        value: The value to store.
+        timeout (float, optional): The timeout in seconds. Defaults to the cache's own
+            timeout.
+        nx (bool, optional): Only write the key if it does not exist yet. Defaults to
+            False.
+
+    Returns:
+        bool: True if the value was stored.
+    """
+    cache = caches[cache_name]
+    if is_redis(cache):
+        px = redis_timeout_ms(cache, timeout)
+        key = cache.make_key(key)
+        if px is not None and px <= 0:
+            if nx:
+                return False
+            return bool(
+                await _on_server(
+                    cache_name, cache, key, True, lambda client: client.delete(key)
+                )
+            )
+        value = cache.client.encode(value)
+        return bool(
+            await _on_server(
+                cache_name,
+                cache,
+                key,
+                True,
+                lambda client: client.set(key, value, px=px, nx=nx),
+            )
+        )
+    if isinstance(cache, IN_PROCESS_BACKENDS):
+        if nx:
+            return cache.add(key, value, timeout)
+        cache.set(key, value, timeout)
+        return True
+    if nx:
+        return await cache.aadd(key, value, timeout)
+    await cache.aset(key, value, timeout)
+    return True
+
+
+async def aadd(cache_name, key, value, timeout=DEFAULT_TIMEOUT):
+    """
+    Writes a key to a cache tier only if it does not exist yet. See `aset`.
+    """
+    return await aset(cache_name, key, value, timeout, nx=True)
+
+
+async def awrite_many(cache_names, values, timeout=DEFAULT_TIMEOUT, nx=False):
+    """
+    Writes several keys to several cache tiers without blocking the event loop. See
+    `write_many`.
+    """
+    results = {}
+    for cache_name in cache_names:
+        cache = caches[cache_name]
+        errors = []
+        try:
+            if is_redis(cache):
+                px = redis_timeout_ms(cache, timeout)
+                expired = px is not None and px <= 0
+                written = 0
+                # Like `aset`, already expired values delete their keys, unless they
+                # must not replace them.
+                groups = (
+                    [] if expired and nx else redis_groups(cache, values, write=True)
+                )
+                for index, _, keys in groups:
+                    if index is None:
+                        errors.append(f"No reachable Redis server for {len(keys)} keys")
+                        continue
+                    pipeline = async_redis(cache_name, cache, index).pipeline(
+                        transaction=True
+                    )
+                    for key in keys:
+                        if expired:
+                            pipeline.delete(cache.make_key(key))
+                        else:
+                            pipeline.set(
+                                cache.make_key(key),
+                                cache.client.encode(values[key]),
+                                px=px,
+                                nx=nx,
+                            )
+                    try:
+                        written += sum(1 for ack in await pipeline.execute() if ack)
+                    except UNAVAILABLE as error:
+                        skip_server(cache, index, error)
+                        errors.append(repr(error))
+            else:
+                written = 0
+                for key, value in values.items():
+                    written += bool(await aset(cache_name, key, value, timeout, nx=nx))
+        except Exception as error:
+            results[cache_name] = _write_result(cache_name, error=repr(error))
+        else:
+            results[cache_name] = _write_result(
+                cache_name, written, "; ".join(errors) or None
+            )
+    return results
+
+
+async def adelete(cache_name, key):
+    """
+    Deletes a key from a cache tier without blocking the event loop. See `aget`.
+
+    Returns:
+        bool: True if the key existed.
+    """
+    cache = caches[cache_name]
+    if is_redis(cache):
+        key = cache.make_key(key)
+        return bool(
+            await _on_server(
+                cache_name, cache, key, True, lambda client: client.delete(key)
+            )
+        )
+    if isinstance(cache, IN_PROCESS_BACKENDS):
+        return cache.delete(key)
+    return await cache.adelete(key)
+
+
+async def adelete_if(cache_name, key, value):
+    """
+    Deletes a key from a cache tier only if it holds the given value, without blocking
+    the event loop. See `delete_if`.
+
+    Returns:
+        bool: True if the key was deleted.
+    """
+    cache = caches[cache_name]
+    if is_redis(cache):
+        key, value = cache.make_key(key), cache.client.encode(value)
+        return bool(
+            await _on_server(
+                cache_name,
+                cache,
+                key,
+                True,
+                lambda client: client.eval(COMPARE_AND_DELETE, 1, key, value),
+            )
+        )
+    if isinstance(cache, IN_PROCESS_BACKENDS):
+        return cache.get(key) == value and cache.delete(key)
+    return await cache.aget(key) == value and await cache.adelete(key)
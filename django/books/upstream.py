@@ -0,0 +1,776 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent import futures
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import metrics
+from .guard import Guard, Rejected
+
+try:
+    import httpx
+except (
+    ImportError
+):  # HTTP/2 is optional and only available with httpx[http2] installed.
+    httpx = None
+
+try:
+    import aiohttp
+except ImportError:  # Only needed by the async view.
+    aiohttp = None
+
+
+class UpstreamError(Exception):
+    """
+    Raised when an upstream request fails before a response is received (connection
+    error, timeout...).
+    """
+
+
+class UpstreamUnavailable(UpstreamError):
+    """
+    Raised when an upstream request is not sent at all: its circuit breaker is open, or
+    its rate limit was reached.
+    """
+
+
+class UpstreamTimeout(UpstreamError):
+    """
+    Raised when a request got no answer within its latency budget. The attempts still
+    running are kept in `pending`: futures for UpstreamClient, tasks for
+    AsyncUpstreamClient.
+    """
+
+    def __init__(self, message, pending=()):
+        super().__init__(message)
+        self.pending = list(pending)
+
+
+class LatencyTracker:
+    """
+    Tracks the recent latencies of an upstream service, to tell when a request is late
+    enough to be hedged.
+
+    The hedge delay is the UPSTREAM_HEDGE_QUANTILE of the latencies of the last
+    UPSTREAM_HEDGE_WINDOW answers, recomputed every RECOMPUTE_EVERY answers, or
+    UPSTREAM_HEDGE_DELAY until MIN_SAMPLES answers were seen. Hedges are paid for with a
+    budget: each request adds UPSTREAM_HEDGE_MAX_RATIO of a hedge to it, up to
+    HEDGE_BURST, so that when the whole service slows down, before the quantile catches
+    up, hedging adds at most that share of requests instead of doubling its load.
+    """
+
+    MIN_SAMPLES = 20
+    RECOMPUTE_EVERY = 16
+    HEDGE_BURST = 10
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = deque(maxlen=settings.UPSTREAM_HEDGE_WINDOW)
+        self.threshold = None
+        self.unsorted = 0
+        self.budget = self.HEDGE_BURST
+        self.hedges = 0
+        self.won = 0
+
+    def observe(self, seconds):
+        """
+        Records how long an answer took.
+
+        Args:
+            seconds (float): The latency of the answer.
+        """
+        with self.lock:
+            self.samples.append(seconds)
+            self.unsorted += 1
+            if (
+                self.unsorted >= self.RECOMPUTE_EVERY
+                and len(self.samples) >= self.MIN_SAMPLES
+            ):
+                ordered = sorted(self.samples)
+                index = min(
+                    len(ordered) - 1,
+                    int(settings.UPSTREAM_HEDGE_QUANTILE * len(ordered)),
+                )
+                self.threshold = ordered[index]
+                self.unsorted = 0
+
+    def delay(self):
+        """
+        Returns how long a request may go unanswered before it is hedged, in seconds.
+        """
+        return (
+            settings.UPSTREAM_HEDGE_DELAY if self.threshold is None else self.threshold
+        )
+
+    def sent(self):
+        """
+        Records a request that may be hedged, adding to the hedge budget.
+        """
+        with self.lock:
+            self.budget = min(
+                self.HEDGE_BURST, self.budget + settings.UPSTREAM_HEDGE_MAX_RATIO
+            )
+
+    def take_hedge(self):
+        """
+        Takes a hedge from the budget.
+
+        Returns:
+            bool: Whether a hedge may be sent.
+        """
+        with self.lock:
+            if self.budget < 1 or not settings.UPSTREAM_HEDGE_MAX_RATIO:
+                return False
+            self.budget -= 1
+            self.hedges += 1
+        metrics.hedge("sent")
+        return True
+
+    def hedge_won(self):
+        """
+        Records a hedge answered before the request it duplicated.
+        """
+        with self.lock:
+            self.won += 1
+        metrics.hedge("won")
+
+    def stats(self):
+        """
+        Reports the hedge delay and how many hedges were sent and won.
+
+        Returns:
+            dict: The current delay in seconds, the number of latencies it is computed
+            from, and the hedges.
+        """
+        return {
+            "delay": self.delay(),
+            "samples": len(self.samples),
+            "hedges": self.hedges,
+            "won": self.won,
+        }
+
+
+def _discard(task):
+    # Retrieves the outcome of an abandoned task, so that asyncio does not log it as
+    # never retrieved.
+    if not task.cancelled():
+        task.exception()
+
+
+class UpstreamClient:
+    """
+    A pooled, keep-alive HTTP client for one upstream service.
+
+    Connections are reused across requests, every request has connect and read timeouts,
+    and idempotent requests are retried a bounded number of times with exponential
+    backoff. Requests may go through a Guard, which rate limits them and stops sending
+    them while the service is failing.
+    """
+
+    RETRY_STATUSES = (502, 503, 504)
+
+    def __init__(self, base_url, headers=None, http2=False, guard=None, latency=None):
+        """
+        Initializes the client and its connection pool.
+
+        Args:
+            base_url (str): The scheme and host every request path is appended to.
+            headers (dict, optional): Headers sent with every request.
+            http2 (bool, optional): Whether to use HTTP/2. Requires httpx[http2].
+                Defaults to False.
+            guard (Guard, optional): The rate limiter and circuit breaker of the
+                service. Defaults to None.
+            latency (LatencyTracker, optional): The latencies of the service, for
+                `get_within`. Defaults to a tracker of its own.
+        """
+        self.base_url = base_url.rstrip("/")
+        self.guard = guard
+        self.latency = latency if latency is not None else LatencyTracker()
+        self._executor = None
+        self.timeout = (
+            settings.UPSTREAM_CONNECT_TIMEOUT,
+            settings.UPSTREAM_READ_TIMEOUT,
+        )
+        self.http2 = http2
+        self.requests_sent = 0
+        self.errors = 0
+        self._counter_lock = threading.Lock()
+
+        if http2:
+            if httpx is None:
+                raise ImportError(
+                    "UPSTREAM_HTTP2 requires httpx[http2] to be installed"
+                )
+            # httpx ignores the client's limits when given a transport, so the pool is
+            # sized on the transport. Retries are left to `request`, so that they go
+            # through the guard.
+            self._transport = httpx.HTTPTransport(
+                http2=True,
+                limits=httpx.Limits(
+                    max_connections=settings.UPSTREAM_POOL_SIZE,
+                    max_keepalive_connections=settings.UPSTREAM_POOL_SIZE,
+                ),
+            )
+            self.session = httpx.Client(
+                http2=True,
+                headers=headers,
+                timeout=httpx.Timeout(
+                    settings.UPSTREAM_READ_TIMEOUT,
+                    connect=settings.UPSTREAM_CONNECT_TIMEOUT,
+                ),
+                transport=self._transport,
+            )
+        else:
+            self.session = requests.Session()
+            if headers:
+                self.session.headers.update(headers)
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=settings.UPSTREAM_POOL_SIZE,
+                # Retries are left to `request`, so that they go through the guard.
+                max_retries=0,
+            )
+            self.session.mount("http://", adapter)
+            self.session.mount("https://", adapter)
+
+    def request(self, method, path, **kwargs):
+        """
+        Sends a request to the upstream service.
+
+        Idempotent requests that fail, or are answered with one of RETRY_STATUSES, are
+        retried up to UPSTREAM_RETRIES times with exponential backoff. Every attempt
+        goes through the guard, so retries take a token of the rate limit too, and stop
+        as soon as the breaker opens.
+
+        Args:
+            method (str): The HTTP method.
+            path (str): The path, relative to the base URL.
+            **kwargs: Extra arguments for the underlying client (`data`, `headers`...).
+
+        Returns:
+            The response object, which has at least `status_code`, `text` and `json()`.
+
+        Raises:
+            UpstreamUnavailable: If the guard of the service did not let an attempt
+                through.
+            UpstreamError: If no response could be received.
+        """
+        retries = (
+            settings.UPSTREAM_RETRIES
+            if method.upper() in Retry.DEFAULT_ALLOWED_METHODS
+            else 0
+        )
+        for attempt in range(retries + 1):
+            try:
+                response = self._attempt(method, path, **kwargs)
+            except UpstreamUnavailable:
+                raise
+            except UpstreamError:
+                if attempt == retries:
+                    raise
+            else:
+                if (
+                    response.status_code not in self.RETRY_STATUSES
+                    or attempt == retries
+                ):
+                    return response
+            time.sleep(settings.UPSTREAM_BACKOFF_FACTOR * (2**attempt))
+
+    def _attempt(self, method, path, **kwargs):
+        # Sends a request once, through the guard. See `request`.
+        try:
+            probe = self.guard.before() if self.guard is not None else False
+        except Rejected as error:
+            raise UpstreamUnavailable(
+                f"{method} {self.base_url}{path} not sent: {error}"
+            ) from error
+
+        with self._counter_lock:
+            self.requests_sent += 1
+        start = time.monotonic()
+        try:
+            if self.http2:
+                response = self.session.request(method, self.base_url + path, **kwargs)
+            else:
+                response = self.session.request(
+                    method, self.base_url + path, timeout=self.timeout, **kwargs
+                )
+        except (requests.RequestException, *self._httpx_errors()) as error:
+            with self._counter_lock:
+                self.errors += 1
+            if self.guard is not None:
+                self.guard.after(probe, True, time.monotonic() - start)
+            raise UpstreamError(
+                f"{method} {self.base_url}{path} failed: {error}"
+            ) from error
+
+        elapsed = time.monotonic() - start
+        if self.guard is not None:
+            self.guard.after(probe, response.status_code >= 500, elapsed)
+        if response.status_code < 500:
+            self.latency.observe(elapsed)
+        return response
+
+    def get(self, path, **kwargs):
+        """
+        Sends a GET request to the upstream service. See `request`.
+        """
+        return self.request("GET", path, **kwargs)
+
+    def get_within(self, path, deadline, **kwargs):
+        """
+        Sends a GET request that must be answered before a deadline, hedged if it is
+        late.
+
+        The request is sent from a pool thread. If it has not been answered after the
+        hedge delay of the service (see `LatencyTracker`), one duplicate is sent, and
+        the first answer of either is returned. Attempts still running at the deadline
+        are not interrupted: they are handed over in the exception.
+
+        Args:
+            path (str): The path, relative to the base URL.
+            deadline (float): The `time.monotonic()` time by which an answer is needed.
+            **kwargs: Extra arguments for `request`.
+
+        Returns:
+            The response object. See `request`.
+
+        Raises:
+            UpstreamTimeout: If no answer arrived before the deadline.
+            UpstreamUnavailable, UpstreamError: If every attempt failed. See `request`.
+        """
+        if self._executor is None:
+            with self._counter_lock:
+                if self._executor is None:
+                    # Late attempts keep their thread until they are answered or time
+                    # out.
+                    self._executor = futures.ThreadPoolExecutor(
+                        max_workers=2 * settings.UPSTREAM_POOL_SIZE,
+                        thread_name_prefix="upstream",
+                    )
+        first = self._executor.submit(self.get, path, **kwargs)
+        pending, hedge, may_hedge = {first}, None, True
+        self.latency.sent()
+        hedge_at = time.monotonic() + self.latency.delay()
+        error = None
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                raise UpstreamTimeout(
+                    f"GET {self.base_url}{path} not answered in time", pending
+                )
+            until = min(deadline, hedge_at) if may_hedge else deadline
+            done, pending = futures.wait(
+                pending, until - now, return_when=futures.FIRST_COMPLETED
+            )
+            for attempt in done:
+                try:
+                    response = attempt.result()
+                except UpstreamError as failure:
+                    error = failure
+                    continue
+                if attempt is hedge:
+                    self.latency.hedge_won()
+                return response
+            if may_hedge and pending and time.monotonic() >= hedge_at:
+                may_hedge = False
+                if self.latency.take_hedge():
+                    hedge = self._executor.submit(self.get, path, **kwargs)
+                    pending.add(hedge)
+        raise error
+
+    def stats(self):
+        """
+        Reports the usage of this client and of its connection pools.
+
+        Returns:
+            dict: Request and error counts, plus one entry per host pool with its
+            connection usage.
+        """
+        return {
+            "base_url": self.base_url,
+            "transport": "httpx/http2" if self.http2 else "requests",
+            "requests": self.requests_sent,
+            "errors": self.errors,
+            "pools": self._pool_stats(),
+            "hedging": self.latency.stats(),
+        }
+
+    def _pool_stats(self):
+        if self.http2:
+            # The connections are only exposed by httpcore's pool, which httpx does not
+            # document: they are left out if it changes.
+            pool = getattr(self._transport, "_pool", None)
+            stats = {"maxsize": settings.UPSTREAM_POOL_SIZE}
+            connections = getattr(pool, "connections", None)
+            if connections is not None:
+                stats["connections"] = len(connections)
+                stats["idle"] = sum(
+                    1 for connection in connections if connection.is_idle()
+                )
+            return [stats]
+
+        pools = []
+        for adapter in dict.fromkeys(self.session.adapters.values()):
+            manager = adapter.poolmanager
+            for key in manager.pools.keys():
+                pool = manager.pools.get(key)
+                if pool is None:
+                    continue
+                pools.append(
+                    {
+                        "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                        "connections": pool.num_connections,
+                        "requests": pool.num_requests,
+                        "idle": pool.pool.qsize() if pool.pool is not None else 0,
+                        "maxsize": pool.pool.maxsize if pool.pool is not None else 0,
+                    }
+                )
+        return pools
+
+    @staticmethod
+    def _httpx_errors():
+        return (httpx.HTTPError,) if httpx is not None else ()
+
+
+class UpstreamResponse:
+    """
+    A fully read response of the async client, exposing the same basics as a `requests`
+    response.
+    """
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode()
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class AsyncUpstreamClient:
+    """
+    The asyncio counterpart of UpstreamClient, built on aiohttp.
+
+    Waiting on a response does not hold a thread, so one process can keep thousands of
+    requests in flight. HTTP/2 is not supported by aiohttp, so this client always speaks
+    HTTP/1.1 with keep-alive.
+    """
+
+    RETRY_STATUSES = UpstreamClient.RETRY_STATUSES
+
+    def __init__(self, base_url, headers=None, http2=False, guard=None, latency=None):
+        """
+        Initializes the client and its connection pool. Must be called from a running
+        event loop.
+
+        Args:
+            base_url (str): The scheme and host every request path is appended to.
+            headers (dict, optional): Headers sent with every request.
+            http2 (bool, optional): Ignored; accepted for compatibility with
+                UpstreamClient.
+            guard (Guard, optional): The rate limiter and circuit breaker of the
+                service. Defaults to None.
+            latency (LatencyTracker, optional): The latencies of the service. See
+                `UpstreamClient`.
+        """
+        if aiohttp is None:
+            raise ImportError(
+                "The async upstream client requires aiohttp to be installed"
+            )
+        self.base_url = base_url.rstrip("/")
+        self.guard = guard
+        self.latency = latency if latency is not None else LatencyTracker()
+        self.requests_sent = 0
+        self.errors = 0
+        self.connector = aiohttp.TCPConnector(limit=settings.UPSTREAM_ASYNC_POOL_SIZE)
+        self.session = aiohttp.ClientSession(
+            connector=self.connector,
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=settings.UPSTREAM_CONNECT_TIMEOUT,
+                sock_read=settings.UPSTREAM_READ_TIMEOUT,
+            ),
+        )
+
+    async def request(self, method, path, **kwargs):
+        """
+        Sends a request to the upstream service, with the same retry policy as
+        `UpstreamClient.request`.
+
+        Returns:
+            UpstreamResponse: The response, with its body already read.
+
+        Raises:
+            UpstreamUnavailable: If the guard of the service did not let an attempt
+                through.
+            UpstreamError: If no response could be received.
+        """
+        retries = (
+            settings.UPSTREAM_RETRIES
+            if method.upper() in Retry.DEFAULT_ALLOWED_METHODS
+            else 0
+        )
+        for attempt in range(retries + 1):
+            try:
+                response = await self._attempt(method, path, **kwargs)
+            except UpstreamUnavailable:
+                raise
+            except UpstreamError:
+                if attempt == retries:
+                    raise
+            else:
+                if (
+                    response.status_code not in self.RETRY_STATUSES
+                    or attempt == retries
+                ):
+                    return response
+            await asyncio.sleep(settings.UPSTREAM_BACKOFF_FACTOR * (2**attempt))
+
+    async def _attempt(self, method, path, **kwargs):
+        # Sends a request once, through the guard. See `request`.
+        url = self.base_url + path
+        try:
+            probe = await self.guard.abefore() if self.guard is not None else False
+        except Rejected as error:
+            raise UpstreamUnavailable(f"{method} {url} not sent: {error}") from error
+
+        self.requests_sent += 1
+        start = time.monotonic()
+        try:
+            async with self.session.request(method, url, **kwargs) as response:
+                content = await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            self.errors += 1
+            if self.guard is not None:
+                await self.guard.aafter(probe, True, time.monotonic() - start)
+            raise UpstreamError(f"{method} {url} failed: {error!r}") from error
+
+        elapsed = time.monotonic() - start
+        if self.guard is not None:
+            await self.guard.aafter(probe, response.status >= 500, elapsed)
+        if response.status < 500:
+            self.latency.observe(elapsed)
+        return UpstreamResponse(response.status, content)
+
+    async def get(self, path, **kwargs):
+        """
+        Sends a GET request to the upstream service. See `request`.
+        """
+        return await self.request("GET", path, **kwargs)
+
+    async def aclose(self):
+        """
+        Closes the session and its connections.
+        """
+        await self.session.close()
+
+    async def get_within(self, path, deadline, **kwargs):
+        """
+        Sends a GET request that must be answered before a deadline, hedged if it is
+        late. See `UpstreamClient.get_within`: attempts are tasks of the running event
+        loop instead of pool threads.
+        """
+        first = asyncio.ensure_future(self.get(path, **kwargs))
+        first.add_done_callback(_discard)
+        pending, hedge, may_hedge = {first}, None, True
+        self.latency.sent()
+        hedge_at = time.monotonic() + self.latency.delay()
+        error = None
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                raise UpstreamTimeout(
+                    f"GET {self.base_url}{path} not answered in time", pending
+                )
+            until = min(deadline, hedge_at) if may_hedge else deadline
+            done, pending = await asyncio.wait(
+                pending, timeout=until - now, return_when=asyncio.FIRST_COMPLETED
+            )
+            for attempt in done:
+                try:
+                    response = attempt.result()
+                except UpstreamError as failure:
+                    error = failure
+                    continue
+                if attempt is hedge:
+                    self.latency.hedge_won()
+                return response
+            if may_hedge and pending and time.monotonic() >= hedge_at:
+                may_hedge = False
+                if self.latency.take_hedge():
+                    hedge = asyncio.ensure_future(self.get(path, **kwargs))
+                    hedge.add_done_callback(_discard)
+                    pending.add(hedge)
+        raise error
+
+    def stats(self):
+        """
+        Reports the usage of this client. See `UpstreamClient.stats`.
+        """
+        idle = sum(len(connections) for connections in self.connector._conns.values())
+        in_use = len(self.connector._acquired)
+        return {
+            "base_url": self.base_url,
+            "transport": "aiohttp",
+            "requests": self.requests_sent,
+            "errors": self.errors,
+            "pools": [
+                {
+                    "connections": idle + in_use,
+                    "idle": idle,
+                    "maxsize": self.connector.limit,
+                }
+            ],
+            "hedging": self.latency.stats(),
+        }
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+_clients_pid = None
+# Async clients are bound to the event loop that created them.
+_async_clients = weakref.WeakKeyDictionary()
+_guards = {}
+_guards_lock = threading.Lock()
+_latencies = {}
+
+
+def get_guard(name="taaghche"):
+    """
+    Returns the guard (rate limiter and circuit breaker) of an upstream service, shared
+    by its sync and async clients.
+
+    Args:
+        name (str, optional): The name of the service. Only the Taaghche API is guarded.
+
+    Returns:
+        Guard: The guard of the service, or None if it has none (or UPSTREAM_GUARD_CACHE
+        is empty).
+    """
+    if name != "taaghche" or not settings.UPSTREAM_GUARD_CACHE:
+        return None
+    with _guards_lock:
+        if name not in _guards:
+            _guards[name] = Guard(name)
+        return _guards[name]
+
+
+def get_latency(name="taaghche"):
+    """
+    Returns the latency tracker of an upstream service, shared by its sync and async
+    clients. See `LatencyTracker`.
+
+    Args:
+        name (str, optional): The name of the service.
+
+    Returns:
+        LatencyTracker: The tracker of the service.
+    """
+    with _guards_lock:
+        if name not in _latencies:
+            _latencies[name] = LatencyTracker()
+        return _latencies[name]
+
+
+def _build_client(name, client_class=UpstreamClient):
+    if name == "taaghche":
+        return client_class(
+            settings.TAAGHCHE_API_URL,
+            headers={"User-Agent": "TaaghcheApplication/1.0", "accepts": "*/*"},
+            http2=settings.UPSTREAM_HTTP2,
+            guard=get_guard(name),
+            latency=get_latency(name),
+        )
+    if name == "internal":
+        return client_class(settings.INTERNAL_API_URL)
+    raise KeyError(f"Unknown upstream client {name!r}")
+
+
+def get_client(name="taaghche"):
+    """
+    Returns the shared client for an upstream service.
+
+    Clients are created once per process: connection pools cannot be shared safely
+    across a fork, so a process forked after creating them (e.g. a gunicorn or Celery
+    worker) gets its own.
+
+    Args:
+        name (str, optional): "taaghche" for the Taaghche API or "internal" for this
+            service's own API.
+
+    Returns:
+        UpstreamClient: The client for the service.
+    """
+    global _clients_pid
+    with _clients_lock:
+        if _clients_pid != os.getpid():
+            _clients.clear()
+            _clients_pid = os.getpid()
+        if name not in _clients:
+            _clients[name] = _build_client(name)
+        return _clients[name]
+
+
+def get_async_client(name="taaghche"):
+    """
+    Returns the shared async client for an upstream service, for the running event loop.
+
+    Args:
+        name (str, optional): "taaghche" for the Taaghche API or "internal" for this
+            service's own API.
+
+    Returns:
+        AsyncUpstreamClient: The client for the service.
+    """
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    if name not in clients:
+        clients[name] = _build_client(name, AsyncUpstreamClient)
+    return clients[name]
+
+
+async def aclose_clients():
+    """
+    Closes the async clients of the running event loop, e.g. when the ASGI server shuts
+    down.
+    """
+    for client in _async_clients.pop(asyncio.get_running_loop(), {}).values():
+        await client.aclose()
+
+
+def stats():
+    """
+    Reports the usage of every client created in this process.
+
+    Returns:
+        dict: Client names mapped to their `UpstreamClient.stats()`.
+    """
+    with _clients_lock:
+        clients = dict(_clients) if _clients_pid == os.getpid() else {}
+    result = {name: client.stats() for name, client in clients.items()}
+    for loop_clients in list(_async_clients.values()):
+        for name, client in loop_clients.items():
+            result[f"{name}-async"] = client.stats()
+    return result
+
+
+def guard_stats():
+    """
+    Reports the state of the guards of the upstream services. See `Guard.stats`.
+
+    Returns:
+        dict: Service names mapped to the state of their guard.
+    """
+    guard = get_guard()
+    return {guard.name: guard.stats()} if guard is not None else {}
@@ -1,4 +1,22 @@
+from django.conf import settings
 from django.urls import path
-from .views import GetBookData
+from .views import (
+    AsyncGetBookData,
+    CacheStatus,
+    GetBookData,
+    GetBooksData,
+    HotBooks,
+    Metrics,
+    UpstreamStatus,
+)
 
-urlpatterns = [path("api/book/<int:book_id>", GetBookData.as_view(), name="get-book")]
+book_view = AsyncGetBookData if settings.BOOK_ASYNC_VIEW else GetBookData
+
+urlpatterns = [
+    path("api/book/<int:book_id>", book_view.as_view(), name="get-book"),
+    path("api/books", GetBooksData.as_view(), name="get-books"),
+    path("api/upstream", UpstreamStatus.as_view(), name="upstream-status"),
+    path("api/cache", CacheStatus.as_view(), name="cache-status"),
+    path("api/hot", HotBooks.as_view(), name="hot-books"),
+    path("metrics", Metrics.as_view(), name="metrics"),
+]
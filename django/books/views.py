@@ -1,11 +1,143 @@
 import json
+import math
+import time
 
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.utils.http import parse_etags
+from django.views import View
 from rest_framework.views import APIView, Response, status
 from django.conf import settings
-from .classes import Book
+from django.core.cache import caches
+from .classes import AsyncBook, Book
+from . import entries
+from . import hotness
+from . import invalidation
+from . import metrics
+from . import projections
+from . import upstream
+from .renderers import FastJSONRenderer
 
 
-class GetBookData(APIView):
+class InternalAPIView(APIView):
+    """
+    Base API View for endpoints that may only be called by our own services (e.g. Celery
+    tasks).
+    """
+
+    NOT_ALLOWED_RESPONSE = Response(
+        {"error": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED
+    )
+
+    def is_allowed(self, request):
+        """
+        Verifies if the request is authorized by checking the secret key in the headers.
+
+        Args:
+            request: The HTTP request object.
+
+        Returns:
+            bool: True if authorized, False otherwise.
+        """
+        secret_key = request.headers.get("Authorization")
+        return secret_key == f"Bearer {settings.CELERY_SECRET_KEY}"
+
+
+def book_response(request, book, entry, place, projection=None):
+    """
+    Builds the response serving a cache entry of a book, for the sync and async views.
+
+    The stored JSON body is sent as is (see `entries.render`), with the entry's ETag and
+    a Cache-Control header letting clients reuse it while it is fresh, for at most
+    BOOK_CLIENT_MAX_AGE seconds. A request whose `If-None-Match` matches the stored ETag
+    is answered with a 304, without sending the body. When only some fields were
+    requested, their rendered projection is sent instead, with its own ETag.
+
+    Args:
+        request: The HTTP request object.
+        book (Book): The book the entry was retrieved by.
+        entry (dict): The servable cache entry.
+        place (str): The source of the entry ("upstream" or cache name).
+        projection (dict, optional): The projection of the entry to send (see
+            `projections.build`).
+
+    Returns:
+        HttpResponse: The response.
+    """
+    etag = f'"{projection["etag"]}"' if projection else entries.etag(entry)
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        body = projection["body"] if projection else entries.render(entry)
+        response = HttpResponse(body, content_type=FastJSONRenderer.media_type)
+
+    max_age = 0
+    if entries.is_entry(entry) and not book.stale:
+        max_age = max(
+            0, min(settings.BOOK_CLIENT_MAX_AGE, int(entry["soft"] - time.time()))
+        )
+    response["ETag"] = etag
+    response["Cache-Control"] = f"public, max-age={max_age}"
+    response["data-origin"] = place
+    response["data-stale"] = str(book.stale).lower()
+    return response
+
+
+def book_error(book, place):
+    """
+    Describes the error answering a book request that got no data to serve, for the sync
+    and async views.
+
+    Books the API has no data for are answered with a 404. When the API could not
+    answer, the status tells why, so that clients and shared caches do not take an
+    outage for a missing book: a 504 when it did not answer in time (see
+    `Book.start_deadline`), a 503 while its guard does not let requests through, with a
+    Retry-After until the negative entry expires, and a 502 when it failed. The
+    `data-negative` header tells where a cached answer came from.
+
+    Args:
+        book (Book): The book, after its entry was retrieved.
+        place (str): The source of the entry ("upstream" or cache name).
+
+    Returns:
+        tuple: The status code, the response data and the response headers.
+    """
+    headers = {"data-origin": None}
+    if not book.negative:
+        return (
+            status.HTTP_404_NOT_FOUND,
+            {"error": GetBookData.NOT_FOUND_ERROR},
+            headers,
+        )
+
+    headers["data-negative"] = place
+    status_code = book.entry["status"]
+    if status_code < 500:
+        return (
+            status.HTTP_404_NOT_FOUND,
+            {"error": GetBookData.NOT_FOUND_ERROR},
+            headers,
+        )
+    if status_code == status.HTTP_504_GATEWAY_TIMEOUT:
+        return status_code, {"error": GetBookData.TIMEOUT_ERROR}, headers
+    if status_code == status.HTTP_503_SERVICE_UNAVAILABLE:
+        headers["Retry-After"] = str(
+            max(1, math.ceil(book.entry["hard"] - time.time()))
+        )
+        return status_code, {"error": GetBookData.UNAVAILABLE_ERROR}, headers
+    return status.HTTP_502_BAD_GATEWAY, {"error": GetBookData.UPSTREAM_ERROR}, headers
+
+
+def _etag_matches(if_none_match, etag):
+    # If-None-Match uses the weak comparison: W/"x" matches "x".
+    candidates = [
+        candidate.removeprefix("W/") for candidate in parse_etags(if_none_match)
+    ]
+    return "*" in candidates or etag in candidates
+
+
+class GetBookData(InternalAPIView):
     """
     API View for handling book-related operations.
 
@@ -14,20 +146,30 @@ class GetBookData(APIView):
     """
 
     # Responses for common scenarios
+    NOT_FOUND_ERROR = "No book found"
     NOT_FOUND_RESPONSE = Response(
-        {"error": "No book found"},
+        {"error": NOT_FOUND_ERROR},
         headers={"data-origin": None},
         status=status.HTTP_404_NOT_FOUND,
     )
-    NOT_ALLOWED_RESPONSE = Response(
-        {"error": "Unauthorized"}, status=status.HTTP_401_UNAUTHORIZED
-    )
+    TIMEOUT_ERROR = "The book API did not answer in time"
+    UNAVAILABLE_ERROR = "The book API is unavailable"
+    UPSTREAM_ERROR = "The book API failed"
 
     def get(self, request, *args, **kwargs):
         """
         Handles GET requests to retrieve book data.
 
         Retrieves the book data either from the cache or from an upstream source if not cached.
+        The cached JSON body is sent as is, and conditional requests are answered from
+        its stored ETag (see `book_response`). The `data-stale` header tells whether
+        cached data is being served past its soft expiry. A book the API recently had no
+        data for is answered with a 404 from the cache, and the `data-negative` header
+        tells where that answer came from. A book the API could not answer for, with no
+        expired data to serve instead, is answered with a 502, 503 or 504 (see
+        `book_error`). The `fields` query parameter, e.g.
+        `?fields=book.title,book.coverUri`, limits the data to these fields (see
+        `projections.parse`).
 
         Args:
             request: The HTTP request object.
@@ -41,22 +183,30 @@ class GetBookData(APIView):
         if not book_id:
             return self.NOT_FOUND_RESPONSE
 
+        try:
+            fields = projections.parse(request.GET.get("fields"))
+        except ValueError as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
         book = Book(book_id=book_id)
-        data, place = book.get_data()
+        entry, place = book.get_entry()
 
-        if data:
-            return Response(data=data, headers={"data-origin": place})
-        else:
-            return self.NOT_FOUND_RESPONSE
+        if entries.state(entry) in entries.SERVABLE:
+            projection = projections.render(book_id, entry, fields) if fields else None
+            return book_response(request, book, entry, place, projection)
+        status_code, data, headers = book_error(book, place)
+        return Response(data, headers=headers, status=status_code)
 
     def delete(self, request, *args, **kwargs):
         """
         Handles DELETE requests to remove book data from the cache.
 
-        The request must be authorized with a valid secret key.
+        The request must be authorized with a valid secret key. If `negative_only` is
+        set in the body, only a negative entry is removed.
 
         Args:
-            request: The HTTP request object containing the `cache` name in the body.
+            request: The HTTP request object containing the `cache` name, and optionally
+                `negative_only`, in the body.
             *args: Additional arguments.
             **kwargs: Keyword arguments containing `book_id`.
 
@@ -78,7 +228,13 @@ class GetBookData(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        result = book.delete_in_cache(cache_name=cache_name)
+        negative_only = str(request.data.get("negative_only", "")).lower() in (
+            "1",
+            "true",
+        )
+        result = book.delete_in_cache(
+            cache_name=cache_name, negative_only=negative_only
+        )
         return Response({"success": True, "message": result})
 
     def put(self, request, *args, **kwargs):
@@ -86,6 +242,7 @@ class GetBookData(APIView):
         Handles PUT requests to update book data in the cache.
 
         The request must be authorized with a valid secret key and should contain the book data.
+        The response reports the write as acknowledged by the cache, under `result`.
 
         Args:
             request: The HTTP request object containing `data` and `cache` in the body.
@@ -118,17 +275,287 @@ class GetBookData(APIView):
 
         book = Book(book_id=book_id)
         result = book.set_in_cache(cache_name=cache, value=data)
-        return Response(data={"success": True, "message": result})
+        done = "set" if result["written"] else "not set"
+        return Response(
+            data={
+                "success": result["success"],
+                "message": f"Data for {book_id} {done} in {cache} cache",
+                "result": result,
+            }
+        )
 
-    def is_allowed(self, request):
+
+class GetBooksData(APIView):
+    """
+    API View for retrieving the data of several books in a single request.
+    """
+
+    renderer = FastJSONRenderer()
+
+    def get(self, request, *args, **kwargs):
         """
-        Verifies if the request is authorized by checking the secret key in the headers.
+        Handles GET requests to retrieve the data of several books.
+
+        The books are given as a comma separated `ids` query parameter, e.g.
+        `/api/books?ids=1,2,3`, and the `fields` query parameter limits the data of each
+        book to these fields, like for a single book. The stored JSON body of each book
+        (or its projection) is inserted in the response as is.
 
         Args:
             request: The HTTP request object.
 
         Returns:
-            bool: True if authorized, False otherwise.
+            HttpResponse: The JSON response listing each requested book, in the
+            requested order (a book requested twice is listed twice), with its data, the
+            source of the data and whether it is stale, or an error message. Books the
+            API has no data for have no data, and `data-negative` tells where that
+            answer came from.
         """
-        secret_key = request.headers.get("Authorization")
-        return secret_key == f"Bearer {settings.CELERY_SECRET_KEY}"
+        try:
+            book_ids = [
+                int(book_id)
+                for book_id in request.query_params.get("ids", "").split(",")
+            ]
+        except ValueError:
+            return Response(
+                {"error": "ids must be a comma separated list of book ids"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if len(book_ids) > settings.BOOK_BATCH_MAX_IDS:
+            return Response(
+                {"error": f"at most {settings.BOOK_BATCH_MAX_IDS} ids are allowed"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            fields = projections.parse(request.query_params.get("fields"))
+        except ValueError as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = Book.get_many_entries(book_ids)
+        servable = {
+            book_id: entry
+            for book_id, (entry, place) in results.items()
+            if entries.state(entry) in entries.SERVABLE
+        }
+        if fields:
+            bodies = {
+                book_id: projection["body"]
+                for book_id, projection in projections.render_many(
+                    servable, fields
+                ).items()
+            }
+        else:
+            bodies = {
+                book_id: entries.render(entry) for book_id, entry in servable.items()
+            }
+
+        books = []
+        for book_id in book_ids:
+            entry, place = results[book_id]
+            head = self.renderer.render(
+                {
+                    "id": book_id,
+                    "data-origin": None if entries.is_negative(entry) else place,
+                    "data-negative": place if entries.is_negative(entry) else None,
+                    "data-stale": entries.state(entry) == entries.STALE,
+                }
+            )
+            books.append(head[:-1] + b',"data":' + bodies.get(book_id, b"null") + b"}")
+        return HttpResponse(
+            b'{"books":[' + b",".join(books) + b"]}",
+            content_type=self.renderer.media_type,
+        )
+
+
+class AsyncGetBookData(View):
+    """
+    Async View for book-related operations, served by ASGI deployments instead of
+    GetBookData.
+
+    GET requests run on the event loop end to end, so a process can hold thousands of
+    in-flight cache misses. PUT and DELETE only come from Celery tasks and are delegated
+    to GetBookData in a worker thread.
+    """
+
+    renderer = FastJSONRenderer()
+    sync_view = staticmethod(GetBookData.as_view())
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Like APIView, this view is only called by API clients and authenticates with a
+        # bearer key.
+        view = super().as_view(**initkwargs)
+        view.csrf_exempt = True
+        return view
+
+    async def get(self, request, *args, **kwargs):
+        """
+        Handles GET requests to retrieve book data. See `GetBookData.get`.
+
+        Returns:
+            HttpResponse: The rendered book data, or an error (see `book_error`).
+        """
+        book_id = kwargs.get("book_id", None)
+        try:
+            fields = projections.parse(request.GET.get("fields"))
+        except ValueError as error:
+            return self._render({"error": str(error)}, status.HTTP_400_BAD_REQUEST)
+
+        book = AsyncBook(book_id=book_id)
+        entry, place = (None, None)
+        if book_id:
+            entry, place = await book.aget_entry()
+
+        if entries.state(entry) not in entries.SERVABLE:
+            status_code, data, headers = book_error(book, place)
+            response = self._render(data, status_code)
+            for header, value in headers.items():
+                response[header] = value
+            return response
+
+        projection = (
+            await projections.arender(book_id, entry, fields) if fields else None
+        )
+        return book_response(request, book, entry, place, projection)
+
+    async def put(self, request, *args, **kwargs):
+        """
+        Handles PUT requests by delegating them to GetBookData.
+        """
+        return await sync_to_async(self.sync_view)(request, *args, **kwargs)
+
+    async def delete(self, request, *args, **kwargs):
+        """
+        Handles DELETE requests by delegating them to GetBookData.
+        """
+        return await sync_to_async(self.sync_view)(request, *args, **kwargs)
+
+    def _render(self, data, status_code=status.HTTP_200_OK):
+        return HttpResponse(
+            self.renderer.render(data),
+            content_type=self.renderer.media_type,
+            status=status_code,
+        )
+
+
+class UpstreamStatus(InternalAPIView):
+    """
+    API View reporting the state of the upstream HTTP clients of the process that serves
+    the request.
+    """
+
+    def get(self, request, *args, **kwargs):
+        """
+        Handles GET requests to report upstream client and connection pool usage, and
+        the state of the rate limiter and circuit breaker of each guarded service (see
+        `Guard.stats`).
+
+        The request must be authorized with a valid secret key.
+
+        Returns:
+            Response: A Response object mapping each client name to its statistics, and
+            each guarded service to the state of its guard.
+        """
+        if not self.is_allowed(request):
+            return self.NOT_ALLOWED_RESPONSE
+
+        return Response({"clients": upstream.stats(), "guards": upstream.guard_stats()})
+
+
+class CacheStatus(InternalAPIView):
+    """
+    API View reporting the usage of the cache tiers of the process that serves the
+    request.
+    """
+
+    def get(self, request, *args, **kwargs):
+        """
+        Handles GET requests to report the counters of every cache tier that keeps them
+        (see `L1Cache.stats`), and the state of the invalidation listener (see
+        `invalidation.stats`).
+
+        The request must be authorized with a valid secret key.
+
+        Returns:
+            Response: A Response object mapping each cache name to its statistics.
+        """
+        if not self.is_allowed(request):
+            return self.NOT_ALLOWED_RESPONSE
+
+        return Response(
+            {
+                "caches": {
+                    cache_name: caches[cache_name].stats()
+                    for cache_name in settings.CACHES
+                    if hasattr(caches[cache_name], "stats")
+                },
+                "invalidation": invalidation.stats(),
+            }
+        )
+
+
+class HotBooks(InternalAPIView):
+    """
+    API View listing the hottest books, shared by every process (see `hotness`).
+    """
+
+    def get(self, request, *args, **kwargs):
+        """
+        Handles GET requests to list the hottest books with their decayed lookup counts,
+        hottest first.
+
+        The request must be authorized with a valid secret key. The number of books is
+        given by the `limit` query parameter, and defaults to BOOK_HOT_TOP_K (the books
+        kept cached by `refresh_hot_books`).
+
+        Returns:
+            Response: A Response object with the hot books and the number of books
+            tracked, or a 400 response if `limit` is not a positive integer.
+        """
+        if not self.is_allowed(request):
+            return self.NOT_ALLOWED_RESPONSE
+
+        try:
+            limit = int(request.GET.get("limit", settings.BOOK_HOT_TOP_K))
+            if limit <= 0:
+                raise ValueError
+        except ValueError:
+            return Response(
+                {"error": "limit must be a positive integer"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        return Response(
+            {
+                "books": [
+                    {"book_id": book_id, "score": round(score, 3)}
+                    for book_id, score in hotness.top(limit)
+                ],
+                "tracked": hotness.tracked(),
+            }
+        )
+
+
+class Metrics(InternalAPIView):
+    """
+    API View exposing the metrics of every process in the Prometheus text format, for
+    scraping.
+    """
+
+    def get(self, request, *args, **kwargs):
+        """
+        Handles GET requests to render the counters and histograms of the service (see
+        `metrics.render`).
+
+        The request must be authorized with a valid secret key (the bearer token of the
+        Prometheus job).
+
+        Returns:
+            HttpResponse: The metrics, aggregated across worker processes.
+        """
+        if not self.is_allowed(request):
+            return self.NOT_ALLOWED_RESPONSE
+
+        return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
@@ -13,4 +13,25 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once get_asgi_application has loaded the apps.
+from books import invalidation, upstream  # noqa: E402
+
+
+async def application(scope, receive, send):
+    """
+    Serves Django, starts the invalidation listener when the server starts, and closes
+    the async upstream clients when it shuts down (ASGI lifespan).
+    """
+    if scope["type"] != "lifespan":
+        return await django_application(scope, receive, send)
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            invalidation.start_listener()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await upstream.aclose_clients()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
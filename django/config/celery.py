@@ -25,6 +25,21 @@ app.conf.task_routes = {
         "routing_key": "books.refresh_cache",
         "queue": "cache_cleaner",
     },
+    "books.tasks.clear_books_cache": {
+        "exchange": "books",
+        "routing_key": "books.clear_caches",
+        "queue": "cache_cleaner",
+    },
+    "books.tasks.refresh_books_cache": {
+        "exchange": "books",
+        "routing_key": "books.refresh_caches",
+        "queue": "cache_cleaner",
+    },
+    "books.tasks.refresh_hot_books": {
+        "exchange": "books",
+        "routing_key": "books.refresh_hot",
+        "queue": "cache_cleaner",
+    },
 }
 
 
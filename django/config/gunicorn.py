@@ -0,0 +1,20 @@
+# config/gunicorn.py, loaded with `gunicorn -c config/gunicorn.py`.
+import os
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+
+
+def post_worker_init(worker):
+    # Each worker applies the invalidations of the other processes to its in-process
+    # tiers.
+    from books import invalidation
+
+    invalidation.start_listener()
+
+
+def child_exit(server, worker):
+    # The counters of a dead worker are still summed from PROMETHEUS_MULTIPROC_DIR, but
+    # its live gauges must not be exported anymore.
+    from books import metrics
+
+    metrics.mark_process_dead(worker.pid)
@@ -0,0 +1,42 @@
+"""
+Lean Django settings for the processes serving the book API.
+
+They extend the project settings, keeping only what the book endpoints use: no admin,
+auth, sessions, messages nor static files, and no middleware but SecurityMiddleware. The
+endpoints have no users: reads are anonymous, and PUT and DELETE (sent by the Celery
+tasks) are authenticated by the views themselves, with the bearer key CELERY_SECRET_KEY,
+so DRF is configured not to authenticate requests either. Select them with:
+
+    DJANGO_SETTINGS_MODULE=config.settings_lean gunicorn --bind 0.0.0.0:8000
+    config.wsgi:application
+
+benchmarks.profiles compares their request overhead and startup time with the project
+settings.
+"""
+
+from config.settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = [
+    "books",
+]
+
+# SecurityMiddleware only adds response headers (nosniff, referrer and cross-origin
+# opener policies).
+MIDDLEWARE = [
+    "django.middleware.security.SecurityMiddleware",
+]
+
+# Every response is JSON: no template is ever rendered.
+TEMPLATES = []
+
+# Error messages are not translated, so translation catalogs are never loaded.
+USE_I18N = False
+
+REST_FRAMEWORK = {
+    "DEFAULT_RENDERER_CLASSES": [
+        "books.renderers.FastJSONRenderer",
+    ],
+    "DEFAULT_AUTHENTICATION_CLASSES": [],
+    "DEFAULT_PERMISSION_CLASSES": [],
+    "UNAUTHENTICATED_USER": None,
+}
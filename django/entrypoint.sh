@@ -0,0 +1,12 @@
+#!/bin/sh
+# entrypoint.sh
+
+# Removes the sample files this host's processes left in PROMETHEUS_MULTIPROC_DIR
+# before a restart (see books/metrics.py): their pids are reused, and the files of the
+# other containers sharing the directory are kept.
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+    rm -f "$PROMETHEUS_MULTIPROC_DIR"/*_"$(hostname)"-[0-9]*.db
+fi
+
+exec "$@"